@@ -1,11 +1,565 @@
 import urllib.parse
-from sqlalchemy import create_engine
-from sqlalchemy.types import *
-from sqlalchemy import event
-import pyodbc
 import urllib
 import json
 import os
+import sys
+import atexit
+import bisect
+import collections
+import datetime
+import decimal
+import functools
+import threading
+import time
+import weakref
+
+try:
+    from .args_loader import load_args
+except ImportError:
+    from args_loader import load_args
+
+# pyodbc, SQLAlchemy, numpy, pandas og shapely importeres først, når de bruges, så korte scripts starter hurtigt.
+# SQLAlchemys typer (NVARCHAR, Integer osv.) kan stadig importeres herfra og hentes ved første opslag.
+_SQLALCHEMY_TYPES = (
+    'TypeEngine', 'TypeDecorator', 'UserDefinedType', 'ExternalType', 'INT', 'CHAR', 'VARCHAR', 'NCHAR',
+    'NVARCHAR', 'TEXT', 'Text', 'FLOAT', 'NUMERIC', 'REAL', 'DECIMAL', 'TIMESTAMP', 'DATETIME', 'CLOB', 'BLOB',
+    'BINARY', 'VARBINARY', 'BOOLEAN', 'BIGINT', 'SMALLINT', 'INTEGER', 'DATE', 'TIME', 'TupleType', 'String',
+    'Integer', 'SmallInteger', 'BigInteger', 'Numeric', 'Float', 'DateTime', 'Date', 'Time', 'LargeBinary',
+    'Boolean', 'Unicode', 'Concatenable', 'UnicodeText', 'PickleType', 'Interval', 'Enum', 'Indexable', 'ARRAY',
+    'JSON',
+)
+
+__all__ = ['ConnectionPool', 'StatementCache', 'DBConnect', 'AsyncDBConnect', 'StatistikSink', 'pool_stats',
+           'close_pools', 'flush_statistik', 'statistik_stats'] + list(_SQLALCHEMY_TYPES)
+
+
+def __getattr__(name):
+    if name in _SQLALCHEMY_TYPES:
+        import sqlalchemy.types
+        return getattr(sqlalchemy.types, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class StatementCache:
+    """
+    En LRU-afgrænset cache af forberedte SQL-sætninger for én forbindelse.
+
+    pyodbc genbruger en cursors forberedte sætning, når den samme SQL-tekst udføres igen på samme cursor.
+    Cachen holder derfor én cursor pr. SQL-tekst, så parameteriserede sætninger kun forberedes én gang pr.
+    forbindelse, og SQL Server kan genbruge planen. Den mindst brugte cursor lukkes, når cachen er fuld.
+
+    Attributter:
+    -----------
+    max_size : int
+        Det maksimale antal forberedte sætninger i cachen.
+    """
+
+    def __init__(self, cnxn, max_size=50, stats=None):
+        """
+        Initialiserer cachen.
+
+        Parametre:
+        ----------
+        cnxn : Connection
+            Forbindelsen, sætningerne forberedes på.
+        max_size : int, valgfri
+            Det maksimale antal forberedte sætninger (standard: 50).
+        stats : dict, valgfri
+            En ordbog med tællerne 'hits', 'misses' og 'evictions', der kan deles mellem flere caches.
+        """
+        self.max_size = max_size
+        self.__cnxn = cnxn
+        self.__cursors = collections.OrderedDict()
+        self.__stats = stats if stats is not None else {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def cursor(self, sql):
+        """
+        Returnerer den cursor, der har `sql` forberedt, og opretter en ny ved cache-miss.
+
+        Parametre:
+        ----------
+        sql : str
+            SQL-sætningen med `?`-parametre.
+
+        Returnerer:
+        -----------
+        Cursor
+            En cursor, der er reserveret til `sql`.
+        """
+        cursor = self.__cursors.get(sql)
+        if cursor is not None:
+            self.__cursors.move_to_end(sql)
+            self.__stats['hits'] += 1
+            return cursor
+        self.__stats['misses'] += 1
+        cursor = self.__cnxn.cursor()
+        self.__cursors[sql] = cursor
+        if len(self.__cursors) > self.max_size:
+            _, evicted = self.__cursors.popitem(last=False)
+            self.__stats['evictions'] += 1
+            try:
+                evicted.close()
+            except Exception:
+                pass
+        return cursor
+
+    def clear(self):
+        """
+        Lukker alle cursorer i cachen.
+        """
+        cursors, self.__cursors = self.__cursors, collections.OrderedDict()
+        for cursor in cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def statistics(self):
+        """
+        Returnerer cachens tællere.
+
+        Returnerer:
+        -----------
+        dict
+            Antal cache-hits (`hits`), cache-misses (`misses`), fjernede sætninger (`evictions`)
+            og aktuelt antal forberedte sætninger (`size`).
+        """
+        stats = dict(self.__stats)
+        stats['size'] = len(self.__cursors)
+        return stats
+
+
+# Sessionsindstillinger, der gendannes ved aflevering (pyodbc: autocommit, sqlite3: isolation_level)
+_SESSION_ATTRS = ('autocommit', 'isolation_level')
+
+
+class ConnectionPool:
+    """
+    En trådsikker, afgrænset pulje af genbrugelige databaseforbindelser.
+
+    Puljen opretter forbindelser via en fabriksfunktion (f.eks. `pyodbc.connect` eller `sqlite3.connect`),
+    udlåner dem med `checkout()` og modtager dem igen med `checkin()`. Forbindelser, der har ligget ubrugt
+    længere end `idle_timeout`, lukkes, og en udlånt forbindelse sundhedstjekkes med `SELECT 1`, før den
+    gives videre.
+
+    Attributter:
+    -----------
+    max_size : int
+        Det maksimale antal ledige forbindelser, puljen holder, og det antal forbindelser, den opretter
+        uden at regnes som overløb.
+    max_overflow : int eller None
+        Antal forbindelser ud over `max_size`, der må udlånes samtidigt. Overløbsforbindelser lukkes ved
+        aflevering, når puljen allerede har `max_size` ledige. Er grænsen nået, venter `checkout()` op til
+        `checkout_timeout`. `None` betyder ingen grænse.
+    idle_timeout : float
+        Antal sekunder en ledig forbindelse må ligge, før den lukkes.
+    checkout_timeout : float
+        Antal sekunder `checkout()` venter på en ledig forbindelse, før der kastes `TimeoutError`.
+    health_check : bool
+        Om en genbrugt forbindelse skal sundhedstjekkes ved udlån.
+    """
+
+    def __init__(self, factory, max_size=5, idle_timeout=300, checkout_timeout=30, health_check=True,
+                 statement_cache_size=50, max_overflow=10):
+        """
+        Initialiserer puljen.
+
+        Parametre:
+        ----------
+        factory : callable
+            En funktion uden argumenter, der returnerer en ny DB-API-forbindelse.
+        max_size : int, valgfri
+            Det maksimale antal forbindelser i puljen (standard: 5).
+        idle_timeout : float, valgfri
+            Sekunder før en ledig forbindelse lukkes (standard: 300).
+        checkout_timeout : float, valgfri
+            Sekunder `checkout()` venter på en ledig forbindelse (standard: 30).
+        health_check : bool, valgfri
+            Sundhedstjek af genbrugte forbindelser ved udlån (standard: True).
+        statement_cache_size : int, valgfri
+            Det maksimale antal forberedte sætninger pr. forbindelse (standard: 50).
+        max_overflow : int, valgfri
+            Antal forbindelser ud over `max_size`, der må udlånes samtidigt (standard: 10). Når grænsen er nået,
+            venter `checkout()` op til `checkout_timeout`. `None` fjerner grænsen.
+        """
+        self.max_size = max_size
+        self.max_overflow = max_overflow
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+        self.statement_cache_size = statement_cache_size
+        self.__factory = factory
+        self.__caches = {}
+        self.__session_defaults = {}
+        self.__statement_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.__idle = []
+        self.__in_use = 0
+        self.__cond = threading.Condition()
+        self.__stats = {'checkouts': 0, 'checkins': 0, 'waits': 0, 'creates': 0, 'overflows': 0,
+                        'evictions': 0, 'failed_health_checks': 0}
+
+    def checkout(self):
+        """
+        Låner en forbindelse fra puljen. Genbruger den senest afleverede ledige forbindelse og opretter
+        ellers en ny. Er `max_size` + `max_overflow` forbindelser udlånt, venter den på, at en afleveres.
+
+        Returnerer:
+        -----------
+        Connection
+            En åben DB-API-forbindelse.
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+        with self.__cond:
+            self.__evict_idle()
+            self.__stats['checkouts'] += 1
+            while True:
+                if self.__idle:
+                    cnxn = self.__idle.pop()[0]
+                    break
+                if self.max_overflow is None or self.__in_use < self.max_size + self.max_overflow:
+                    cnxn = None
+                    if self.__in_use >= self.max_size:
+                        self.__stats['overflows'] += 1
+                    break
+                if not waited:
+                    waited = True
+                    self.__stats['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.__cond.wait(remaining):
+                    raise TimeoutError(f'No free connection in pool after {self.checkout_timeout} seconds')
+            self.__in_use += 1
+
+        # Sundhedstjek og oprettelse sker uden for låsen, så andre tråde ikke blokeres af netværkskald
+        if cnxn is not None and self.health_check and not self.__is_alive(cnxn):
+            with self.__cond:
+                self.__stats['failed_health_checks'] += 1
+            self.__close(cnxn)
+            cnxn = None
+        if cnxn is None:
+            try:
+                cnxn = self.__factory()
+            except Exception:
+                with self.__cond:
+                    self.__in_use -= 1
+                    self.__cond.notify()
+                raise
+            # Forbindelsens oprindelige sessionsindstillinger, som `checkin()` gendanner
+            defaults = {attr: getattr(cnxn, attr) for attr in _SESSION_ATTRS if hasattr(cnxn, attr)}
+            with self.__cond:
+                self.__stats['creates'] += 1
+                self.__session_defaults[id(cnxn)] = defaults
+        return cnxn
+
+    def checkin(self, cnxn):
+        """
+        Afleverer en forbindelse til puljen. En eventuel åben transaktion rulles tilbage, og ændrede
+        sessionsindstillinger som `autocommit` gendannes, så næste låner får en ren forbindelse. Har puljen
+        allerede `max_size` ledige forbindelser, lukkes forbindelsen i stedet.
+
+        Parametre:
+        ----------
+        cnxn : Connection
+            Forbindelsen, der tidligere er lånt med `checkout()`.
+        """
+        with self.__cond:
+            defaults = self.__session_defaults.get(id(cnxn), {})
+        try:
+            cnxn.rollback()
+            for attr, value in defaults.items():
+                if getattr(cnxn, attr) != value:
+                    setattr(cnxn, attr, value)
+        except Exception:
+            self.discard(cnxn)
+            return
+        with self.__cond:
+            self.__in_use -= 1
+            self.__stats['checkins'] += 1
+            full = len(self.__idle) >= self.max_size
+            if not full:
+                self.__idle.append((cnxn, time.monotonic()))
+            self.__cond.notify()
+        if full:
+            self.__close(cnxn)
+
+    def discard(self, cnxn):
+        """
+        Lukker en udlånt forbindelse i stedet for at aflevere den, f.eks. efter en netværksfejl.
+
+        Parametre:
+        ----------
+        cnxn : Connection
+            Forbindelsen, der skal kasseres.
+        """
+        self.__close(cnxn)
+        with self.__cond:
+            self.__in_use -= 1
+            self.__cond.notify()
+
+    def close(self):
+        """
+        Lukker alle ledige forbindelser. Udlånte forbindelser lukkes ikke, men kan stadig afleveres.
+        """
+        with self.__cond:
+            idle, self.__idle = self.__idle, []
+        for cnxn, _ in idle:
+            self.__close(cnxn)
+
+    def statement_cache(self, cnxn):
+        """
+        Returnerer cachen af forberedte sætninger for en forbindelse fra puljen. Cachen følger forbindelsen,
+        så sætningerne genbruges på tværs af udlån, og nedlægges, når forbindelsen lukkes.
+
+        Parametre:
+        ----------
+        cnxn : Connection
+            En forbindelse lånt fra puljen.
+
+        Returnerer:
+        -----------
+        StatementCache
+            Forbindelsens cache.
+        """
+        with self.__cond:
+            cache = self.__caches.get(id(cnxn))
+            if cache is None:
+                cache = StatementCache(cnxn, self.statement_cache_size, self.__statement_stats)
+                self.__caches[id(cnxn)] = cache
+        return cache
+
+    def statistics(self):
+        """
+        Returnerer puljens tællere.
+
+        Returnerer:
+        -----------
+        dict
+            Antal udlån (`checkouts`), afleveringer (`checkins`), udlån der måtte vente (`waits`),
+            oprettede forbindelser (`creates`), udlån ud over `max_size` (`overflows`), lukkede ledige forbindelser (`evictions`),
+            fejlede sundhedstjek (`failed_health_checks`), aktuelt udlånte (`in_use`) og ledige (`idle`)
+            samt hits og misses i cachen af forberedte sætninger (`statement_hits`, `statement_misses`).
+        """
+        with self.__cond:
+            stats = dict(self.__stats)
+            stats['in_use'] = self.__in_use
+            stats['idle'] = len(self.__idle)
+            stats['statement_hits'] = self.__statement_stats['hits']
+            stats['statement_misses'] = self.__statement_stats['misses']
+        return stats
+
+    def __evict_idle(self):
+        """
+        Lukker ledige forbindelser, der har ligget ubrugt længere end `idle_timeout`. Kaldes med låsen holdt.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [entry for entry in self.__idle if entry[1] < cutoff]
+        if expired:
+            self.__idle = [entry for entry in self.__idle if entry[1] >= cutoff]
+            self.__stats['evictions'] += len(expired)
+            for cnxn, _ in expired:
+                self.__close(cnxn)
+
+    @staticmethod
+    def __is_alive(cnxn):
+        try:
+            cursor = cnxn.cursor()
+            cursor.execute('SELECT 1').fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def __close(self, cnxn):
+        self.__session_defaults.pop(id(cnxn), None)
+        cache = self.__caches.pop(id(cnxn), None)
+        if cache is not None:
+            cache.clear()
+        try:
+            cnxn.close()
+        except Exception:
+            pass
+
+
+# Processomspændende registre, så gentagne DBConnect(...)-kald deler forbindelser og engines
+_pools = {}
+_engines = {}
+_registry_lock = threading.Lock()
+
+
+def _get_pool(key, factory):
+    """
+    Henter (eller opretter) puljen for en nøgle (server, database, brugernavn, adgangskode).
+    """
+    with _registry_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(factory,
+                                  max_size=DBConnect.pool_size,
+                                  idle_timeout=DBConnect.idle_timeout,
+                                  checkout_timeout=DBConnect.checkout_timeout,
+                                  statement_cache_size=DBConnect.statement_cache_size,
+                                  max_overflow=DBConnect.max_overflow)
+            _pools[key] = pool
+        return pool
+
+
+def _get_engine(key, db_params, fast_executemany):
+    """
+    Henter (eller opretter) den delte SQLAlchemy engine for en nøgle og `fast_executemany`-indstilling.
+    """
+    with _registry_lock:
+        engine = _engines.get((key, fast_executemany))
+        if engine is None:
+            from sqlalchemy import create_engine
+            kwargs = {'fast_executemany': True} if fast_executemany else {}
+            engine = create_engine("mssql+pyodbc:///?odbc_connect={}".format(db_params),
+                                   pool_size=DBConnect.pool_size,
+                                   pool_recycle=DBConnect.idle_timeout,
+                                   pool_pre_ping=True,
+                                   **kwargs)
+            _engines[(key, fast_executemany)] = engine
+        return engine
+
+
+def pool_stats():
+    """
+    Returnerer statistik for alle forbindelsespuljer i processen.
+
+    Returnerer:
+    -----------
+    dict
+        En ordbog med 'server/database (bruger)' som nøgle og puljens tællere som værdi.
+    """
+    with _registry_lock:
+        pools = list(_pools.items())
+    return {f"{key[0]}/{key[1]} ({key[2] or 'trusted'})": pool.statistics() for key, pool in pools}
+
+
+def close_pools():
+    """
+    Lukker alle ledige forbindelser og nedlægger alle delte engines i processen.
+    """
+    with _registry_lock:
+        pools = list(_pools.values())
+        engines = list(_engines.values())
+        _engines.clear()
+    for pool in pools:
+        pool.close()
+    for engine in engines:
+        engine.dispose()
+
+
+# pandas dtypes for de Python-typer, pyodbc angiver som type_code i cursor.description
+_DTYPES = {int: 'Int64', float: 'float64', decimal.Decimal: 'float64', bool: 'boolean',
+           datetime.datetime: 'datetime64[ns]', str: 'object'}
+
+
+def _quote_table(schema, table):
+    """
+    Returnerer et tabelnavn i formatet [schema].[table] eller [table].
+    """
+    return f'[{schema}].[{table}]' if schema else f'[{table}]'
+
+
+def _bulk_parameters(chunk, geometry_name, input_sizes=True):
+    """
+    Konverterer en bid af en (Geo)DataFrame til kolonnevise parameterlister og pyodbc-inputstørrelser.
+
+    Manglende værdier bliver til `None`, og geometrikolonnen konverteres samlet til WKB.
+    Inputstørrelserne sættes eksplicit, så `fast_executemany` ikke gætter typen ud fra første række.
+    Tekst og WKB får biddens største længde, så pyodbc kan binde faste buffere; først over 4000 tegn
+    (nvarchar) eller 8000 bytes (varbinary) bruges 0, dvs. (max). Uden `input_sizes` importeres pyodbc
+    ikke, og der returneres `None` som størrelser.
+    """
+    import numpy as np
+    import shapely
+
+    if input_sizes:
+        import pyodbc
+
+    params = []
+    sizes = [] if input_sizes else None
+    for name in chunk.columns:
+        series = chunk[name]
+        if name == geometry_name:
+            wkb = shapely.to_wkb(np.asarray(series.values, dtype=object)).tolist()
+            params.append(wkb)
+            if input_sizes:
+                length = max((len(b) for b in wkb if b is not None), default=0)
+                sizes.append((pyodbc.SQL_VARBINARY, length if 0 < length <= 8000 else 0, 0))
+            continue
+        kind = series.dtype.kind
+        values = series.to_numpy(dtype=object)
+        mask = series.isna().to_numpy()
+        if mask.any():
+            values[mask] = None
+        params.append(values.tolist())
+        if not input_sizes:
+            continue
+        if kind == 'M':
+            sizes.append((pyodbc.SQL_TYPE_TIMESTAMP, 27, 7))
+        elif kind in 'iu':
+            sizes.append((pyodbc.SQL_BIGINT, 0, 0))
+        elif kind == 'f':
+            sizes.append((pyodbc.SQL_DOUBLE, 0, 0))
+        elif kind == 'b':
+            sizes.append((pyodbc.SQL_BIT, 0, 0))
+        else:
+            length = max((len(str(v)) for v in values[~mask]), default=0)
+            sizes.append((pyodbc.SQL_WVARCHAR, length if 0 < length <= 4000 else 0, 0))
+    return params, sizes
+
+
+class _Handle:
+    """
+    En tynd proxy om en forbindelse eller cursor fra `DBConnect`, der holder ejeren i live.
+
+    DBConnect afleverer sin forbindelse til puljen, når objektet bliver garbage collected. Uden proxyen
+    kunne `DBConnect(...).conn()` derfor give en forbindelse, som puljen samtidig lånte ud igen. Cursorer
+    og metoder, der returnerer det indpakkede objekt (f.eks. `cursor.execute`), pakkes også ind.
+    """
+
+    __slots__ = ('_obj', '_owner')
+
+    def __init__(self, obj, owner):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_owner', owner)
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if result is self._obj:
+                return self
+            if name == 'cursor':
+                return _Handle(result, self._owner)
+            return result
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._obj, name, value)
+
+    def __iter__(self):
+        # En generator, så proxyen og dermed ejeren lever, så længe der itereres
+        yield from self._obj
+
+    def __next__(self):
+        return next(self._obj)
+
+    def __enter__(self):
+        self._obj.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._obj.__exit__(exc_type, exc_value, traceback)
+
+    def __repr__(self):
+        return repr(self._obj)
+
 
 class DBConnect:
     """
@@ -24,11 +578,24 @@ class DBConnect:
         Brugernavnet til SQL Server-godkendelse. Hvis ikke angivet, bruges Windows-godkendelse.
     password : str, valgfri
         Adgangskoden til SQL Server-godkendelse. Bruges kun, hvis et brugernavn er angivet.
+
+    Forbindelser og engines deles i hele processen pr. (server, database, brugernavn, adgangskode),
+    så gentagne `DBConnect(...)`- og `engine()`-kald genbruger varme forbindelser. Størrelsen på
+    puljerne styres af klasseattributterne `pool_size`, `max_overflow`, `idle_timeout` og `checkout_timeout`.
     """
 
-    def __init__(self, database, server, username=None, password=None):
+    pool_size = 5
+    max_overflow = 10
+    idle_timeout = 300
+    checkout_timeout = 30
+    statement_cache_size = 50
+
+    def __init__(self, database, server, username=None, password=None, connect=None):
         """
-        Initialiserer DBConnect-objektet og opretter en forbindelse til SQL Server-databasen.
+        Initialiserer DBConnect-objektet og låner en forbindelse til SQL Server-databasen fra den delte pulje.
+
+        Forbindelsen afleveres til puljen igen med `close()`, når objektet bruges i en `with`-blok,
+        eller når objektet og alle cursorer og forbindelser hentet fra det er garbage collected.
 
         Parametre:
         ----------
@@ -40,11 +607,11 @@ class DBConnect:
             Brugernavnet til SQL Server-godkendelse. Hvis ikke angivet, bruges Windows-godkendelse.
         password : str, valgfri
             Adgangskoden til SQL Server-godkendelse. Bruges kun, hvis et brugernavn er angivet.
+        connect : callable, valgfri
+            En funktion uden argumenter, der returnerer en ny DB-API-forbindelse. Bruges i stedet for
+            `pyodbc.connect`, f.eks. med `sqlite3` som lokal stand-in til test. Bruges kun, når puljen
+            for forbindelsesnøglen oprettes.
         """
-        module_dir = os.path.dirname(__file__)
-        args_path = os.path.join(module_dir, 'DatabaseConnections_args.json')
-        with open(args_path, 'r') as f:
-            self.__args = json.load(f)
         self.database = database
         self.server = server
         self.username = username
@@ -55,19 +622,63 @@ class DBConnect:
             self.__params += ';Trusted_Connection=yes'
         else:
             self.__params += ';UID=' + username + ';PWD=' + password
-        self.__cnxn = pyodbc.connect(self.__params)
+        # Cursorerne i cachen af forberedte sætninger kan have ulæste resultater, mens en anden sætning
+        # udføres på samme forbindelse; uden MARS afviser SQL Server det med "Connection is busy"
+        self.__params += ';MARS_Connection=yes'
         self.__db_params = urllib.parse.quote_plus(self.__params)
-        
+        self.__key = (self.server, self.database, self.username, self.password)
+        if connect is None:
+            import pyodbc
+            connect = functools.partial(pyodbc.connect, self.__params)
+        self.__pool = _get_pool(self.__key, connect)
+        self.__cnxn = self.__pool.checkout()
+        self.__release = weakref.finalize(self, self.__pool.checkin, self.__cnxn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Afleverer forbindelsen til den delte pulje. Objektet må ikke bruges til forespørgsler bagefter.
+        """
+        self.__release()
+
+    def statement_stats(self):
+        """
+        Returnerer tællerne for forbindelsens cache af forberedte sætninger.
+
+        Returnerer:
+        -----------
+        dict
+            Cachens tællere, se `StatementCache.statistics`. Hits og misses er fælles for hele puljen.
+        """
+        return self.__pool.statement_cache(self.__cnxn).statistics()
+
+    def pool_stats(self):
+        """
+        Returnerer statistik for den pulje, objektets forbindelse kommer fra.
+
+        Returnerer:
+        -----------
+        dict
+            Puljens tællere, se `ConnectionPool.statistics`.
+        """
+        return self.__pool.statistics()
+
     def engine(self):
         """
-        Opretter og returnerer et SQLAlchemy engine-objekt til forbindelse med SQL Server-databasen.
+        Returnerer den delte SQLAlchemy engine til forbindelse med SQL Server-databasen.
+        Engines oprettes én gang pr. forbindelsesnøgle og genbruges på tværs af kald og objekter.
 
         Returnerer:
         -----------
         sqlalchemy.engine.Engine
             Et SQLAlchemy engine-objekt, der kan bruges til at interagere med databasen.
         """
-        return create_engine("mssql+pyodbc:///?odbc_connect={}".format(self.__db_params))
+        return _get_engine(self.__key, self.__db_params, fast_executemany=False)
 
     def cursor(self):
         """
@@ -76,36 +687,271 @@ class DBConnect:
         Returnerer:
         -----------
         pyodbc.Cursor
-            Et cursor-objekt, der kan bruges til at udføre SQL-forespørgsler og hente resultater.
+            Et cursor-objekt, der kan bruges til at udføre SQL-forespørgsler og hente resultater. Cursoren
+            holder DBConnect-objektet i live, så forbindelsen ikke afleveres til puljen, mens den bruges.
         """
-        return self.__cnxn.cursor()
+        return _Handle(self.__cnxn.cursor(), self)
     
     def fast_engine(self):
         """
-        Opretter og returnerer et SQLAlchemy engine-objekt med `fast_executemany` aktiveret til bulk-indlæsningsoperationer.
+        Returnerer den delte SQLAlchemy engine med `fast_executemany` aktiveret til bulk-indlæsningsoperationer.
 
         Returnerer:
         -----------
         sqlalchemy.engine.Engine
             Et SQLAlchemy engine-objekt med hurtig indlæsningsfunktionalitet.
         """
-        return create_engine("mssql+pyodbc:///?odbc_connect={}".format(self.__db_params), fast_executemany=True)
+        return _get_engine(self.__key, self.__db_params, fast_executemany=True)
 
     def conn(self):
         """
-        Returnerer den aktuelle ODBC-forbindelse.
+        Returnerer den aktuelle ODBC-forbindelse. Forbindelsen tilhører puljen og må ikke lukkes direkte;
+        brug `close()` på DBConnect-objektet i stedet.
 
         Returnerer:
         -----------
         pyodbc.Connection
-            En aktiv ODBC-forbindelse til SQL Server-databasen.
+            En aktiv ODBC-forbindelse til SQL Server-databasen. Forbindelsen og cursorer hentet fra den
+            holder DBConnect-objektet i live, så forbindelsen ikke afleveres til puljen, mens den bruges.
         """
-        return self.__cnxn
-    
-    def statistik(self, gruppenavn, navn, id, status, interval, runtime, featuresRead={}, featuresWritten={}):
+        return _Handle(self.__cnxn, self)
+
+    def execute(self, sql, params=None, commit=False):
+        """
+        Udfører en parameteriseret SQL-sætning via forbindelsens cache af forberedte sætninger.
+
+        Værdier skal gives som `?`-parametre frem for at blive flettet ind i SQL-teksten, så sætningen
+        kun forberedes én gang pr. forbindelse, og SQL Server kan genbruge planen.
+
+        Parametre:
+        ----------
+        sql : str
+            SQL-sætningen med `?`-parametre.
+        params : sequence, valgfri
+            Parametrene til sætningen.
+        commit : bool, valgfri
+            Commit efter udførelsen (standard: False).
+
+        Returnerer:
+        -----------
+        pyodbc.Cursor
+            Sætningens cursor, som resultatet kan hentes fra. Cursoren genbruges ved næste udførelse af
+            samme SQL-tekst, så resultatet skal hentes før det. Ulæste resultater blokerer ikke andre
+            sætninger, da forbindelsen åbnes med `MARS_Connection=yes`.
+        """
+        cursor = self.__pool.statement_cache(self.__cnxn).cursor(sql)
+        if params is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql, params)
+        if commit:
+            self.__cnxn.commit()
+        return _Handle(cursor, self)
+
+    def executemany(self, sql, seq_of_params, commit=False):
+        """
+        Udfører en parameteriseret SQL-sætning for hver parameterrække med `fast_executemany`,
+        via forbindelsens cache af forberedte sætninger.
+
+        Parametre:
+        ----------
+        sql : str
+            SQL-sætningen med `?`-parametre.
+        seq_of_params : sequence
+            En sekvens af parameterrækker.
+        commit : bool, valgfri
+            Commit efter udførelsen (standard: False).
+        """
+        cursor = self.__pool.statement_cache(self.__cnxn).cursor(sql)
+        if hasattr(cursor, 'fast_executemany'):
+            cursor.fast_executemany = True
+        cursor.executemany(sql, seq_of_params)
+        if commit:
+            self.__cnxn.commit()
+
+    def commit(self):
+        """
+        Committer den aktuelle transaktion på forbindelsen.
+        """
+        self.__cnxn.commit()
+
+    def bulk_load(self, df, table, schema='dbo', chunksize=50_000, mode='append', staging=False, key=None,
+                  srid=25832, geometry_sql='geometry::STGeomFromWKB(?, {srid})'):
+        """
+        Indlæser en (Geo)DataFrame i en eksisterende tabel med `fast_executemany` i bidder af `chunksize` rækker.
+
+        Kolonnerne konverteres vektoriseret pr. bid til typede parameterlister, og geometrien konverteres
+        til WKB med `shapely.to_wkb` i stedet for WKT-strenge pr. række. Med `staging=True` indlæses der
+        først i en staging-tabel (`<table>__staging`), hvorfra data tilføjes, erstatter eller merges ind i
+        måltabellen i samme transaktion. Hele indlæsningen committes samlet og rulles tilbage ved fejl.
+
+        Parametre:
+        ----------
+        df : DataFrame eller GeoDataFrame
+            Data, der skal indlæses. Kolonnenavnene skal svare til måltabellens kolonner.
+        table : str
+            Navnet på måltabellen.
+        schema : str, valgfri
+            Skemaet for måltabellen (standard: 'dbo'). `None` udelader skemaet.
+        chunksize : int, valgfri
+            Antal rækker pr. `executemany` (standard: 50.000).
+        mode : str, valgfri
+            'append' tilføjer rækker, 'replace' sletter måltabellens rækker først, og 'merge' opdaterer
+            eksisterende rækker ud fra `key` og indsætter resten (kræver `staging=True`). Standard er 'append'.
+        staging : bool, valgfri
+            Indlæs via en staging-tabel (standard: False).
+        key : list, valgfri
+            Nøglekolonner til `mode='merge'`.
+        srid : int, valgfri
+            SRID til geometrien (standard: 25832).
+        geometry_sql : str, valgfri
+            SQL-udtryk til geometrikolonnen med `?` som WKB-parameter (standard: 'geometry::STGeomFromWKB(?, {srid})').
+
+        Returnerer:
+        -----------
+        dict
+            Antal rækker (`rows`), antal bidder (`chunks`), tidsforbrug (`seconds`) og rækker pr. sekund (`rows_per_second`).
+        """
+        if mode not in ('append', 'replace', 'merge'):
+            raise ValueError(f"Unknown mode '{mode}', use 'append', 'replace' or 'merge'")
+        if mode == 'merge' and (not staging or not key):
+            raise ValueError("mode='merge' requires staging=True and key columns")
+
+        start = time.perf_counter()
+        geometry_name = df.geometry.name if hasattr(df, 'geometry') and hasattr(df.geometry, 'crs') else None
+        columns = list(df.columns)
+        target = _quote_table(schema, table)
+        load_table = _quote_table(schema, table + '__staging') if staging else target
+        column_list = ', '.join(f'[{c}]' for c in columns)
+        values = ', '.join(geometry_sql.format(srid=srid) if c == geometry_name else '?' for c in columns)
+        insert_sql = f'INSERT INTO {load_table} ({column_list}) VALUES ({values})'
+
+        cursor = self.__cnxn.cursor()
+        pyodbc_cursor = hasattr(cursor, 'fast_executemany')
+        if pyodbc_cursor:
+            cursor.fast_executemany = True
+        chunks = 0
+        try:
+            if staging:
+                cursor.execute(f"IF OBJECT_ID('{load_table}') IS NOT NULL DROP TABLE {load_table}")
+                cursor.execute(f'SELECT TOP 0 {column_list} INTO {load_table} FROM {target}')
+            elif mode == 'replace':
+                cursor.execute(f'DELETE FROM {target}')
+
+            for offset in range(0, len(df), chunksize):
+                chunk = df.iloc[offset:offset + chunksize]
+                params, sizes = _bulk_parameters(chunk, geometry_name, input_sizes=pyodbc_cursor)
+                if pyodbc_cursor:
+                    cursor.setinputsizes(sizes)
+                cursor.executemany(insert_sql, list(zip(*params)))
+                chunks += 1
+
+            if staging:
+                if mode == 'replace':
+                    cursor.execute(f'DELETE FROM {target}')
+                if mode == 'merge':
+                    on = ' AND '.join(f't.[{k}] = s.[{k}]' for k in key)
+                    updates = ', '.join(f't.[{c}] = s.[{c}]' for c in columns if c not in key)
+                    source_list = ', '.join(f's.[{c}]' for c in columns)
+                    # Består tabellen kun af nøglekolonner, er der intet at opdatere, og kun nye rækker indsættes
+                    matched = f'WHEN MATCHED THEN UPDATE SET {updates} ' if updates else ''
+                    cursor.execute(f'MERGE {target} AS t USING {load_table} AS s ON {on} {matched}'
+                                   f'WHEN NOT MATCHED THEN INSERT ({column_list}) VALUES ({source_list});')
+                else:
+                    cursor.execute(f'INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {load_table}')
+                cursor.execute(f'DROP TABLE {load_table}')
+            self.__cnxn.commit()
+        except Exception:
+            self.__cnxn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        seconds = time.perf_counter() - start
+        return {'rows': len(df), 'chunks': chunks, 'seconds': seconds,
+                'rows_per_second': len(df) / seconds if seconds > 0 else float('inf')}
+
+    def iter_query(self, sql, params=None, chunk_rows=50_000, dtypes=None, geometry=None, crs='EPSG:25832', arrow=False):
+        """
+        Udfører en forespørgsel og returnerer resultatet i bidder af højst `chunk_rows` rækker.
+
+        Rækkerne hentes med `cursor.fetchmany` med `arraysize` sat til `chunk_rows`, så hukommelsesforbruget
+        er begrænset af bidstørrelsen og ikke af resultatets størrelse. Kolonnernes dtypes bestemmes én gang
+        ud fra cursorens beskrivelse (eller `dtypes`) og bruges for alle bidder. Forbindelsen er optaget,
+        indtil generatoren er løbet igennem eller lukket.
+
+        Parametre:
+        ----------
+        sql : str
+            SQL-forespørgslen, evt. med `?`-parametre.
+        params : sequence, valgfri
+            Parametre til forespørgslen.
+        chunk_rows : int, valgfri
+            Antal rækker pr. bid (standard: 50.000).
+        dtypes : dict, valgfri
+            Kolonnenavn -> pandas dtype, der overstyrer de automatisk bestemte dtypes.
+        geometry : str, valgfri
+            Navnet på en kolonne med WKB (f.eks. `SHAPE.STAsBinary() AS geometry`). Hvis angivet, returneres
+            GeoDataFrames med kolonnen som geometri.
+        crs : str, valgfri
+            Koordinatsystemet for geometrikolonnen (standard: 'EPSG:25832').
+        arrow : bool, valgfri
+            Returnér `pyarrow.RecordBatch` i stedet for pandas (standard: False). Geometrien forbliver WKB.
+
+        Returnerer:
+        -----------
+        generator
+            DataFrames, GeoDataFrames eller RecordBatches med op til `chunk_rows` rækker hver.
+        """
+        import numpy as np
+        import pandas as pd
+
+        cursor = self.__cnxn.cursor()
+        cursor.arraysize = chunk_rows
+        try:
+            if params is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql, params)
+            columns = [d[0] for d in cursor.description]
+            resolved = {c: _DTYPES.get(d[1]) for c, d in zip(columns, cursor.description)}
+            resolved.update(dtypes or {})
+            if geometry is not None:
+                resolved[geometry] = None
+            if arrow:
+                import pyarrow as pa
+                arrow_types = {int: pa.int64(), float: pa.float64(), bool: pa.bool_(), str: pa.string(),
+                               datetime.datetime: pa.timestamp('us'), bytes: pa.binary(), bytearray: pa.binary()}
+                types = [arrow_types.get(d[1]) for d in cursor.description]
+            elif geometry is not None:
+                import geopandas as gpd
+
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                values = list(zip(*rows))
+                del rows
+                if arrow:
+                    yield pa.record_batch([pa.array(v, type=t) for v, t in zip(values, types)], names=columns)
+                    continue
+                batch = pd.DataFrame({c: pd.Series(v, dtype=resolved[c]) for c, v in zip(columns, values)})
+                if geometry is not None:
+                    batch[geometry] = gpd.GeoSeries.from_wkb(np.asarray(batch[geometry], dtype=object))
+                    batch = gpd.GeoDataFrame(batch, geometry=geometry, crs=crs)
+                yield batch
+        finally:
+            cursor.close()
+
+    def statistik(self, gruppenavn, navn, id, status, interval, runtime, featuresRead={}, featuresWritten={}, buffered=False):
         """
         Logger statistik for en FME-jobkørsel i databasen.
 
+        Som standard skrives rækken med det samme, og `dato` sættes af serveren med GETDATE(). Med
+        `buffered=True` lægges rækken i den processomspændende `StatistikSink` og skrives i batch sammen med
+        andre rækker, senest når processen afsluttes. `dato` er da klientens tidspunkt for kaldet, da
+        serverens tid ved skrivningen kan ligge op til `flush_interval` sekunder senere.
+
         Parametre:
         ----------
         gruppenavn : str
@@ -124,6 +970,8 @@ class DBConnect:
             En ordbog med antal læste features, grupperet efter feature-type.
         featuresWritten : dict, valgfri
             En ordbog med antal skrevne features, grupperet efter feature-type.
+        buffered : bool, valgfri
+            Hvis `True`, skrives rækken i batch i stedet for med det samme (standard: False).
         """
         self.gruppenavn = gruppenavn
         self.id = id
@@ -136,38 +984,543 @@ class DBConnect:
         self.featuresRead = json.dumps(featuresRead)
         self.featuresWritten = json.dumps(featuresWritten)
 
-        sql = f"""INSERT INTO [Digitalisering].[FME_STATISTIK]
-                    (OBJECTID
-                    , gruppenavn
-                    , dato
-                    , id
-                    , navn
-                    , status
-                    , runtime
-                    , featuresWritten
-                    , totalFeaturesWritten
-                    , interval
-                    , featuresRead
-                    , totalFeaturesRead) 
-                VALUES (
-                    (SELECT MAX(OBJECTID) FROM [Digitalisering].[FME_STATISTIK])+1
-                    , '{self.gruppenavn}'
-                    , GETDATE()
-                    , '{self.id}'
-                    , '{self.navn}'
-                    , '{self.status}'
-                    , {self.runtime}
-                    , '{self.featuresWritten}'
-                    , {self.totalFeaturesWritten}
-                    , '{self.interval}'
-                    , '{self.featuresRead}'
-                    , {self.totalFeaturesRead}
-                    )"""
-        
-        connection = DBConnect(server=self.__args['geodata_server'] , database=self.__args['geodata_database'])
-        cursor = connection.cursor()
-        cursor.execute(sql)
-        cursor.commit()
+        sink = _get_statistik_sink()
+        # Uden buffer sætter serveren `dato`, ligesom før bufferen fandtes
+        dato = datetime.datetime.now() if buffered else None
+        sink.add((self.gruppenavn, dato, self.id, self.navn, self.status, self.runtime,
+                  self.featuresWritten, self.totalFeaturesWritten, self.interval,
+                  self.featuresRead, self.totalFeaturesRead))
+        if not buffered:
+            sink.flush()
+
+
+class AsyncDBConnect:
+    """
+    En facade, der udfører uafhængige SQL-forespørgsler parallelt på en afgrænset trådpulje.
+
+    Hver arbejdstråd låner sin egen forbindelse fra den delte forbindelsespulje (se `DBConnect`), så
+    forespørgslerne ikke deler cursor eller transaktion. Forespørgsler kan sendes synkront med `submit()`,
+    der returnerer en `concurrent.futures.Future`, eller asynkront med `run()` og `gather()` fra asyncio.
+    For hver forespørgsel registreres svartiden i et histogram pr. label.
+
+    Bemærk, at `DBConnect.pool_size` skal være mindst `workers`, ellers venter arbejdstrådene på hinanden.
+
+    Attributter:
+    -----------
+    latency_buckets : tuple
+        Øvre grænser i sekunder for histogrammets spande.
+    """
+
+    latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, database, server, username=None, password=None, workers=4, connect=None):
+        """
+        Initialiserer facaden og trådpuljen. Forbindelserne oprettes først, når en arbejdstråd skal bruge dem.
+
+        Parametre:
+        ----------
+        database : str
+            Navnet på SQL Server-databasen.
+        server : str
+            Navnet eller IP-adressen på SQL Serveren.
+        username : str, valgfri
+            Brugernavnet til SQL Server-godkendelse. Hvis ikke angivet, bruges Windows-godkendelse.
+        password : str, valgfri
+            Adgangskoden til SQL Server-godkendelse.
+        workers : int, valgfri
+            Antal arbejdstråde og dermed samtidige forbindelser (standard: 4).
+        connect : callable, valgfri
+            Fabriksfunktion til forbindelser, se `DBConnect`.
+        """
+        import concurrent.futures
+
+        self.__db_args = {'database': database, 'server': server, 'username': username,
+                          'password': password, 'connect': connect}
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                                thread_name_prefix='AsyncDBConnect')
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__connections = []
+        self.__running = {}
+        self.__latency = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def submit(self, sql, params=None, fetch='all', commit=False, label=None):
+        """
+        Sender en forespørgsel til trådpuljen.
+
+        Parametre:
+        ----------
+        sql : str
+            SQL-forespørgslen, evt. med `?`-parametre.
+        params : sequence, valgfri
+            Parametre til forespørgslen.
+        fetch : str, valgfri
+            'all' returnerer alle rækker, 'one' den første række, 'value' første kolonne i første række,
+            og 'none' antallet af berørte rækker (standard: 'all').
+        commit : bool, valgfri
+            Commit efter forespørgslen, f.eks. ved INSERT (standard: False).
+        label : str, valgfri
+            Navn til svartidshistogrammet. Standard er selve SQL-teksten (forkortet).
+
+        Returnerer:
+        -----------
+        concurrent.futures.Future
+            En future med forespørgslens resultat.
+        """
+        if fetch not in ('all', 'one', 'value', 'none'):
+            raise ValueError(f"Unknown fetch '{fetch}', use 'all', 'one', 'value' or 'none'")
+        if label is None:
+            label = ' '.join(sql.split())[:80]
+        state = {'cursor': None, 'cancelled': False}
+        future = self.__executor.submit(self.__execute, sql, params, fetch, commit, label, state)
+        with self.__lock:
+            self.__running[future] = state
+        future.add_done_callback(self.__forget)
+        return future
+
+    def cancel(self, future):
+        """
+        Annullerer en forespørgsel. Er den ikke startet endnu, fjernes den fra køen; kører den,
+        kaldes `cursor.cancel()` på dens cursor.
+
+        Parametre:
+        ----------
+        future : concurrent.futures.Future
+            Future returneret af `submit()`.
+        """
+        if future.cancel():
+            return
+        with self.__lock:
+            state = self.__running.get(future)
+        if state is not None:
+            state['cancelled'] = True
+            cursor = state['cursor']
+            if cursor is not None:
+                try:
+                    cursor.cancel()
+                except Exception:
+                    pass
+
+    async def run(self, sql, params=None, fetch='all', commit=False, label=None, timeout=None):
+        """
+        Udfører en forespørgsel fra asyncio og annullerer den, hvis den overskrider `timeout`.
+
+        Parametre:
+        ----------
+        sql, params, fetch, commit, label
+            Se `submit()`.
+        timeout : float, valgfri
+            Maksimal ventetid i sekunder. Ved overskridelse kastes `asyncio.TimeoutError`.
+
+        Returnerer:
+        -----------
+        object
+            Forespørgslens resultat, se `fetch` i `submit()`.
+        """
+        import asyncio
+
+        if label is None:
+            label = ' '.join(sql.split())[:80]
+        future = self.submit(sql, params, fetch=fetch, commit=commit, label=label)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.cancel(future)
+            with self.__lock:
+                self.__histogram(label)['timeouts'] += 1
+            raise
+
+    async def gather(self, queries, timeout=None, return_exceptions=False):
+        """
+        Udfører mange forespørgsler samtidigt og returnerer resultaterne i samme rækkefølge.
+
+        Parametre:
+        ----------
+        queries : list
+            En liste af SQL-strenge eller ordbøger med argumenter til `run()` (f.eks. {'sql': ..., 'params': ...}).
+        timeout : float, valgfri
+            Timeout pr. forespørgsel i sekunder, medmindre ordbogen selv angiver `timeout`.
+        return_exceptions : bool, valgfri
+            Returnér fejl som resultater i stedet for at kaste den første (standard: False).
+
+        Returnerer:
+        -----------
+        list
+            Resultaterne i samme rækkefølge som `queries`.
+        """
+        import asyncio
+
+        calls = []
+        for query in queries:
+            kwargs = {'sql': query} if isinstance(query, str) else dict(query)
+            kwargs.setdefault('timeout', timeout)
+            calls.append(self.run(**kwargs))
+        return await asyncio.gather(*calls, return_exceptions=return_exceptions)
+
+    def latency_stats(self):
+        """
+        Returnerer svartidshistogrammer pr. label.
+
+        Returnerer:
+        -----------
+        dict
+            Label -> antal (`count`), fejl (`errors`), timeouts (`timeouts`), gennemsnit (`mean`), maksimum (`max`)
+            i sekunder og `buckets` med antal forespørgsler pr. øvre grænse ('+Inf' for resten).
+        """
+        with self.__lock:
+            stats = {}
+            for label, hist in self.__latency.items():
+                buckets = dict(zip([str(b) for b in self.latency_buckets] + ['+Inf'], hist['buckets']))
+                stats[label] = {'count': hist['count'], 'errors': hist['errors'], 'timeouts': hist['timeouts'],
+                                'mean': hist['total'] / hist['count'] if hist['count'] else 0.0,
+                                'max': hist['max'], 'buckets': buckets}
+        return stats
+
+    def close(self):
+        """
+        Venter på igangværende forespørgsler, lukker trådpuljen og afleverer forbindelserne til den delte pulje.
+        """
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+        with self.__lock:
+            connections, self.__connections = self.__connections, []
+        for db in connections:
+            db.close()
+
+    def __connection(self):
+        """
+        Returnerer arbejdstrådens egen DBConnect og opretter den ved første brug.
+        """
+        db = getattr(self.__local, 'db', None)
+        if db is None:
+            db = DBConnect(**self.__db_args)
+            self.__local.db = db
+            with self.__lock:
+                self.__connections.append(db)
+        return db
+
+    def __execute(self, sql, params, fetch, commit, label, state):
+        """
+        Udfører en forespørgsel i en arbejdstråd og registrerer svartiden.
+        """
+        if state['cancelled']:
+            import concurrent.futures
+            raise concurrent.futures.CancelledError()
+        cnxn = self.__connection().conn()
+        start = time.perf_counter()
+        failed = True
+        cursor = cnxn.cursor()
+        state['cursor'] = cursor
+        try:
+            if params is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql, params)
+            if fetch == 'all':
+                result = cursor.fetchall()
+            elif fetch == 'one':
+                result = cursor.fetchone()
+            elif fetch == 'value':
+                row = cursor.fetchone()
+                result = row[0] if row is not None else None
+            else:
+                result = cursor.rowcount
+            if commit:
+                cnxn.commit()
+            failed = False
+            return result
+        finally:
+            state['cursor'] = None
+            cursor.close()
+            if failed:
+                try:
+                    cnxn.rollback()
+                except Exception:
+                    pass
+            self.__record(label, time.perf_counter() - start, failed)
+
+    def __record(self, label, seconds, failed):
+        """
+        Registrerer en svartid i histogrammet for `label`.
+        """
+        index = bisect.bisect_left(self.latency_buckets, seconds)
+        with self.__lock:
+            hist = self.__histogram(label)
+            hist['count'] += 1
+            hist['total'] += seconds
+            hist['max'] = max(hist['max'], seconds)
+            hist['buckets'][index] += 1
+            if failed:
+                hist['errors'] += 1
+
+    def __histogram(self, label):
+        """
+        Returnerer (og opretter) histogrammet for `label`. Kaldes med låsen holdt.
+        """
+        hist = self.__latency.get(label)
+        if hist is None:
+            hist = {'count': 0, 'errors': 0, 'timeouts': 0, 'total': 0.0, 'max': 0.0,
+                    'buckets': [0] * (len(self.latency_buckets) + 1)}
+            self.__latency[label] = hist
+        return hist
+
+    def __forget(self, future):
+        with self.__lock:
+            self.__running.pop(future, None)
+
+
+class StatistikSink:
+    """
+    En buffer, der samler statistikrækker til [Digitalisering].[FME_STATISTIK] og skriver dem i batches.
+
+    Rækker lægges i en kø i hukommelsen og skrives med én parameteriseret `executemany` (med
+    `fast_executemany`), når køen når `batch_size` rækker, når den ældste række er `flush_interval`
+    sekunder gammel, eller når processen afsluttes. OBJECTID tildeles i blokke: der hentes ét
+    MAX(OBJECTID) pr. flush under en opdateringslås, og batchens rækker nummereres fortløbende derfra.
+    Fejler skrivningen ved procesafslutningen, skrives fejlen og antallet af tabte rækker til stderr.
+
+    Attributter:
+    -----------
+    batch_size : int
+        Antal rækker i køen, der udløser en flush.
+    flush_interval : float
+        Maksimal alder i sekunder for den ældste række i køen, før den skrives.
+    """
+
+    table = '[Digitalisering].[FME_STATISTIK]'
+    columns = ('OBJECTID', 'gruppenavn', 'dato', 'id', 'navn', 'status', 'runtime', 'featuresWritten',
+               'totalFeaturesWritten', 'interval', 'featuresRead', 'totalFeaturesRead')
+
+    def __init__(self, connection_factory, batch_size=500, flush_interval=30):
+        """
+        Initialiserer bufferen.
+
+        Parametre:
+        ----------
+        connection_factory : callable
+            En funktion uden argumenter, der returnerer et DBConnect-objekt til statistikdatabasen.
+        batch_size : int, valgfri
+            Antal rækker, der udløser en flush (standard: 500).
+        flush_interval : float, valgfri
+            Maksimal alder i sekunder for en række i køen (standard: 30).
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.__connection_factory = connection_factory
+        self.__queue = []
+        self.__oldest = None
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__timer = None
+        self.__stats = {'flushes': 0, 'failed_flushes': 0, 'records_flushed': 0, 'max_queue_depth': 0,
+                        'last_flush_seconds': 0.0, 'max_flush_seconds': 0.0, 'total_flush_seconds': 0.0}
+        # En række uden `dato` får serverens tid; COALESCE giver datetime-typen, også når parameteren er NULL
+        self.__sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            self.table, ', '.join(self.columns),
+            ', '.join('COALESCE(?, GETDATE())' if c == 'dato' else '?' for c in self.columns))
+        self.__max_sql = f'SELECT ISNULL(MAX(OBJECTID), 0) FROM {self.table} WITH (UPDLOCK, HOLDLOCK)'
+        atexit.register(self.__close_at_exit)
+
+    def add(self, record):
+        """
+        Lægger en statistikrække i køen og flusher, hvis køen har nået `batch_size`.
+
+        Parametre:
+        ----------
+        record : tuple
+            Rækkens værdier i samme rækkefølge som `columns`, uden OBJECTID.
+        """
+        with self.__lock:
+            self.__queue.append(record)
+            if self.__oldest is None:
+                self.__oldest = time.monotonic()
+            depth = len(self.__queue)
+            self.__stats['max_queue_depth'] = max(self.__stats['max_queue_depth'], depth)
+            if self.__timer is None:
+                self.__timer = threading.Thread(target=self.__run_timer, name='StatistikSink', daemon=True)
+                self.__timer.start()
+        if depth >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Skriver alle rækker i køen til databasen i én transaktion.
+        Fejler skrivningen, lægges rækkerne tilbage forrest i køen, og fejlen kastes videre.
+
+        Returnerer:
+        -----------
+        int
+            Antal skrevne rækker.
+        """
+        with self.__flush_lock:
+            with self.__lock:
+                records, self.__queue = self.__queue, []
+                self.__oldest = None
+            if not records:
+                return 0
+            start = time.perf_counter()
+            try:
+                with self.__connection_factory() as connection:
+                    # Ét opslag pr. batch; låsen forhindrer, at samtidige jobs tildeler de samme OBJECTID'er
+                    # Resultatet læses helt, så cursoren ikke holder et åbent resultat under indsættelsen
+                    first_id = connection.execute(self.__max_sql).fetchall()[0][0] + 1
+                    connection.executemany(self.__sql, [(first_id + i,) + record for i, record in enumerate(records)],
+                                           commit=True)
+            except Exception:
+                with self.__lock:
+                    self.__queue[:0] = records
+                    if self.__oldest is None:
+                        self.__oldest = time.monotonic()
+                    self.__stats['failed_flushes'] += 1
+                raise
+            elapsed = time.perf_counter() - start
+            with self.__lock:
+                self.__stats['flushes'] += 1
+                self.__stats['records_flushed'] += len(records)
+                self.__stats['last_flush_seconds'] = elapsed
+                self.__stats['max_flush_seconds'] = max(self.__stats['max_flush_seconds'], elapsed)
+                self.__stats['total_flush_seconds'] += elapsed
+            return len(records)
+
+    def close(self):
+        """
+        Stopper baggrundstimeren og skriver de resterende rækker. Kaldes automatisk ved procesafslutning.
+        """
+        self.__stop.set()
+        self.flush()
+
+    def __close_at_exit(self):
+        """
+        Skriver de resterende rækker ved procesafslutning. Fejler det, skrives fejlen og antallet af tabte
+        rækker til stderr, da der ikke er nogen kalder til at modtage undtagelsen.
+        """
+        try:
+            self.close()
+        except Exception as e:
+            with self.__lock:
+                lost = len(self.__queue)
+            print(f'StatistikSink: {lost} statistics rows could not be written to {self.table} at exit: '
+                  f'{type(e).__name__}: {e}', file=sys.stderr)
+
+    def statistics(self):
+        """
+        Returnerer bufferens tællere.
+
+        Returnerer:
+        -----------
+        dict
+            Aktuel kødybde (`queue_depth`), største kødybde (`max_queue_depth`), antal flushes og fejlede
+            flushes, antal skrevne rækker samt seneste, største og samlede flush-tid i sekunder.
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['queue_depth'] = len(self.__queue)
+        return stats
+
+    def __run_timer(self):
+        """
+        Baggrundstråd, der flusher køen, når den ældste række er ældre end `flush_interval`.
+        """
+        while not self.__stop.wait(min(self.flush_interval, 1.0)):
+            with self.__lock:
+                due = self.__oldest is not None and time.monotonic() - self.__oldest >= self.flush_interval
+            if due:
+                try:
+                    self.flush()
+                except Exception:
+                    # Rækkerne er lagt tilbage i køen og forsøges igen ved næste interval eller ved afslutning
+                    pass
+
+
+_statistik_sink = None
+
+
+def _statistik_connection():
+    """
+    Opretter en DBConnect til geodata-serveren angivet i DatabaseConnections_args.json.
+    """
+    args = load_args('DatabaseConnections')
+    return DBConnect(server=args['geodata_server'], database=args['geodata_database'])
+
+
+def _get_statistik_sink():
+    """
+    Henter (eller opretter) den processomspændende StatistikSink til geodata-serveren.
+    """
+    global _statistik_sink
+    with _registry_lock:
+        if _statistik_sink is None:
+            _statistik_sink = StatistikSink(_statistik_connection)
+        return _statistik_sink
+
+
+def flush_statistik():
+    """
+    Skriver alle ventende statistikrækker til databasen med det samme.
+
+    Returnerer:
+    -----------
+    int
+        Antal skrevne rækker.
+    """
+    return _statistik_sink.flush() if _statistik_sink is not None else 0
+
+
+def statistik_stats():
+    """
+    Returnerer tællerne for statistikbufferen, se `StatistikSink.statistics`.
+
+    Returnerer:
+    -----------
+    dict
+        Bufferens tællere, eller en tom ordbog hvis der endnu ikke er logget statistik.
+    """
+    return _statistik_sink.statistics() if _statistik_sink is not None else {}
+
+
+if __name__ == "__main__":
+    # Benchmark af bulk_load mod plain to_sql med WKT-strenge, med SQLite som lokal stand-in for SQL Server
+    import sqlite3
+    import tempfile
+    import geopandas as gpd
+    import numpy as np
+
+    rows = 200_000
+    rng = np.random.default_rng(0)
+    gdf = gpd.GeoDataFrame({'navn': [f'feature {i}' for i in range(rows)],
+                            'vaerdi': rng.random(rows),
+                            'antal': rng.integers(0, 1000, rows)},
+                           geometry=gpd.points_from_xy(rng.uniform(440_000, 480_000, rows),
+                                                       rng.uniform(6_250_000, 6_300_000, rows)),
+                           crs='EPSG:25832')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'benchmark.sqlite')
+        connect = functools.partial(sqlite3.connect, path, check_same_thread=False)
+        with connect() as cnxn:
+            cnxn.execute('CREATE TABLE bulk (navn TEXT, vaerdi REAL, antal INTEGER, geometry BLOB)')
 
+        start = time.perf_counter()
+        plain = gdf.drop(columns='geometry').assign(geometry=gdf.geometry.apply(lambda geom: geom.wkt))
+        with connect() as cnxn:
+            plain.to_sql('plain', cnxn, index=False, chunksize=50_000)
+        to_sql_seconds = time.perf_counter() - start
 
+        with DBConnect('benchmark', 'sqlite', connect=connect) as db:
+            result = db.bulk_load(gdf, 'bulk', schema=None, geometry_sql='?')
 
+    print(f"to_sql    : {rows / to_sql_seconds:12,.0f} rows/s ({to_sql_seconds:.2f} s)")
+    print(f"bulk_load : {result['rows_per_second']:12,.0f} rows/s ({result['seconds']:.2f} s)")
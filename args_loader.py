@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def load_args(name, directory=None):
+    """
+    Indlæser konfigurationen fra `<name>_args.json` og cacher den for resten af processen.
+
+    Filen parses kun første gang og igen, hvis dens ændringstidspunkt (mtime) ændrer sig. Værdier kan
+    overstyres med miljøvariabler på formen `<NAME>_<NØGLE>`, f.eks. `EMAILER_SMTP_SERVER` eller
+    `DATABASECONNECTIONS_GEODATA_SERVER`. Findes filen ikke, bruges kun miljøvariablerne.
+
+    Parametre:
+    ----------
+    name : str
+        Modulnavnet foran `_args.json`, f.eks. 'emailer' eller 'DatabaseConnections'.
+    directory : str, valgfri
+        Mappen med konfigurationsfilen. Standard er mappen, som dette modul ligger i.
+
+    Returnerer:
+    -----------
+    dict
+        En kopi af konfigurationen med eventuelle miljøvariabler anvendt.
+    """
+    path = os.path.join(directory or os.path.dirname(os.path.abspath(__file__)), f'{name}_args.json')
+    prefix = name.upper() + '_'
+    overrides = {key[len(prefix):].lower(): value for key, value in os.environ.items() if key.startswith(prefix)}
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        if overrides:
+            return overrides
+        raise
+
+    with _lock:
+        cached = _cache.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'r') as f:
+                cached = (mtime, json.load(f))
+            _cache[path] = cached
+    args = dict(cached[1])
+    args.update(overrides)
+    return args
+
+
+if __name__ == "__main__":
+    # Måler opstartstiden for modulerne i en ny proces mod import af de tunge drivere, de tidligere importerede
+    import statistics
+    import subprocess
+    import sys
+
+    def startup(code, runs=7):
+        times = []
+        for _ in range(runs):
+            result = subprocess.run([sys.executable, '-c', f'import time; t = time.perf_counter(); {code}; '
+                                     'print(time.perf_counter() - t)'],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, check=True)
+            times.append(float(result.stdout))
+        return statistics.median(times)
+
+    cases = {
+        'DatabaseConnections, emailer': 'import DatabaseConnections, emailer',
+        'eager drivers (før)': 'import pyodbc, sqlalchemy, sqlalchemy.types, numpy, pandas, shapely',
+    }
+    for label, code in cases.items():
+        try:
+            print(f'{label:30}: {startup(code) * 1000:8.1f} ms')
+        except subprocess.CalledProcessError as e:
+            print(f'{label:30}: fejlede ({e.stderr.strip().splitlines()[-1]})')
@@ -1,5 +1,46 @@
-import geopandas as gpd
-from shapely.geometry import box
+import collections
+import concurrent.futures
+import functools
+import math
+import numbers
+import time
+import numpy as np
+
+# geopandas, pyproj og shapely importeres først i de metoder, der bruger dem, så scripts der kun
+# opdeler eller beregner arealer ikke betaler for importen.
+
+
+@functools.lru_cache(maxsize=None)
+def _crs(crs):
+    """
+    Returnerer et cachet pyproj CRS-objekt for en koordinatsystem-angivelse som 'EPSG:25832'.
+    """
+    from pyproj import CRS
+    return CRS.from_user_input(crs)
+
+
+# Projicerede koordinatsystemer, som modulet bruger som standard; de kan afgøres uden at importere pyproj
+_PROJECTED = {'EPSG:25832', 'EPSG:25833', 'EPSG:3857'}
+
+
+def _is_geographic(crs):
+    """
+    Afgør, om et koordinatsystem er geografisk. De kendte projicerede systemer i `_PROJECTED` kræver ikke pyproj.
+    """
+    if isinstance(crs, str) and crs.strip().upper() in _PROJECTED:
+        return False
+    return _crs(crs).is_geographic
+
+
+@functools.lru_cache(maxsize=64)
+def _transformer(from_crs, to_crs):
+    """
+    Returnerer en cachet pyproj Transformer mellem to koordinatsystemer med x/y-rækkefølge (lon/lat).
+    Transformere er dyre at oprette, så de deles i hele processen.
+    """
+    from pyproj import Transformer
+    return Transformer.from_crs(_crs(from_crs), _crs(to_crs), always_xy=True)
+
 
 class BoundingBox:
     """
@@ -7,14 +48,18 @@ class BoundingBox:
 
     Klassen BoundingBox giver funktionalitet til at opbevare, opdele og beregne arealet af en bounding box. 
     Den kan returnere arealet i forskellige enheder som kvadratmeter, hektar og kvadratkilometer.
+    Med `grid` og `tile` kan en bounding box inddeles i mange fliser på én gang som et NumPy (N, 4)-array,
+    og med `reproject` kan mange fliser omregnes til et andet koordinatsystem på én gang.
 
     Attributter:
     -----------
     initBBOX : list
         Standard bounding box, der er angivet ved initialiseringen.
+    crs : str
+        Koordinatsystemet for bounding boxene (standard: 'EPSG:25832').
     """
 
-    def __init__(self, defaultBox):
+    def __init__(self, defaultBox, crs='EPSG:25832'):
         """
         Initialiserer BoundingBox-objektet med en standard bounding box.
 
@@ -22,8 +67,12 @@ class BoundingBox:
         ----------
         defaultBox : list
             En liste med fire værdier, der repræsenterer en standard bounding box i formatet [minx, miny, maxx, maxy].
+        crs : str, valgfri
+            Koordinatsystemet for bounding boxene (standard: 'EPSG:25832').
         """
         self.initBBOX = defaultBox
+        self.crs = crs
+        self.__reprojection = {'calls': 0, 'boxes': 0, 'seconds': 0.0}
 
     def defaultBBOX(self):
         """
@@ -72,35 +121,245 @@ class BoundingBox:
         
         return bboxes
     
-    def getArea(self, bbox, output='m2'):
+    def adaptiveSplit(self, bbox, probe, limit, max_workers=4, max_in_flight=None, max_depth=12, split='quad'):
+        """
+        Opdeler en bounding box adaptivt, indtil ingen flise indeholder `limit` features eller flere.
+
+        `probe` kaldes for hver flise (f.eks. en WFS-forespørgsel med count eller hentning af features).
+        Fliser, der rammer grænsen, opdeles og undersøges igen, mens de øvrige returneres med det samme, så
+        nedhentningen kan starte, før hele træet er gennemgået. Kaldene kører samtidigt på en trådpulje med
+        højst `max_in_flight` igangværende kald. Hver flise undersøges præcis én gang, da børnene af en
+        opdeling aldrig overlapper.
+
+        Parametre:
+        ----------
+        bbox : list
+            En liste med fire værdier, der repræsenterer en bounding box i formatet [minx, miny, maxx, maxy].
+        probe : callable
+            En funktion, der tager en flise [minx, miny, maxx, maxy] og returnerer antallet af features
+            eller en sekvens af features (hvor `len` bruges som antal).
+        limit : int
+            Antal features, hvor servicen anses for at have ramt sin grænse, og flisen skal opdeles.
+        max_workers : int, valgfri
+            Antal tråde (standard: 4).
+        max_in_flight : int, valgfri
+            Det maksimale antal samtidige kald til `probe` (standard: `max_workers`).
+        max_depth : int, valgfri
+            Den maksimale opdelingsdybde. Fliser på denne dybde returneres, selv om de rammer grænsen (standard: 12).
+        split : str, valgfri
+            'quad' opdeler i fire kvadranter, 'half' halverer langs den længste side som `splitBbox` (standard: 'quad').
+
+        Returnerer:
+        -----------
+        generator
+            Tupler (flise, resultat), hvor flise er [minx, miny, maxx, maxy] som floats og resultat er
+            returværdien fra `probe`.
+        """
+        if split not in ('quad', 'half'):
+            raise ValueError(f"Unknown split '{split}', use 'quad' or 'half'")
+        max_in_flight = max_in_flight or max_workers
+        pending = collections.deque([(tuple(float(v) for v in bbox), 0)])
+        in_flight = {}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='adaptiveSplit')
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < max_in_flight:
+                    tile, depth = pending.popleft()
+                    in_flight[executor.submit(probe, list(tile))] = (tile, depth)
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    tile, depth = in_flight.pop(future)
+                    result = future.result()
+                    count = int(result) if isinstance(result, numbers.Integral) else len(result)
+                    if count >= limit and depth < max_depth:
+                        # Børnene undersøges først, så færdige fliser når frem hurtigt, og køen forbliver lille
+                        children = self.__quadrants(tile) if split == 'quad' else \
+                            [tuple(float(v) for v in b) for b in self.splitBbox(tile)]
+                        pending.extendleft((child, depth + 1) for child in reversed(children))
+                    else:
+                        yield list(tile), result
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def __quadrants(tile):
+        minx, miny, maxx, maxy = tile
+        midx = minx + (maxx - minx) / 2
+        midy = miny + (maxy - miny) / 2
+        return [(minx, miny, midx, midy), (midx, miny, maxx, midy),
+                (minx, midy, midx, maxy), (midx, midy, maxx, maxy)]
+
+    def grid(self, bbox, nx, ny, overlap=0.0, as_str=False):
+        """
+        Inddeler en bounding box i et gitter af `nx` gange `ny` lige store fliser.
+
+        Alle fliser beregnes samlet med NumPy, og rækkefølgen er række for række nedefra (stigende y),
+        og inden for hver række fra venstre mod højre (stigende x).
+
+        Parametre:
+        ----------
+        bbox : list
+            En liste med fire værdier, der repræsenterer en bounding box i formatet [minx, miny, maxx, maxy].
+        nx : int
+            Antal fliser i x-retningen.
+        ny : int
+            Antal fliser i y-retningen.
+        overlap : float, valgfri
+            Margen i koordinatsystemets enheder, som hver flise udvides med til alle sider (standard: 0).
+        as_str : bool, valgfri
+            Returnér fliserne som lister af strenge ligesom `splitBbox` (standard: False).
+
+        Returnerer:
+        -----------
+        numpy.ndarray
+            Et (N, 4)-array af float med [minx, miny, maxx, maxy] pr. flise, eller en liste af strenglister,
+            hvis `as_str` er `True`.
+        """
+        minx, miny, maxx, maxy = (float(v) for v in bbox)
+        xs = np.linspace(minx, maxx, int(nx) + 1)
+        ys = np.linspace(miny, maxy, int(ny) + 1)
+        x0, y0 = np.meshgrid(xs[:-1], ys[:-1])
+        x1, y1 = np.meshgrid(xs[1:], ys[1:])
+        tiles = np.column_stack([x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel()])
+        if overlap:
+            tiles += np.array([-overlap, -overlap, overlap, overlap])
+        if as_str:
+            return self.asStrings(tiles)
+        return tiles
+
+    def tile(self, bbox, max_size=None, max_area=None, overlap=0.0, as_str=False):
+        """
+        Inddeler en bounding box i det mindste antal lige store fliser, der overholder en maksimal
+        sidelængde og/eller et maksimalt areal. Med `max_area` vælges antallet af kolonner ud fra
+        sqrt(areal / max_area) og boksens form, så fliserne er nær kvadratiske; en aflang bounding box deles
+        dog ikke i flere fliser end nødvendigt.
+
+        Parametre:
+        ----------
+        bbox : list
+            En liste med fire værdier, der repræsenterer en bounding box i formatet [minx, miny, maxx, maxy].
+        max_size : float, valgfri
+            Den maksimale bredde og højde af en flise i koordinatsystemets enheder.
+        max_area : float, valgfri
+            Det maksimale areal af en flise i koordinatsystemets enheder i anden (f.eks. m2).
+        overlap : float, valgfri
+            Margen, som hver flise udvides med til alle sider (standard: 0). Indgår ikke i størrelseskravene.
+        as_str : bool, valgfri
+            Returnér fliserne som lister af strenge ligesom `splitBbox` (standard: False).
+
+        Returnerer:
+        -----------
+        numpy.ndarray
+            Et (N, 4)-array af float med [minx, miny, maxx, maxy] pr. flise, se `grid`.
+        """
+        minx, miny, maxx, maxy = (float(v) for v in bbox)
+        width = maxx - minx
+        height = maxy - miny
+        nx = ny = 1
+        if max_size:
+            nx = max(nx, math.ceil(width / max_size))
+            ny = max(ny, math.ceil(height / max_size))
+        if max_area and width * height > max_area:
+            # Antallet af kolonner vælges, så fliserne bliver nær kvadratiske: sqrt(areal / max_area) justeret for
+            # boksens form og højst det nødvendige antal fliser. Rækkerne dækker så resten af arealkravet
+            needed = math.ceil(round(width * height / max_area, 9))
+            cols = min(needed, math.ceil(round(math.sqrt(needed * width / height), 9))) if height > 0 else needed
+            nx = max(nx, cols)
+            ny = max(ny, math.ceil(round(width * height / (max_area * nx), 9)))
+        return self.grid([minx, miny, maxx, maxy], nx, ny, overlap=overlap, as_str=as_str)
+
+    def asStrings(self, tiles):
+        """
+        Konverterer et (N, 4)-array af fliser til lister af strenge i samme format som `splitBbox`.
+
+        Parametre:
+        ----------
+        tiles : numpy.ndarray
+            Et (N, 4)-array med [minx, miny, maxx, maxy] pr. flise.
+
+        Returnerer:
+        -----------
+        list
+            En liste med en liste af fire strenge pr. flise.
+        """
+        return np.asarray(tiles, dtype=float).astype(str).tolist()
+
+    def toGeometry(self, tiles):
+        """
+        Konverterer et (N, 4)-array af fliser til et array af shapely-polygoner i ét vektoriseret kald.
+
+        Parametre:
+        ----------
+        tiles : numpy.ndarray
+            Et (N, 4)-array med [minx, miny, maxx, maxy] pr. flise.
+
+        Returnerer:
+        -----------
+        numpy.ndarray
+            Et array med en shapely-polygon pr. flise.
+        """
+        import shapely
+
+        tiles = np.asarray(tiles, dtype=float)
+        return shapely.box(tiles[:, 0], tiles[:, 1], tiles[:, 2], tiles[:, 3])
+
+    def toGeoDataFrame(self, tiles, crs=None):
+        """
+        Konverterer et (N, 4)-array af fliser til en GeoDataFrame med én polygon og koordinaterne pr. flise.
+
+        Parametre:
+        ----------
+        tiles : numpy.ndarray
+            Et (N, 4)-array med [minx, miny, maxx, maxy] pr. flise.
+        crs : str, valgfri
+            Fliserne koordinatsystem. Standard er objektets `crs`.
+
+        Returnerer:
+        -----------
+        GeoDataFrame
+            En GeoDataFrame med kolonnerne minx, miny, maxx, maxy og geometry.
+        """
+        import geopandas as gpd
+
+        tiles = np.asarray(tiles, dtype=float)
+        return gpd.GeoDataFrame({'minx': tiles[:, 0], 'miny': tiles[:, 1], 'maxx': tiles[:, 2], 'maxy': tiles[:, 3]},
+                                geometry=self.toGeometry(tiles), crs=crs or self.crs)
+
+    def getArea(self, bbox, output='m2', geodesic=False, crs=None):
         """
         Beregner arealet af en bounding box og returnerer det i den ønskede enhed.
 
+        Arealet beregnes direkte som bredde gange højde, da en bounding box i et projiceret koordinatsystem
+        (som standardens EPSG:25832) er et akseparallelt rektangel. Kun ved `geodesic=True` eller et geografisk
+        koordinatsystem bygges geometrien og arealet beregnes via GeoPandas/pyproj.
+
         Parametre:
         ----------
         bbox : list
             En liste med fire værdier, der repræsenterer en bounding box i formatet [minx, miny, maxx, maxy].
         output : str, valgfri
             Enheden for arealet, som enten kan være 'm2' (kvadratmeter), 'ha' (hektar) eller 'km2' (kvadratkilometer). 
-            Standard er 'm2'.
+            'all' returnerer alle tre enheder i en ordbog. Standard er 'm2'.
+        geodesic : bool, valgfri
+            Beregn det geodætiske areal på ellipsoiden i stedet for det plane areal (standard: False).
+        crs : str, valgfri
+            Koordinatsystemet for bounding boxen. Standard er objektets `crs`.
 
         Returnerer:
         -----------
         float
-            Arealet af bounding boxen i den valgte enhed.
+            Arealet af bounding boxen i den valgte enhed, eller en ordbog med 'm2', 'ha' og 'km2', hvis `output` er 'all'.
         """
         minx = float(bbox[0])
         miny = float(bbox[1])
         maxx = float(bbox[2])
         maxy = float(bbox[3])
 
-        bbox = box(minx, miny, maxx, maxy)
-
-        # Opretter en GeoDataFrame med bounding box polygonen
-        gdf = gpd.GeoDataFrame({'geometry': [bbox]}, crs="EPSG:25832")  # Antager at koordinaterne er i WGS 84
-
-        # Beregner arealet i kvadratmeter
-        area_m2 = round(gdf['geometry'].area[0], 2)
+        crs = crs or self.crs
+        if geodesic or _is_geographic(crs):
+            area_m2 = round(self.__geoArea((minx, miny, maxx, maxy), crs, geodesic), 2)
+        else:
+            area_m2 = round(abs((maxx - minx) * (maxy - miny)), 2)
 
         # Konverterer til kvadratkilometer
         area_km2 = round(area_m2 / 1_000_000, 2)
@@ -108,9 +367,133 @@ class BoundingBox:
         # Konverterer til hektar
         area_ha = round(area_m2 / 10_000, 2)
 
-        if output == 'km2':
+        if output == 'all':
+            return {'m2': area_m2, 'ha': area_ha, 'km2': area_km2}
+        elif output == 'km2':
             return area_km2
         elif output == 'ha':
             return area_ha
         else:
             return area_m2
+
+    def getAreas(self, bboxes):
+        """
+        Beregner arealet af mange bounding boxes på én gang i et projiceret koordinatsystem.
+
+        Parametre:
+        ----------
+        bboxes : numpy.ndarray eller list
+            Et (N, 4)-array eller en liste af bounding boxes i formatet [minx, miny, maxx, maxy].
+
+        Returnerer:
+        -----------
+        dict
+            En ordbog med 'm2', 'ha' og 'km2' som nøgler og et NumPy-array med N arealer som værdi,
+            afrundet til to decimaler som i `getArea`.
+        """
+        bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+        area_m2 = np.round(np.abs((bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])), 2)
+        return {'m2': area_m2, 'ha': np.round(area_m2 / 10_000, 2), 'km2': np.round(area_m2 / 1_000_000, 2)}
+
+    def reproject(self, bboxes, to_crs, from_crs=None, densify=21):
+        """
+        Omregner mange bounding boxes til et andet koordinatsystem på én gang.
+
+        Hver kant fortættes med `densify` mellempunkter, før alle punkter for alle bokse transformeres i ét
+        kald, og den nye bounding box er punkternes omsluttende rektangel. Det sikrer, at den omregnede boks
+        dækker hele den oprindelige, selv om kanterne krummer. Transformeren caches for hele processen.
+
+        Parametre:
+        ----------
+        bboxes : numpy.ndarray eller list
+            En bounding box eller et (N, 4)-array af bounding boxes i formatet [minx, miny, maxx, maxy].
+        to_crs : str
+            Målkoordinatsystemet, f.eks. 'EPSG:4326' eller 'EPSG:3857'.
+        from_crs : str, valgfri
+            Kildekoordinatsystemet. Standard er objektets `crs`.
+        densify : int, valgfri
+            Antal mellempunkter pr. kant (standard: 21).
+
+        Returnerer:
+        -----------
+        numpy.ndarray
+            Et (N, 4)-array af float med de omregnede bounding boxes. Akserne er altid x/y (lon/lat).
+        """
+        start = time.perf_counter()
+        bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+        minx, miny, maxx, maxy = (bboxes[:, i:i + 1] for i in range(4))
+        t = np.linspace(0.0, 1.0, densify + 2)
+        xs_edge = minx + (maxx - minx) * t
+        ys_edge = miny + (maxy - miny) * t
+        ones = np.ones_like(t)
+        # Nederste, øverste, venstre og højre kant som (N, 4 * punkter) arrays
+        xs = np.hstack([xs_edge, xs_edge, minx * ones, maxx * ones])
+        ys = np.hstack([miny * ones, maxy * ones, ys_edge, ys_edge])
+
+        tx, ty = _transformer(from_crs or self.crs, to_crs).transform(xs.ravel(), ys.ravel())
+        tx = np.where(np.isfinite(tx), tx, np.nan).reshape(xs.shape)
+        ty = np.where(np.isfinite(ty), ty, np.nan).reshape(ys.shape)
+        result = np.column_stack([np.nanmin(tx, axis=1), np.nanmin(ty, axis=1),
+                                  np.nanmax(tx, axis=1), np.nanmax(ty, axis=1)])
+
+        self.__reprojection['calls'] += 1
+        self.__reprojection['boxes'] += len(bboxes)
+        self.__reprojection['seconds'] += time.perf_counter() - start
+        return result
+
+    def reprojectionStats(self):
+        """
+        Returnerer tidsforbruget for `reproject` på dette objekt samt den delte transformer-caches tællere.
+
+        Returnerer:
+        -----------
+        dict
+            Antal kald (`calls`), omregnede bokse (`boxes`), samlet tid (`seconds`), tid pr. 1000 bokse i
+            millisekunder (`ms_per_1000_boxes`) og hits/misses i transformer-cachen.
+        """
+        stats = dict(self.__reprojection)
+        stats['ms_per_1000_boxes'] = stats['seconds'] * 1_000_000 / stats['boxes'] if stats['boxes'] else 0.0
+        cache = _transformer.cache_info()
+        stats['transformer_cache_hits'] = cache.hits
+        stats['transformer_cache_misses'] = cache.misses
+        return stats
+
+    @staticmethod
+    def __geoArea(bbox, crs, geodesic):
+        """
+        Beregner arealet i m2 af en bounding box via GeoPandas: geodætisk på ellipsoiden, eller plant i
+        en estimeret UTM-zone, hvis koordinatsystemet er geografisk.
+        """
+        import geopandas as gpd
+        import shapely
+
+        gdf = gpd.GeoDataFrame({'geometry': [shapely.box(*bbox)]}, crs=crs)
+        if geodesic:
+            from pyproj import Geod
+            area, _ = Geod(ellps='GRS80').geometry_area_perimeter(gdf.to_crs('EPSG:4326').geometry[0])
+            return abs(area)
+        return gdf.to_crs(gdf.estimate_utm_crs()).area[0]
+
+
+if __name__ == "__main__":
+    # Mikrobenchmark af getArea: den tidligere GeoDataFrame-beregning mod den direkte beregning
+    import timeit
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    bb = BoundingBox([440000, 6250000, 480000, 6300000])
+    bbox = ['440000', '6250000', '441000', '6251000']
+
+    def old_getArea(bbox):
+        gdf = gpd.GeoDataFrame({'geometry': [box(*(float(v) for v in bbox))]}, crs="EPSG:25832")
+        return round(gdf['geometry'].area[0], 2)
+
+    tiles = bb.grid(bb.defaultBBOX(), 100, 100)
+    for label, func, number in [('før (GeoDataFrame)', lambda: old_getArea(bbox), 200),
+                                ('getArea', lambda: bb.getArea(bbox), 100_000),
+                                ('getAreas, 10.000 fliser', lambda: bb.getAreas(tiles), 1_000)]:
+        seconds = timeit.timeit(func, number=number) / number
+        print(f'{label:25}: {seconds * 1_000_000:10.2f} µs pr. kald')
+
+    bb.reproject(tiles, 'EPSG:4326')
+    print(f"reproject til EPSG:4326 : {bb.reprojectionStats()['ms_per_1000_boxes']:10.2f} ms pr. 1000 fliser")
@@ -1,12 +1,117 @@
 import smtplib
-import email
+import atexit
+import base64
+import contextlib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.header import Header
 from email.mime.base import MIMEBase
-from email import encoders
-import json
 import os.path
+import functools
+import html as html_lib
+import json
+import mimetypes
+import pathlib
+import queue
+import random
+import shutil
+import string
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+
+try:
+    from .args_loader import load_args
+except ImportError:
+    from args_loader import load_args
+
+@functools.lru_cache(maxsize=128)
+def _compile(template):
+    """
+    Deler en `string.Template`-skabelon op i faste tekststykker og pladsholdere. Resultatet caches, så
+    samme skabelon kun parses én gang pr. proces.
+
+    Parametre:
+    ----------
+    template : str
+        Skabelonen med pladsholdere som `$navn` eller `${navn}`. `$$` giver et dollartegn.
+
+    Returnerer:
+    -----------
+    tuple
+        Stykker på formen (False, tekst) eller (True, navn).
+    """
+    segments = []
+    literal = []
+    pos = 0
+    for match in string.Template.pattern.finditer(template):
+        literal.append(template[pos:match.start()])
+        pos = match.end()
+        if match.group('escaped') is not None:
+            literal.append(string.Template.delimiter)
+            continue
+        name = match.group('named') or match.group('braced')
+        if name is None:
+            raise ValueError(f'Invalid placeholder in template at position {match.start()}')
+        segments.append((False, ''.join(literal)))
+        segments.append((True, name))
+        literal = []
+    literal.append(template[pos:])
+    segments.append((False, ''.join(literal)))
+    return tuple(segment for segment in segments if segment != (False, ''))
+
+
+def _bind(segments, context, escape=False, partial=True):
+    """
+    Indsætter værdierne fra `context` i en kompileret skabelon og slår tilstødende tekststykker sammen.
+
+    Parametre:
+    ----------
+    segments : tuple
+        En skabelon fra `_compile`.
+    context : dict
+        Værdierne til pladsholderne.
+    escape : bool, valgfri
+        HTML-escaper værdierne. Værdier med en `__html__`-metode, f.eks. `markupsafe.Markup`, indsættes
+        uændret (standard: False).
+    partial : bool, valgfri
+        Lader pladsholdere uden værdi stå, så de kan udfyldes senere. Ellers giver de en KeyError (standard: True).
+
+    Returnerer:
+    -----------
+    tuple
+        En ny, kortere skabelon. Er alle pladsholdere udfyldt, består den af ét tekststykke.
+    """
+    bound = []
+    for is_field, value in segments:
+        if is_field:
+            if value not in context:
+                if not partial:
+                    raise KeyError(f"Missing template value '{value}'")
+                bound.append((True, value))
+                continue
+            value = context[value]
+            if escape and hasattr(value, '__html__'):
+                value = value.__html__()
+            elif escape:
+                value = html_lib.escape(str(value))
+            else:
+                value = str(value)
+        if bound and not bound[-1][0]:
+            bound[-1] = (False, bound[-1][1] + value)
+        else:
+            bound.append((False, value))
+    return tuple(bound)
+
+
+def _render(segments, context, escape=False):
+    """
+    Danner den færdige tekst ud fra en (delvist udfyldt) skabelon og `context`.
+    """
+    return ''.join(segment[1] for segment in _bind(segments, context, escape, partial=False))
+
 
 class Mailer:
     """
@@ -15,6 +120,20 @@ class Mailer:
     Mailer-klassen indlæser e-mailkonfiguration fra en JSON-fil og bruger SMTP til at sende e-mails.
     Den kan sende e-mails med både tekst- og HTML-indhold samt vedhæfte filer.
 
+    Brugt som context manager holdes én godkendt SMTP-forbindelse åben for alle afsendelser i blokken:
+
+        with Mailer() as mailer:
+            for afdeling, modtagere in rapporter.items():
+                mailer.sendmail(f'Rapport {afdeling}', modtagere, text=...)
+
+    Uden for en `with`-blok åbnes og lukkes forbindelsen ved hver `sendmail` som hidtil.
+
+    Med `queued=True` returnerer `sendmail` med det samme. E-mailen gemmes i en spool-mappe og afleveres af
+    baggrundstråde, der prøver igen med eksponentiel backoff, hvis serveren ikke svarer. E-mails, der ikke
+    kan afleveres, flyttes til undermappen `dead`. `close()`, slutningen af en `with`-blok og afslutningen af
+    Python venter en begrænset tid på køen og stopper trådene. E-mails, der stadig ligger i spool-mappen,
+    afleveres af den næste Mailer i kø-tilstand med samme spool-mappe.
+
     Attributter:
     -----------
     __smtp_port : int
@@ -27,32 +146,125 @@ class Mailer:
         Brugernavn til SMTP-serveren.
     __server_pass : str
         Adgangskode til SMTP-serveren.
+    keepalive : float
+        Antal sekunder en åben forbindelse må være ubrugt, før den kontrolleres med NOOP inden næste afsendelse.
+
+    Bemærkninger:
+    -------------
+    Vedhæftede filer læses og base64-kodes i bidder, mens beskeden skrives til en midlertidig fil, som
+    derefter streames til serveren. Hukommelsesforbruget afhænger derfor ikke af filernes størrelse.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, keepalive=30, timeout=60, queued=False, spool_dir=None, workers=2, max_attempts=8,
+                 backoff=5, max_backoff=900, max_attachment_size=None, oversize='link',
+                 compress_threshold=1024 * 1024, starttls=True) -> None:
         """
-        Initialiserer Mailer-objektet ved at indlæse konfigurationsindstillinger fra en JSON-fil.
+        Initialiserer Mailer-objektet med konfigurationsindstillinger fra emailer_args.json.
+        Filen parses kun én gang pr. proces, og værdierne kan overstyres med miljøvariabler (se `load_args`).
+
+        Parametre:
+        ----------
+        keepalive : float, valgfri
+            Antal sekunder en åben forbindelse må være ubrugt, før den kontrolleres med NOOP (standard: 30).
+        timeout : float, valgfri
+            Timeout i sekunder for forbindelsen til SMTP-serveren (standard: 60).
+        queued : bool, valgfri
+            Afleverer e-mails fra en spool-mappe i baggrunden i stedet for at vente på serveren (standard: False).
+        spool_dir : str, valgfri
+            Spool-mappen. Standard er `spool_dir` fra konfigurationen eller `emailer_spool` i den midlertidige mappe.
+        workers : int, valgfri
+            Antal baggrundstråde og dermed samtidige forbindelser til serveren (standard: 2).
+        max_attempts : int, valgfri
+            Antal forsøg, før en e-mail flyttes til `dead` (standard: 8).
+        backoff : float, valgfri
+            Ventetid i sekunder efter første fejl. Fordobles ved hvert forsøg (standard: 5).
+        max_backoff : float, valgfri
+            Den længste ventetid mellem to forsøg i sekunder (standard: 900).
+        max_attachment_size : int, valgfri
+            Den største tilladte vedhæftede fil i bytes efter eventuel komprimering (standard: ingen grænse).
+        oversize : str, valgfri
+            Hvad der sker med en for stor fil: 'link' vedhæfter den ikke, men skriver et link til den i en
+            note i e-mailen; 'truncate' vedhæfter de sidste `max_attachment_size` bytes (standard: 'link').
+        compress_threshold : int, valgfri
+            Tekst- og logfiler større end dette antal bytes pakkes som zip, før de vedhæftes. None slår
+            komprimeringen fra (standard: 1 MB).
+        starttls : bool, valgfri
+            Kræver STARTTLS, før der sendes. `False` tillader ukrypterede forbindelser til et internt relæ uden
+            login; er der angivet brugernavn, kræves STARTTLS stadig (standard: True).
         """
-        module_dir = os.path.dirname(__file__)
-        args_path = os.path.join(module_dir, 'emailer_args.json')
-        with open(args_path, 'r') as f:
-            self.__args = json.load(f)
-        self.__smtp_port = 587
+        if oversize not in ('link', 'truncate'):
+            raise ValueError(f"Unknown oversize policy '{oversize}', use 'link' or 'truncate'")
+        self.__args = load_args('emailer')
+        self.__smtp_port = int(self.__args.get('smtp_port', 587))
         self.__smtp_server = self.__args['smtp_server']
         self.__sender_email = self.__args['sender']
         self.__server_user = self.__args['user']
         self.__server_pass = self.__args['pass']
+        self.keepalive = keepalive
+        self.__timeout = timeout
+        self.__starttls = starttls
+        self.__server = None
+        self.__last_used = 0.0
+        self.__persistent = 0
+        self.__max_attachment_size = max_attachment_size
+        self.__oversize = oversize
+        self.__compress_threshold = compress_threshold
+        self.queued = queued
+        if queued:
+            self.spool_dir = spool_dir or self.__args.get('spool_dir') or os.path.join(tempfile.gettempdir(),
+                                                                                       'emailer_spool')
+            self.__dead_dir = os.path.join(self.spool_dir, 'dead')
+            os.makedirs(self.__dead_dir, exist_ok=True)
+            self.__max_attempts = max_attempts
+            self.__backoff = backoff
+            self.__max_backoff = max_backoff
+            self.__spool = queue.PriorityQueue()
+            self.__pending = set()
+            self.__pending_cond = threading.Condition()
+            self.__stop = threading.Event()
+            self.__num_workers = workers
+            self.__workers = []
+            self.__recover()
+            self.__start_workers()
+
+    def __enter__(self):
+        self.__persistent += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__persistent -= 1
+        if self.__persistent == 0:
+            self.close()
+
+    @contextlib.contextmanager
+    def __hold(self):
+        """
+        Holder forbindelsen åben under et internt batch-kald. I modsætning til `with mailer:` lukkes kun
+        forbindelsen bagefter, så kø-tilstandens baggrundstråde fortsætter.
+        """
+        self.__persistent += 1
+        try:
+            yield
+        finally:
+            self.__persistent -= 1
+            if self.__persistent == 0:
+                self.__server = self.__quit(self.__server)
 
-    def __msg(self):
+    def __msg(self, subtype='alternative'):
         """
         Opretter en MIMEMultipart-e-mailbesked med de angivne parametre.
 
+        Parametre:
+        ----------
+        subtype : str, valgfri
+            'alternative' for tekst og HTML alene, 'mixed' når der er vedhæftede filer (standard: 'alternative').
+
         Returnerer:
         -----------
         MIMEMultipart
             En e-mailbesked med de relevante headers som 'Subject', 'From' og 'To'.
         """
-        self.message = MIMEMultipart('alternative')
+        self.message = MIMEMultipart(subtype)
         self.message['Subject'] = self.subject
         self.message['From'] = self.__sender_email
         self.message['To'] = self.__receiver_emails
@@ -62,6 +274,10 @@ class Mailer:
         """
         Opretter en vedhæftet fil til e-mailen.
 
+        Filens indhold læses ikke her. Delen får en pladsholder som indhold, som erstattes af den
+        base64-kodede fil, når beskeden skrives (se `__render`). Store tekst- og logfiler pakkes som zip i en
+        midlertidig fil, og filer over `max_attachment_size` håndteres efter `oversize`.
+
         Parametre:
         ----------
         filename : str
@@ -69,15 +285,45 @@ class Mailer:
 
         Returnerer:
         -----------
-        MIMEBase
-            En MIMEBase-objekt, der repræsenterer den vedhæftede fil.
+        tuple
+            (MIMEBase, kilde, note). Kilden er en dict med pladsholderen og det, der skal kodes. Hvis filen ikke
+            vedhæftes, er delen og kilden None, og noten forklarer hvorfor.
         """
-        if filename is not None:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(open(filename, 'rb').read())
-            email.encoders.encode_base64(part)
-            part.add_header('Content-Disposition', 'attachment; filename="%s"' % os.path.basename(filename))
-            return part
+        name = os.path.basename(filename)
+        size = os.path.getsize(filename)
+        source = {'token': f'@@ATTACHMENT-{uuid.uuid4().hex}@@', 'path': filename, 'file': None, 'offset': 0,
+                  'size': size, 'encoded': None}
+        mime = mimetypes.guess_type(filename)[0] or ''
+        is_text = mime.startswith('text/') or filename.lower().endswith(('.log', '.csv', '.gml', '.json', '.sql'))
+        if self.__compress_threshold is not None and is_text and size > self.__compress_threshold:
+            packed = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+            with zipfile.ZipFile(packed, 'w', zipfile.ZIP_DEFLATED) as zf:
+                with open(filename, 'rb') as f_in, zf.open(name, 'w', force_zip64=True) as f_out:
+                    shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+            source.update(file=packed, size=packed.tell())
+            name += '.zip'
+        note = None
+        limit = self.__max_attachment_size
+        if limit is not None and source['size'] > limit:
+            if self.__oversize == 'link':
+                if source['file'] is not None:
+                    source['file'].close()
+                note = (f"Attachment '{os.path.basename(filename)}' ({size / 1024 ** 2:.1f} MB) exceeds the "
+                        f"{limit / 1024 ** 2:.1f} MB limit and was not attached: "
+                        f"{pathlib.Path(filename).resolve().as_uri()}")
+                return None, None, note
+            # Ved afkortning vedhæftes slutningen af den ukomprimerede fil, hvor de seneste linjer i en log står
+            if source['file'] is not None:
+                source['file'].close()
+                name = os.path.basename(filename)
+            source.update(file=None, offset=size - limit, size=limit)
+            note = (f"Attachment '{name}' ({size / 1024 ** 2:.1f} MB) exceeds the {limit / 1024 ** 2:.1f} MB "
+                    f"limit; only the last {limit / 1024 ** 2:.1f} MB is attached.")
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(source['token'])
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=name)
+        return part, source, note
 
     def sendmail(self, subject: str, tos: list = None, text: str = None, html: str = None, filename: str = None):
         """
@@ -93,45 +339,660 @@ class Mailer:
             E-mailens tekstindhold.
         html : str, valgfri
             E-mailens HTML-indhold.
-        filename : str, valgfri
-            Stien til en fil, der skal vedhæftes til e-mailen.
+        filename : str eller list, valgfri
+            Stien til en fil eller en liste af stier til filer, der skal vedhæftes til e-mailen.
+
+        Returnerer:
+        -----------
+        dict eller str
+            De modtagere, serveren afviste, med SMTP-kode og svar. Tom, hvis alle blev accepteret.
+            I kø-tilstand returneres e-mailens id i spool-mappen i stedet.
         """
         self.subject = subject
         self.tos = tos
         self.text = text
         self.html = html
         self.filename = filename
-        if self.tos is not None:
-            self.__receiver_emails = ', '.join(tos)
+        msg, recipients, sources = self.__build(subject, tos, text, html, filename)
+        if self.queued:
+            return self.__enqueue(msg, recipients, sources)
+        return self.__send(msg, recipients, sources)
+
+    def send_many(self, messages):
+        """
+        Sender flere e-mails efter hinanden over én SMTP-forbindelse.
+
+        En fejl ved én e-mail stopper ikke de øvrige; fejlen noteres for e-mailens modtagere.
+
+        Parametre:
+        ----------
+        messages : iterable
+            E-mails som dicts med samme nøgler som argumenterne til `sendmail`, f.eks.
+            `{'subject': 'Rapport', 'tos': ['a@lk.dk'], 'html': '...'}`.
+
+        Returnerer:
+        -----------
+        list
+            Én dict pr. e-mail, der for hver modtager angiver None, hvis serveren accepterede den, og ellers
+            en tuple (SMTP-kode, svar). Kode er None, hvis fejlen ikke kom fra serveren.
+            I kø-tilstand returneres e-mailenes id'er i spool-mappen i stedet.
+        """
+        if self.queued:
+            return [self.__enqueue(*self.__build(**kwargs)) for kwargs in messages]
+        with self.__hold():
+            return [self.__try_send(*self.__build(**kwargs)) for kwargs in messages]
+
+    def send_template(self, subject, recipients, text=None, html=None, filename=None, context=None):
+        """
+        Sender samme skabelon til flere modtagere med hver sit indhold.
+
+        Emne, tekst og HTML er `string.Template`-skabeloner (`$navn` eller `${navn}`). Skabelonerne kompileres
+        én gang, og værdierne i `context`, der er fælles for alle, indsættes én gang, så kun de personlige
+        værdier indsættes pr. e-mail. Vedhæftede filer base64-kodes én gang og genbruges i alle e-mails.
+        Værdier i HTML-skabelonen HTML-escapes, undtagen værdier med en `__html__`-metode (f.eks. en færdig
+        HTML-tabel pakket i `markupsafe.Markup`).
+
+        Parametre:
+        ----------
+        subject : str
+            Skabelon til emnet.
+        recipients : list
+            Én dict pr. e-mail med nøglerne 'tos' (liste af adresser) og 'context' (personlige værdier).
+        text : str, valgfri
+            Skabelon til tekstindholdet.
+        html : str, valgfri
+            Skabelon til HTML-indholdet.
+        filename : str eller list, valgfri
+            Stien til en eller flere filer, der vedhæftes alle e-mails.
+        context : dict, valgfri
+            Værdier, der er fælles for alle e-mails. En modtagers personlige værdi med samme navn har forrang.
+
+        Returnerer:
+        -----------
+        list
+            Som `send_many`: én dict pr. e-mail med resultatet for hver modtager, eller id'er i kø-tilstand.
+        """
+        recipients = list(recipients)
+        # Personlige værdier har forrang for de fælles ({**context, **personlige}), så kun fælles værdier, som
+        # ingen modtager overstyrer, indsættes på forhånd; resten flettes ind pr. e-mail
+        overridden = set().union(*((recipient.get('context') or {}).keys() for recipient in recipients))
+        shared = {k: v for k, v in (context or {}).items() if k not in overridden}
+        fallback = {k: v for k, v in (context or {}).items() if k in overridden}
+        templates = {key: _bind(_compile(template), shared, escape=key == 'html')
+                     for key, template in (('subject', subject), ('text', text), ('html', html)) if template is not None}
+        attachments = self.__attachments(filename, shared=True)
+        results = []
+        try:
+            with self.__hold():
+                for recipient in recipients:
+                    values = {**fallback, **(recipient.get('context') or {})}
+                    rendered = {key: _render(segments, values, escape=key == 'html')
+                                for key, segments in templates.items()}
+                    msg, tos, sources = self.__build(rendered['subject'], recipient.get('tos'), rendered.get('text'),
+                                                     rendered.get('html'), attachments=attachments)
+                    if self.queued:
+                        results.append(self.__enqueue(msg, tos, sources))
+                    else:
+                        results.append(self.__try_send(msg, tos, sources))
+        finally:
+            for _, source, _ in attachments:
+                if source is not None and source['encoded'] is not None:
+                    source['encoded'].close()
+        return results
+
+    def __try_send(self, msg, recipients, sources):
+        """
+        Sender en e-mail og returnerer resultatet pr. modtager i stedet for at rejse en undtagelse.
+        """
+        try:
+            refused = self.__send(msg, recipients, sources)
+        except smtplib.SMTPRecipientsRefused as e:
+            refused = e.recipients
+        except (smtplib.SMTPException, OSError) as e:
+            code = getattr(e, 'smtp_code', None)
+            refused = {r: (code, str(e)) for r in recipients}
+        return {r: refused.get(r) for r in recipients}
+
+    def __attachments(self, filename, shared=False):
+        """
+        Forbereder en eller flere vedhæftede filer med `__attachment`.
+
+        Parametre:
+        ----------
+        filename : str eller list
+            Stien til en fil eller en liste af stier.
+        shared : bool, valgfri
+            Base64-koder filerne med det samme til midlertidige filer, så de kan genbruges i flere e-mails
+            uden at blive læst og kodet igen (standard: False).
+
+        Returnerer:
+        -----------
+        list
+            (MIMEBase, kilde, note) for hver fil.
+        """
+        if filename is None:
+            filenames = []
+        elif isinstance(filename, (str, os.PathLike)):
+            filenames = [filename]
+        else:
+            filenames = list(filename)
+        attachments = [self.__attachment(path) for path in filenames]
+        if shared:
+            for _, source, _ in attachments:
+                if source is None:
+                    continue
+                encoded = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+                self.__write_source(source, encoded)
+                if source['file'] is not None:
+                    source['file'].close()
+                source.update(file=None, encoded=encoded)
+        return attachments
+
+    def __build(self, subject, tos=None, text=None, html=None, filename=None, attachments=None):
+        """
+        Sammensætter en e-mail og listen over modtagere.
+
+        Parametre:
+        ----------
+        attachments : list, valgfri
+            Vedhæftede filer, der allerede er forberedt med `__attachments`. Bruges i stedet for `filename`.
+
+        Returnerer:
+        -----------
+        tuple
+            (MIMEMultipart, list, list) med beskeden, modtagernes adresser og kilderne til de vedhæftede filer.
+        """
+        self.subject = subject
+        if tos is not None:
+            recipients = list(tos)
         else:
-            self.__receiver_emails = self.__args['sender']
-        msg = self.__msg()
-        if self.text is not None:
-            part1 = MIMEText(self.text, 'plain')
-            msg.attach(part1)
-        if self.html is not None:
-            part2 = MIMEText(self.html, 'html')
-            msg.attach(part2)
+            recipients = [self.__args['sender']]
+        self.__receiver_emails = ', '.join(recipients)
+        if attachments is None:
+            attachments = self.__attachments(filename)
+        msg = self.__msg('mixed' if attachments else 'alternative')
+        # Med vedhæftede filer ligger tekst og HTML i en 'alternative'-del inde i den ydre 'mixed'-del
+        body = MIMEMultipart('alternative') if attachments else msg
+        if text is not None:
+            part1 = MIMEText(text, 'plain')
+            body.attach(part1)
+        if html is not None:
+            part2 = MIMEText(html, 'html')
+            body.attach(part2)
+        if attachments and body.get_payload():
+            msg.attach(body)
 
-        if self.filename is not None:
-            msg.attach(self.__attachment(filename))
+        parts, sources, notes = [], [], []
+        for part, source, note in attachments:
+            if part is not None:
+                parts.append(part)
+                sources.append(source)
+            if note is not None:
+                notes.append(note)
+        if notes:
+            msg.attach(MIMEText('\n'.join(notes), 'plain'))
+        for part in parts:
+            msg.attach(part)
+        return msg, recipients, sources
 
-        self.__send(msg)
+    def __render(self, msg, sources, out):
+        """
+        Skriver beskeden med CRLF-linjeskift til `out` og erstatter pladsholderne med de vedhæftede filer,
+        der læses og base64-kodes i bidder. Kildernes midlertidige filer lukkes bagefter.
+        """
+        data = msg.as_bytes(policy=msg.policy.clone(linesep='\r\n'))
+        try:
+            for source in sources:
+                token = source['token'].encode('ascii')
+                head, data = data.split(token, 1)
+                out.write(head)
+                self.__write_source(source, out)
+            out.write(data)
+        finally:
+            for source in sources:
+                if source['file'] is not None:
+                    source['file'].close()
+        out.seek(0)
+        return out
 
-    def __send(self, msg):
+    def __write_source(self, source, out):
+        """
+        Skriver en vedhæftet fil base64-kodet til `out`. Er filen allerede kodet, kopieres den kodede udgave.
+        """
+        if source['encoded'] is not None:
+            source['encoded'].seek(0)
+            shutil.copyfileobj(source['encoded'], out, 1024 * 1024)
+        elif source['file'] is not None:
+            source['file'].seek(0)
+            self.__encode(source['file'], out, source['size'])
+        else:
+            with open(source['path'], 'rb') as f:
+                f.seek(source['offset'])
+                self.__encode(f, out, source['size'])
+
+    @staticmethod
+    def __encode(f, out, size):
+        """
+        Base64-koder `size` bytes fra `f` til `out` i linjer á 76 tegn uden at læse hele filen i hukommelsen.
+        """
+        # 57 bytes giver præcis én linje på 76 tegn, så bidderne kan kodes hver for sig
+        chunk_size = 57 * 1024
+        first = True
+        while size > 0:
+            chunk = f.read(min(chunk_size, size))
+            if not chunk:
+                break
+            size -= len(chunk)
+            encoded = base64.encodebytes(chunk).replace(b'\n', b'\r\n')
+            if first:
+                first = False
+            else:
+                out.write(b'\r\n')
+            out.write(encoded[:-2])
+
+    def __stream(self, server, sender, recipients, f):
+        """
+        Sender en færdig besked fra filen `f` med MAIL, RCPT og DATA og streamer indholdet i bidder
+        i stedet for at holde hele beskeden i hukommelsen som `smtplib.SMTP.sendmail`.
+
+        Returnerer:
+        -----------
+        dict
+            De afviste modtagere, se `smtplib.SMTP.sendmail`.
+        """
+        server.ehlo_or_helo_if_needed()
+        code, resp = server.mail(sender)
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, sender)
+        refused = {}
+        for recipient in recipients:
+            code, resp = server.rcpt(recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, resp)
+        if len(refused) == len(recipients):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        server.putcmd('data')
+        code, resp = server.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+        buffer, buffered = [], 0
+        last = b'\r\n'
+        for line in f:
+            # Linjer, der starter med et punktum, fordobles (RFC 5321, afsnit 4.5.2)
+            if line[:1] == b'.':
+                line = b'.' + line
+            buffer.append(line)
+            buffered += len(line)
+            last = line
+            if buffered >= 64 * 1024:
+                server.send(b''.join(buffer))
+                buffer, buffered = [], 0
+        if not last.endswith(b'\r\n'):
+            buffer.append(b'\r\n')
+        buffer.append(b'.\r\n')
+        server.send(b''.join(buffer))
+        code, resp = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+    def __open(self):
+        """
+        Åbner en forbindelse til SMTP-serveren med STARTTLS og login. STARTTLS kan kun fravælges med
+        `starttls=False`, når der ikke er angivet et brugernavn, så adgangskoden aldrig sendes ukrypteret.
+
+        Returnerer:
+        -----------
+        smtplib.SMTP
+            Den åbne forbindelse.
+        """
+        server = smtplib.SMTP(self.__smtp_server, self.__smtp_port, timeout=self.__timeout)
+        server.ehlo()
+        if self.__starttls or self.__server_user:
+            if not server.has_extn('starttls'):
+                server.close()
+                raise smtplib.SMTPNotSupportedError('The SMTP server does not offer STARTTLS')
+            server.starttls()
+            server.ehlo()
+        if self.__server_user:
+            server.login(self.__server_user, self.__server_pass)
+        return server
+
+    def __connect(self):
+        """
+        Åbner Mailerens egen forbindelse og lukker en eventuel gammel.
+        """
+        self.__server = self.__quit(self.__server)
+        self.server = self.__open()
+        self.__server = self.server
+        self.__last_used = time.monotonic()
+
+    def __session(self):
+        """
+        Returnerer en åben forbindelse. En forbindelse, der har været ubrugt længere end `keepalive`,
+        kontrolleres med NOOP og genåbnes, hvis serveren har lukket den.
+        """
+        if self.__server is None:
+            self.__connect()
+        elif time.monotonic() - self.__last_used > self.keepalive:
+            try:
+                alive = self.__server.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                alive = False
+            if not alive:
+                self.__connect()
+        return self.__server
+
+    def __send(self, msg, recipients, sources=()):
         """
         Sender den sammensatte e-mailbesked via SMTP.
 
+        Forbindelsen genbruges inden for en `with`-blok og genåbnes én gang, hvis serveren har lukket den.
+
         Parametre:
         ----------
         msg : MIMEMultipart
             Den e-mailbesked, der skal sendes.
+        recipients : list
+            Modtagernes adresser.
+        sources : list, valgfri
+            Kilderne til de vedhæftede filer fra `__build`.
+
+        Returnerer:
+        -----------
+        dict
+            De afviste modtagere, se `smtplib.SMTP.sendmail`.
         """
         self.msg = msg
-        self.server = smtplib.SMTP(self.__smtp_server, self.__smtp_port)
-        self.server.ehlo()
-        self.server.starttls()
-        self.server.ehlo()
-        self.server.login(self.__server_user, self.__server_pass)
-        self.server.sendmail(self.__sender_email, self.__receiver_emails, self.msg.as_string())
-        self.server.close()
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as data:
+            self.__render(msg, sources, data)
+            try:
+                try:
+                    refused = self.__stream(self.__session(), self.__sender_email, recipients, data)
+                except smtplib.SMTPServerDisconnected:
+                    data.seek(0)
+                    self.__connect()
+                    refused = self.__stream(self.__server, self.__sender_email, recipients, data)
+                self.__last_used = time.monotonic()
+            finally:
+                if not self.__persistent:
+                    self.__server = self.__quit(self.__server)
+        return refused
+
+    def __enqueue(self, msg, recipients, sources=()):
+        """
+        Gemmer en e-mail i spool-mappen og sætter den i kø til baggrundstrådene.
+
+        Returnerer:
+        -----------
+        str
+            E-mailens id.
+        """
+        self.__start_workers()
+        msg_id = uuid.uuid4().hex
+        path = os.path.join(self.spool_dir, msg_id)
+        with open(path + '.eml.tmp', 'wb') as f:
+            self.__render(msg, sources, f)
+        os.replace(path + '.eml.tmp', path + '.eml')
+        meta = {'sender': self.__sender_email, 'recipients': recipients, 'attempts': 0,
+                'next_attempt': time.time(), 'error': None}
+        self.__write_meta(msg_id, meta)
+        self.__schedule(msg_id, meta['next_attempt'])
+        return msg_id
+
+    def __write_meta(self, msg_id, meta, directory=None):
+        """
+        Skriver metadata for en e-mail atomisk, så en afbrudt proces ikke efterlader en halv fil.
+        """
+        path = os.path.join(directory or self.spool_dir, msg_id + '.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    def __schedule(self, msg_id, due):
+        """
+        Sætter en e-mail i kø til afsendelse på tidspunktet `due`.
+        """
+        with self.__pending_cond:
+            self.__pending.add(msg_id)
+        self.__spool.put((due, msg_id))
+
+    def __recover(self):
+        """
+        Sætter e-mails, som en tidligere proces ikke nåede at aflevere, i kø igen. E-mails, som en proces
+        har været i gang med at sende i over en time, regnes for efterladt af en proces, der er stoppet.
+        """
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith('.sending') and time.time() - os.path.getmtime(path) > 3600:
+                name = name[:-len('.sending')] + '.json'
+                try:
+                    os.rename(path, os.path.join(self.spool_dir, name))
+                except OSError:
+                    continue
+            if not name.endswith('.json'):
+                continue
+            msg_id = name[:-len('.json')]
+            try:
+                with open(os.path.join(self.spool_dir, name), 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if os.path.exists(os.path.join(self.spool_dir, msg_id + '.eml')):
+                self.__schedule(msg_id, meta.get('next_attempt', 0))
+
+    def __start_workers(self):
+        """
+        Starter baggrundstrådene, hvis de ikke kører, f.eks. når en lukket Mailer bruges igen.
+        """
+        if self.__workers:
+            return
+        self.__stop.clear()
+        self.__workers = [threading.Thread(target=self.__worker, name=f'Mailer-{i}', daemon=True)
+                          for i in range(self.__num_workers)]
+        for worker in self.__workers:
+            worker.start()
+        atexit.register(self.close)
+
+    def __worker(self):
+        """
+        Baggrundstråd: afleverer e-mails fra køen over sin egen forbindelse til serveren.
+        """
+        server = None
+        while not self.__stop.is_set():
+            try:
+                due, msg_id = self.__spool.get(timeout=self.keepalive)
+            except queue.Empty:
+                # Ingen e-mails i et stykke tid: forbindelsen lukkes, så serveren ikke lukker den for os
+                server = self.__quit(server)
+                continue
+            if not msg_id:
+                # Vækker tråden, så den ser, at `close` har bedt den stoppe
+                continue
+            wait = due - time.time()
+            if wait > 0:
+                self.__spool.put((due, msg_id))
+                self.__stop.wait(min(wait, 1.0))
+                continue
+            server = self.__deliver(server, msg_id)
+        self.__quit(server)
+
+    def __deliver(self, server, msg_id):
+        """
+        Forsøger at aflevere én e-mail fra spool-mappen. Ved en midlertidig fejl planlægges et nyt forsøg
+        med eksponentiel backoff; ved en permanent fejl eller for mange forsøg flyttes e-mailen til `dead`.
+        Afviser serveren kun nogle af modtagerne, prøves de midlertidigt afviste (4xx) igen, mens de permanent
+        afviste (5xx) lægges i `dead` (se `__refuse`).
+
+        Returnerer:
+        -----------
+        smtplib.SMTP
+            Forbindelsen, der kan genbruges til næste e-mail, eller None.
+        """
+        path = os.path.join(self.spool_dir, msg_id)
+        try:
+            # Omdøbningen gør e-mailen til vores, også hvis flere processer deler spool-mappen
+            os.rename(path + '.json', path + '.sending')
+        except FileNotFoundError:
+            self.__done(msg_id)
+            return server
+        # Omdøbningen bevarer ændringstidspunktet fra køen; det nulstilles, så `__recover` måler fra nu
+        os.utime(path + '.sending')
+        with open(path + '.sending', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        try:
+            if server is None:
+                server = self.__open()
+            with open(path + '.eml', 'rb') as f:
+                try:
+                    refused = self.__stream(server, meta['sender'], meta['recipients'], f)
+                except smtplib.SMTPServerDisconnected:
+                    f.seek(0)
+                    server = self.__open()
+                    refused = self.__stream(server, meta['sender'], meta['recipients'], f)
+        except smtplib.SMTPRecipientsRefused as e:
+            # Serveren afviste alle modtagere, men forbindelsen er i orden efter RSET
+            refused = e.recipients
+        except (smtplib.SMTPException, OSError) as e:
+            server = self.__quit(server)
+            meta['attempts'] += 1
+            meta['error'] = f'{type(e).__name__}: {e}'
+            code = getattr(e, 'smtp_code', None)
+            if (code is not None and code >= 500) or meta['attempts'] >= self.__max_attempts:
+                self.__write_meta(msg_id, meta, self.__dead_dir)
+                os.replace(path + '.eml', os.path.join(self.__dead_dir, msg_id + '.eml'))
+                os.remove(path + '.sending')
+                self.__done(msg_id)
+            else:
+                self.__retry(msg_id, meta)
+            return server
+        if refused:
+            attempts = meta['attempts'] + 1
+            refused = {recipient: (code, resp.decode('utf-8', 'replace') if isinstance(resp, bytes) else resp)
+                       for recipient, (code, resp) in refused.items()}
+            retry = [r for r, (code, _) in refused.items() if code < 500] if attempts < self.__max_attempts else []
+            dead = {r: result for r, result in refused.items() if r not in retry}
+            meta['attempts'] = attempts
+            meta['error'] = f'SMTPRecipientsRefused: {len(refused)} of {len(meta["recipients"])} recipients refused'
+            meta['refused'] = {**meta.get('refused', {}), **refused}
+            if dead:
+                self.__refuse(msg_id, meta, dead)
+            if retry:
+                meta['recipients'] = retry
+                self.__retry(msg_id, meta)
+                return server
+        os.remove(path + '.eml')
+        os.remove(path + '.sending')
+        self.__done(msg_id)
+        return server
+
+    def __retry(self, msg_id, meta):
+        """
+        Sætter en e-mail i kø igen efter en eksponentiel backoff, der afhænger af antallet af forsøg.
+        """
+        delay = min(self.__backoff * 2 ** (meta['attempts'] - 1), self.__max_backoff)
+        meta['next_attempt'] = time.time() + delay * random.uniform(0.8, 1.2)
+        self.__write_meta(msg_id, meta)
+        os.remove(os.path.join(self.spool_dir, msg_id + '.sending'))
+        self.__spool.put((meta['next_attempt'], msg_id))
+
+    def __refuse(self, msg_id, meta, refused):
+        """
+        Lægger de modtagere, serveren afviste permanent, i `dead`, mens e-mailen afleveres til de øvrige.
+        En kopi af e-mailen gemmes under id'et `<id>.refused`, og modtagere, der afvises ved senere forsøg,
+        føjes til samme metadata.
+
+        Parametre:
+        ----------
+        msg_id : str
+            E-mailens id i spool-mappen.
+        meta : dict
+            E-mailens metadata.
+        refused : dict
+            De afviste modtagere med SMTP-kode og svar.
+        """
+        dead_id = msg_id + '.refused'
+        try:
+            with open(os.path.join(self.__dead_dir, dead_id + '.json'), 'r', encoding='utf-8') as f:
+                dead = json.load(f)
+        except FileNotFoundError:
+            shutil.copyfile(os.path.join(self.spool_dir, msg_id + '.eml'),
+                            os.path.join(self.__dead_dir, dead_id + '.eml'))
+            dead = {'sender': meta['sender'], 'recipients': [], 'refused': {}}
+        dead['recipients'] += [r for r in refused if r not in dead['recipients']]
+        dead['refused'].update(refused)
+        dead.update(attempts=meta['attempts'], error=meta['error'])
+        self.__write_meta(dead_id, dead, self.__dead_dir)
+
+    def __done(self, msg_id):
+        """
+        Markerer en e-mail som færdigbehandlet, så `flush` kan returnere.
+        """
+        with self.__pending_cond:
+            self.__pending.discard(msg_id)
+            self.__pending_cond.notify_all()
+
+    @staticmethod
+    def __quit(server):
+        """
+        Lukker en forbindelse pænt med QUIT og ellers hårdt. Returnerer None.
+        """
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+        return None
+
+    def flush(self, timeout=None):
+        """
+        Venter på, at e-mails i kø er afleveret eller flyttet til `dead`.
+
+        Parametre:
+        ----------
+        timeout : float, valgfri
+            Det længste antal sekunder, der ventes. Standard er at vente, til køen er tom.
+
+        Returnerer:
+        -----------
+        int
+            Antal e-mails, der stadig venter. De ligger i spool-mappen og afleveres af en senere Mailer.
+        """
+        if not self.queued:
+            return 0
+        with self.__pending_cond:
+            self.__pending_cond.wait_for(lambda: not self.__pending, timeout)
+            return len(self.__pending)
+
+    def close(self, timeout=60):
+        """
+        Lukker forbindelsen til SMTP-serveren, hvis den er åben. I kø-tilstand ventes der først op til
+        `timeout` sekunder på, at køen afleveres, hvorefter baggrundstrådene stoppes. Kaldes ved slutningen af
+        en `with`-blok og automatisk, når Python afsluttes.
+
+        Parametre:
+        ----------
+        timeout : float, valgfri
+            Det længste antal sekunder, der ventes på køen (standard: 60). E-mails, der ikke nåede at blive
+            afleveret, bliver i spool-mappen og afleveres af en senere Mailer.
+
+        Returnerer:
+        -----------
+        int
+            Antal e-mails, der stadig venter i spool-mappen.
+        """
+        self.__server = self.__quit(self.__server)
+        if not self.queued or not self.__workers:
+            return 0
+        atexit.unregister(self.close)
+        remaining = self.flush(timeout)
+        self.__stop.set()
+        for _ in self.__workers:
+            self.__spool.put((float('-inf'), ''))
+        for worker in self.__workers:
+            # En tråd midt i en afsendelse når højst at vente på forbindelsens timeout
+            worker.join(self.__timeout)
+        self.__workers = []
+        return remaining
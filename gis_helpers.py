@@ -1,9 +1,66 @@
-import arcpy
-import geopandas as gpd
+import concurrent.futures
+import functools
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import shapely
 from shapely.geometry import Polygon
 
+# arcpy og geopandas importeres først, når en funktion bruger dem. Så kan modulet importeres hurtigt og
+# på maskiner uden ArcGIS, og fejlen om manglende arcpy kommer først, når en ArcPy-funktion kaldes.
 
-def addGeometry(df, drop_geom = False):
+
+def _arcpy():
+    """
+    Importerer arcpy ved første brug og giver en tydelig fejl, hvis ArcGIS ikke er installeret.
+    """
+    try:
+        import arcpy
+    except ImportError as e:
+        raise ImportError('This function requires arcpy, which is only available with ArcGIS Pro') from e
+    return arcpy
+
+
+@functools.lru_cache(maxsize=None)
+def _spatial_reference(epsg):
+    """
+    Returnerer en cachet `arcpy.SpatialReference`, så den kun oprettes én gang pr. EPSG-kode.
+    """
+    return _arcpy().SpatialReference(epsg)
+
+
+def arcpyGeometry(wkb, epsg):
+    """
+    Standard-geometrifabrik til `addGeometry` og `iterRows`: konverterer WKB til en ArcPy-geometri.
+
+    Parametre:
+    ----------
+    wkb : bytes
+        Geometrien som Well-Known Binary.
+    epsg : int
+        EPSG-koden for geometriens koordinatsystem.
+
+    Returnerer:
+    -----------
+    arcpy.Geometry
+        Geometrien i ArcPy-format med en cachet SpatialReference.
+    """
+    return _arcpy().FromWKB(bytearray(wkb), _spatial_reference(epsg))
+
+
+def _iter_shapes(df, epsg, geometry_factory, batch_size):
+    """
+    Konverterer geometrikolonnen til WKB i batches med `shapely.to_wkb` og returnerer én konverteret
+    geometri ad gangen via `geometry_factory`. Manglende geometrier bliver til `None`.
+    """
+    geometry_factory = geometry_factory or arcpyGeometry
+    geoms = np.asarray(df.geometry.values, dtype=object)
+    for offset in range(0, len(geoms), batch_size):
+        for wkb in shapely.to_wkb(geoms[offset:offset + batch_size]):
+            yield geometry_factory(wkb, epsg) if wkb is not None else None
+
+
+def addGeometry(df, drop_geom = False, epsg=25832, geometry_factory=None, batch_size=10_000):
     """
     Denne funktion, `addGeometry`, konverterer geometri fra en GeoDataFrame til et format, som kan bruges i ArcPy. 
     Funktionen tilføjer en ny kolonne `SHAPE@` til GeoDataFrame'en, som indeholder geometrien i ArcPy-format. 
@@ -13,6 +70,10 @@ def addGeometry(df, drop_geom = False):
     ----------
     - df: GeoDataFrame, der indeholder geospatiale data og en geometri-kolonne.
     - drop_geom: Boolsk værdi, der angiver, om den oprindelige geometri-kolonne skal fjernes. Standard er `False`.
+    - epsg: EPSG-koden for geometriernes koordinatsystem. Standard er 25832.
+    - geometry_factory: Funktion, der tager (wkb, epsg) og returnerer en geometri. Standard er `arcpyGeometry`;
+      en anden fabrik (f.eks. `shapely.from_wkb`) kan bruges til test og benchmarks uden ArcPy.
+    - batch_size: Antal geometrier, der WKB-kodes ad gangen. Standard er 10.000.
 
     Returnerer:
     -----------
@@ -20,17 +81,83 @@ def addGeometry(df, drop_geom = False):
 
     Bemærkninger:
     -------------
-    - Funktionen bruger `arcpy.FromWKT` til at konvertere geometri fra Well-Known Text (WKT) til ArcPy-format.
+    - Funktionen konverterer geometrien via Well-Known Binary (WKB) med `arcpy.FromWKB` og genbruger én
+      SpatialReference pr. EPSG-kode.
+    - Kopien er overfladisk, så de øvrige kolonners data deles med `df` i stedet for at blive kopieret.
     - SpatialReference EPSG:25832 bruges som standard, hvilket svarer til UTM Zone 32N (ETRS89).
     """
-    tmp_df = df.copy(deep=True)
+    tmp_df = df.copy(deep=False)
     geometry_field_name = tmp_df.geometry.name
-    tmp_df['temp_wkt_field'] = tmp_df[geometry_field_name].to_wkt()
-    tmp_df['SHAPE@'] = tmp_df['temp_wkt_field'].apply(lambda geom: arcpy.FromWKT(geom, arcpy.SpatialReference(25832)))
-    tmp_df.drop(columns=['temp_wkt_field'], inplace=True)
+    tmp_df['SHAPE@'] = list(_iter_shapes(tmp_df, epsg, geometry_factory, batch_size))
     if drop_geom == True:
-        tmp_df.drop(columns=[geometry_field_name], inplace=True)
-    return tmp_df        
+        tmp_df = tmp_df.drop(columns=[geometry_field_name])
+    return tmp_df
+
+
+def iterRows(df, fields=None, epsg=25832, geometry_factory=None, batch_size=10_000):
+    """
+    Returnerer rækkerne fra en GeoDataFrame én ad gangen som tupler klar til `arcpy.da.InsertCursor`,
+    med den konverterede geometri sidst. Geometrien konverteres løbende i batches, så der ikke bygges
+    en kopi af hele laget i hukommelsen.
+
+    Parametre:
+    ----------
+    df : GeoDataFrame
+        Data, der skal indsættes.
+    fields : list, valgfri
+        Attributkolonner i den rækkefølge, cursoren forventer. Standard er alle kolonner undtagen geometrien.
+    epsg : int, valgfri
+        EPSG-koden for geometriernes koordinatsystem (standard: 25832).
+    geometry_factory : callable, valgfri
+        Funktion, der tager (wkb, epsg) og returnerer en geometri (standard: `arcpyGeometry`).
+    batch_size : int, valgfri
+        Antal geometrier, der WKB-kodes ad gangen (standard: 10.000).
+
+    Returnerer:
+    -----------
+    generator
+        Tupler med `fields`-værdierne efterfulgt af geometrien.
+    """
+    if fields is None:
+        fields = [c for c in df.columns if c != df.geometry.name]
+    attributes = df[fields].itertuples(index=False, name=None)
+    for values, shape in zip(attributes, _iter_shapes(df, epsg, geometry_factory, batch_size)):
+        yield values + (shape,)
+
+
+def insertRows(df, featureclass, fields=None, epsg=25832, geometry_factory=None, batch_size=10_000):
+    """
+    Indsætter rækkerne fra en GeoDataFrame i en featureclass med `arcpy.da.InsertCursor` via `iterRows`.
+
+    Parametre:
+    ----------
+    df : GeoDataFrame
+        Data, der skal indsættes.
+    featureclass : str
+        Stien til featureclassen.
+    fields : list, valgfri
+        Attributkolonner, der svarer til featureclassens felter. Standard er alle kolonner undtagen geometrien.
+    epsg : int, valgfri
+        EPSG-koden for geometriernes koordinatsystem (standard: 25832).
+    geometry_factory : callable, valgfri
+        Funktion, der tager (wkb, epsg) og returnerer en geometri (standard: `arcpyGeometry`).
+    batch_size : int, valgfri
+        Antal geometrier, der WKB-kodes ad gangen (standard: 10.000).
+
+    Returnerer:
+    -----------
+    int
+        Antal indsatte rækker.
+    """
+    if fields is None:
+        fields = [c for c in df.columns if c != df.geometry.name]
+    count = 0
+    with _arcpy().da.InsertCursor(featureclass, list(fields) + ['SHAPE@']) as cursor:
+        for row in iterRows(df, fields, epsg=epsg, geometry_factory=geometry_factory, batch_size=batch_size):
+            cursor.insertRow(row)
+            count += 1
+    return count
+
 
 def clip(gdf, bbox):
     """
@@ -53,7 +180,14 @@ def clip(gdf, bbox):
     GeoDataFrame
         En ny GeoDataFrame, som indeholder geometrierne fra `gdf`, der er inden for 
         den specificerede bounding box.
+
+    Bemærkninger:
+    -------------
+    - Skal det samme lag klippes til mange bounding boxes, er `Clipper` hurtigere, da den kun bygger
+      sit spatiale indeks én gang.
     """
+    import geopandas as gpd
+
     min_x = bbox[0]
     min_y = bbox[1]
     max_x = bbox[2]
@@ -71,5 +205,283 @@ def clip(gdf, bbox):
     
     return tmp_gdf
 
+class Clipper:
+    """
+    Klipper det samme lag til mange bounding boxes uden at gennemløbe hele laget for hver boks.
+
+    Ved initialiseringen bygges et STRtree og et array med alle geometriers bounding boxes én gang.
+    Ved hvert klip vælges kandidaterne via træet, geometrier der ligger helt inden for boksen bruges
+    uændret, og kun de geometrier, der krydser boksens kant, skæres med et vektoriseret
+    `shapely.intersection`.
+
+    Attributter:
+    -----------
+    gdf : GeoDataFrame
+        Laget, der klippes.
+    """
+
+    def __init__(self, gdf):
+        """
+        Initialiserer Clipper-objektet og bygger det spatiale indeks.
+
+        Parametre:
+        ----------
+        gdf : GeoDataFrame
+            Laget, der skal klippes.
+        """
+        self.gdf = gdf
+        self.__geoms = np.asarray(gdf.geometry.values, dtype=object)
+        self.__bounds = shapely.bounds(self.__geoms)
+        self.__tree = shapely.STRtree(self.__geoms)
+
+    def clip(self, bbox):
+        """
+        Klipper laget til en bounding box.
+
+        Parametre:
+        ----------
+        bbox : list
+            En liste med fire koordinater [min_x, min_y, max_x, max_y].
+
+        Returnerer:
+        -----------
+        GeoDataFrame
+            En ny GeoDataFrame med de features, der ligger inden for bounding boxen, i lagets oprindelige
+            rækkefølge og med geometrierne skåret til boksen.
+        """
+        import geopandas as gpd
+
+        min_x, min_y, max_x, max_y = (float(v) for v in bbox)
+        clip_box = shapely.box(min_x, min_y, max_x, max_y)
+        idx = np.sort(self.__tree.query(clip_box))
+        bounds = self.__bounds[idx]
+        inside = (bounds[:, 0] >= min_x) & (bounds[:, 1] >= min_y) & (bounds[:, 2] <= max_x) & (bounds[:, 3] <= max_y)
+
+        # Kun de skårne geometrier konverteres; resten tages direkte fra lagets geometri-array
+        geoms = self.gdf.geometry.values.take(idx)
+        crossing = np.flatnonzero(~inside)
+        if len(crossing):
+            geoms[crossing] = shapely.intersection(self.__geoms[idx[crossing]], clip_box)
+        keep = ~geoms.is_empty
+
+        tmp_gdf = self.gdf.iloc[idx[keep]].copy()
+        tmp_gdf[tmp_gdf.geometry.name] = gpd.GeoSeries(geoms[keep], index=tmp_gdf.index, crs=self.gdf.crs)
+        return tmp_gdf
+
+
+def partition(gdf, bboxes, workers=None, clip_geometries=True, out_dir=None, driver='GPKG', max_pending=None):
+    """
+    Opdeler en GeoDataFrame i én GeoDataFrame pr. bounding box og returnerer fliserne løbende.
+
+    Features fordeles til fliserne med ét samlet spatialt join (STRtree). Skal geometrierne klippes,
+    fordeles fliserne på en procespulje: alle geometrier WKB-kodes én gang til en delt hukommelsesblok,
+    og hver proces modtager kun indeks og offsets for sin flise. Processen returnerer kun de geometrier,
+    der krydser flisens kant; resten tages uændret fra `gdf`. Der er højst `max_pending` fliser undervejs
+    ad gangen, så hukommelsesforbruget er begrænset.
+
+    Parametre:
+    ----------
+    gdf : GeoDataFrame
+        Laget, der skal opdeles.
+    bboxes : list eller numpy.ndarray
+        Bounding boxes i formatet [min_x, min_y, max_x, max_y], f.eks. fra `BoundingBox.grid`.
+    workers : int, valgfri
+        Antal processer. Standard er antallet af CPU-kerner; 1 klipper i den aktuelle proces.
+    clip_geometries : bool, valgfri
+        Klip geometrierne til fliserne. Hvis `False`, fordeles hele features blot til de fliser, de
+        skærer (standard: True).
+    out_dir : str, valgfri
+        Hvis angivet, skrives hver flise til `tile_<nr>` i mappen med `driver`, og stien returneres i
+        stedet for GeoDataFramen. Tomme fliser skrives ikke.
+    driver : str, valgfri
+        Filformatet ved `out_dir`, f.eks. 'GPKG' eller 'Parquet' (standard: 'GPKG').
+    max_pending : int, valgfri
+        Det maksimale antal fliser undervejs i procespuljen (standard: 2 gange `workers`).
+
+    Returnerer:
+    -----------
+    generator
+        Tupler (flisenummer, GeoDataFrame) eller (flisenummer, sti) i den rækkefølge, fliserne bliver færdige.
+    """
+    import geopandas as gpd
+
+    bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    boxes = shapely.box(bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3])
+    tile_idx, feature_idx = shapely.STRtree(geoms).query(boxes, predicate='intersects')
+    order = np.lexsort((feature_idx, tile_idx))
+    tile_idx, feature_idx = tile_idx[order], feature_idx[order]
+    splits = np.searchsorted(tile_idx, np.arange(1, len(bboxes)))
+    members = np.split(feature_idx, splits)
+
+    if not clip_geometries:
+        for tile_no, idx in enumerate(members):
+            yield tile_no, _partition_output(gdf.iloc[idx], tile_no, out_dir, driver)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    # Kun geometrier, der rammer en flise, kodes; tomme geometrier (None) giver længden 0
+    hits = np.unique(feature_idx)
+    wkb = shapely.to_wkb(geoms[hits])
+    lengths = np.zeros(len(geoms), dtype=np.int64)
+    lengths[hits] = np.fromiter((0 if b is None else len(b) for b in wkb), dtype=np.int64, count=len(wkb))
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    shm = shared_memory.SharedMemory(create=True, size=max(int(lengths.sum()), 1))
+    try:
+        # Kopieres stykvis, så der ikke samtidig skal ligge en samlet kopi af al WKB i hukommelsen
+        for i, b in zip(hits, wkb):
+            if b is not None:
+                shm.buf[offsets[i]:offsets[i] + lengths[i]] = b
+        del wkb
+        if workers == 1:
+            executor = None
+            results = (_partition_worker(i, offsets[idx], lengths[idx], bboxes[i], shm.buf)
+                       for i, idx in enumerate(members))
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_partition_attach,
+                                                              initargs=(shm.name,))
+            results = _bounded_map(executor, _partition_worker, max_pending,
+                                   ((i, offsets[idx], lengths[idx], bboxes[i]) for i, idx in enumerate(members)))
+        try:
+            for tile_no, crossing, clipped_wkb, empty in results:
+                idx = members[tile_no]
+                values = gdf.geometry.values.take(idx)
+                if len(crossing):
+                    values[crossing] = shapely.from_wkb(clipped_wkb)
+                tile_gdf = gdf.iloc[idx[~empty]].copy()
+                tile_gdf[tile_gdf.geometry.name] = gpd.GeoSeries(values[~empty], index=tile_gdf.index, crs=gdf.crs)
+                yield tile_no, _partition_output(tile_gdf, tile_no, out_dir, driver)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _bounded_map(executor, func, max_pending, args_iter):
+    """
+    Som `executor.map`, men med højst `max_pending` opgaver undervejs og resultater i færdig-rækkefølge.
+    """
+    pending = set()
+    for args in args_iter:
+        pending.add(executor.submit(func, *args))
+        if len(pending) >= max_pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in concurrent.futures.as_completed(pending):
+        yield future.result()
+
+
+def _partition_output(tile_gdf, tile_no, out_dir, driver):
+    """
+    Returnerer flisen, eller skriver den til `out_dir` og returnerer stien.
+    """
+    if out_dir is None:
+        return tile_gdf
+    extension = {'GPKG': 'gpkg', 'Parquet': 'parquet', 'ESRI Shapefile': 'shp', 'GeoJSON': 'geojson'}.get(driver, driver.lower())
+    path = os.path.join(out_dir, f'tile_{tile_no}.{extension}')
+    if len(tile_gdf) == 0:
+        return None
+    if driver == 'Parquet':
+        tile_gdf.to_parquet(path)
+    else:
+        tile_gdf.to_file(path, driver=driver)
+    return path
+
+
+# Procesglobal reference til den delte WKB-blok i `partition`s arbejdsprocesser
+_partition_shm = None
+
+
+def _partition_attach(name):
+    """
+    Åbner den delte WKB-blok i en arbejdsproces.
+    """
+    global _partition_shm
+    _partition_shm = shared_memory.SharedMemory(name=name)
+
+
+def _partition_worker(tile_no, offsets, lengths, bbox, buf=None):
+    """
+    Klipper en flises geometrier fra den delte WKB-blok.
+
+    Returnerer flisenummeret, positionerne (inden for flisen) for de geometrier der krydser kanten,
+    deres klippede geometri som WKB og en maske over geometrier, der er blevet tomme.
+    """
+    if buf is None:
+        buf = _partition_shm.buf
+    geoms = shapely.from_wkb([bytes(buf[o:o + n]) if n else None for o, n in zip(offsets, lengths)])
+    min_x, min_y, max_x, max_y = bbox
+    bounds = shapely.bounds(geoms)
+    inside = (bounds[:, 0] >= min_x) & (bounds[:, 1] >= min_y) & (bounds[:, 2] <= max_x) & (bounds[:, 3] <= max_y)
+    crossing = np.flatnonzero(~inside)
+    clipped = shapely.intersection(geoms[crossing], shapely.box(min_x, min_y, max_x, max_y))
+    empty = np.zeros(len(geoms), dtype=bool)
+    empty[crossing] = shapely.is_empty(clipped)
+    return tile_no, crossing, shapely.to_wkb(clipped), empty
+
+
+def _benchmark_clip():
+    """
+    Benchmark af Clipper mod clip på et syntetisk lag med 1 mio. polygoner klippet til 16 fliser.
+    """
+    import time
+    import geopandas as gpd
+
+    n = 1_000_000
+    rng = np.random.default_rng(0)
+    x = rng.uniform(440_000, 480_000, n)
+    y = rng.uniform(6_250_000, 6_290_000, n)
+    gdf = gpd.GeoDataFrame({'id': np.arange(n)}, geometry=shapely.box(x, y, x + 25, y + 25), crs='EPSG:25832')
+    xs = np.linspace(440_000, 480_000, 5)
+    ys = np.linspace(6_250_000, 6_290_000, 5)
+    bboxes = [[xs[i], ys[j], xs[i + 1], ys[j + 1]] for i in range(4) for j in range(4)]
+
+    start = time.perf_counter()
+    clipper = Clipper(gdf)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    new = [clipper.clip(bbox) for bbox in bboxes]
+    new_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    old = [clip(gdf, bbox) for bbox in bboxes]
+    old_seconds = time.perf_counter() - start
+
+    assert [len(a) for a in old] == [len(b) for b in new]
+    print(f'clip    : {old_seconds:8.2f} s for {len(bboxes)} fliser')
+    print(f'Clipper : {new_seconds:8.2f} s for {len(bboxes)} fliser (+ {build:.2f} s til indeks)')
+
+
+def _benchmark_addGeometry():
+    """
+    Benchmark af addGeometry mod den tidligere WKT-baserede konvertering med shapely som stand-in for ArcPy.
+    """
+    import time
+    import geopandas as gpd
+
+    n = 200_000
+    rng = np.random.default_rng(0)
+    points = shapely.points(rng.uniform(440_000, 480_000, n), rng.uniform(6_250_000, 6_290_000, n))
+    gdf = gpd.GeoDataFrame({'id': np.arange(n)}, geometry=shapely.buffer(points, 10, quad_segs=4), crs='EPSG:25832')
+
+    start = time.perf_counter()
+    tmp_df = gdf.copy(deep=True)
+    tmp_df['temp_wkt_field'] = tmp_df.geometry.to_wkt()
+    tmp_df['SHAPE@'] = tmp_df['temp_wkt_field'].apply(lambda geom: shapely.from_wkt(geom))
+    old_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    addGeometry(gdf, geometry_factory=lambda wkb, epsg: shapely.from_wkb(wkb))
+    new_seconds = time.perf_counter() - start
+
+    print(f'addGeometry før (WKT) : {old_seconds:8.2f} s for {n} polygoner')
+    print(f'addGeometry (WKB)     : {new_seconds:8.2f} s for {n} polygoner')
+
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    _benchmark_clip()
+    _benchmark_addGeometry()
@@ -0,0 +1,90 @@
+"""
+Måler importtiden for modulerne i en ny Python-proces med `python -X importtime` og kontrollerer,
+at de tunge afhængigheder ikke importeres, når modulerne indlæses.
+
+Køres som `python importtime_check.py`. Scriptet udskriver importtiden pr. modul og afslutter med
+kode 1, hvis et modul ikke kan importeres, importerer en af de tunge afhængigheder eller overskrider sit
+tidsbudget. Tidsbudgettet afhænger af maskinens belastning og kontrolleres derfor kun her; testen i
+`tests/test_importtime.py` kontrollerer kun de importerede moduler.
+"""
+import os
+import subprocess
+import sys
+
+MODULES = ['args_loader', 'DatabaseConnections', 'emailer', 'boundingBox', 'gis_helpers', 'pipeline', 'popups',
+           'logger', 'unPack', 'LKuuid']
+
+# Afhængigheder, der først må importeres, når en funktion bruger dem
+HEAVY = ['arcpy', 'geopandas', 'pandas', 'pyarrow', 'pyodbc', 'pyproj', 'sqlalchemy']
+
+# Tidsbudget i millisekunder for den samlede import af ét modul inkl. dets afhængigheder
+BUDGET_MS = 500
+
+
+def importtime(module):
+    """
+    Importerer et modul i en ny proces med `-X importtime`.
+
+    Parametre:
+    ----------
+    module : str
+        Navnet på modulet.
+
+    Returnerer:
+    -----------
+    tuple
+        Den samlede importtid for modulet i millisekunder, mængden af importerede topniveau-pakker og
+        fejlens sidste linje, hvis importen fejlede (ellers `None`).
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    error = None
+    if result.returncode != 0:
+        lines = [line for line in result.stderr.splitlines() if line and not line.startswith('import time:')]
+        error = lines[-1] if lines else f'exit code {result.returncode}'
+    cumulative = 0
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        name = name.strip()
+        imported.add(name.split('.')[0])
+        if name == module:
+            cumulative = int(cumulative_us)
+    return cumulative / 1000, imported, error
+
+
+def check():
+    """
+    Måler alle moduler i `MODULES` og udskriver resultatet.
+
+    Returnerer:
+    -----------
+    dict
+        Fejlbeskeden pr. modul, der ikke bestod. Tom, hvis alle moduler bestod.
+    """
+    failures = {}
+    for module in MODULES:
+        ms, imported, error = importtime(module)
+        heavy = sorted(imported.intersection(HEAVY))
+        status = 'OK'
+        if error:
+            status = f'FEJL: import fejlede ({error})'
+        elif heavy:
+            status = f"FEJL: importerer {', '.join(heavy)}"
+        elif ms > BUDGET_MS:
+            status = f'FEJL: over budget på {BUDGET_MS} ms'
+        if status != 'OK':
+            failures[module] = status
+        print(f'{module:20}: {ms:8.1f} ms  {status}')
+    return failures
+
+
+def main():
+    return 1 if check() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,14 @@
 import os
-import datetime
+import atexit
+import contextlib
+import gzip
+import json
+import shutil
+import queue
+import threading
 import time
 import glob
+import tracemalloc
 from time import perf_counter
 
 class Logger:
@@ -26,9 +33,35 @@ class Logger:
         Antal logfiler, der skal gemmes. Overskydende filer slettes automatisk (standard: 10).
     print_msg : bool
         Udskriver logbeskeder direkte til konsollen (standard: False).
+    level : int
+        Laveste niveau, der skrives: `Logger.DEBUG`, `INFO`, `WARNING` eller `CRITICAL`.
+
+    Bemærkninger:
+    -------------
+    Logfilen holdes åben med en skrivebuffer i stedet for at blive åbnet og lukket for hver besked.
+    Bufferen tømmes ved `flush()`, `end()`, kritiske beskeder, undtagelser i en `with`-blok og når
+    Python afsluttes. Med `background=True` skrives beskederne af en baggrundstråd via en afgrænset kø.
+
+    Beskeder kan tage `%`-argumenter, f.eks. `log.info('Behandlet %d af %d', i, n)`. Argumenterne
+    formateres kun, hvis beskeden skrives, og beskeder under `level` returnerer før enhver formatering.
+
+    `timer('fase')` måler tid og eventuelt hukommelse for en fase af kørslen, og `end()` skriver en
+    oversigt over de langsomste faser. Med `jsonl=True` skrives beskeder og målinger også som JSON-linjer
+    i en fil ved siden af logfilen, så mange kørsler kan sammenlignes.
+
+    Logfilen kan roteres efter størrelse (`max_bytes`) og alder (`max_age`), og roterede filer kan
+    komprimeres med gzip i en baggrundstråd. Hvilke filer der gemmes, holdes i en lille manifestfil
+    (`<filnavn>.manifest.json`) i mappen, så mappen ikke skal gennemsøges ved hver kørsel.
     """
 
-    def __init__(self, path, debug=False, date_at_end=False, filename=None, num_of_logs=10, print_msg=False):
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    CRITICAL = 40
+
+    def __init__(self, path, debug=False, date_at_end=False, filename=None, num_of_logs=10, print_msg=False,
+                 buffering=64 * 1024, background=False, queue_size=10_000, overflow='block', level=None,
+                 jsonl=False, summary_size=10, max_bytes=None, max_age=None, compress=False):
         """
         Initialiserer Logger-objektet og opretter logfilen.
 
@@ -46,37 +79,120 @@ class Logger:
             Antal logfiler, der skal gemmes. Overskydende filer slettes automatisk (standard: 10).
         print_msg : bool, valgfri
             Udskriver logbeskeder direkte til konsollen (standard: False).
+        buffering : int, valgfri
+            Størrelsen på skrivebufferen i bytes (standard: 64 KB).
+        background : bool, valgfri
+            Skriver beskederne til filen fra en baggrundstråd, så kaldene ikke venter på disken (standard: False).
+        queue_size : int, valgfri
+            Antal beskeder, der højst må vente i køen til baggrundstråden (standard: 10.000).
+        overflow : str, valgfri
+            Hvad der sker, når køen er fuld: 'block' venter på plads, 'drop' kasserer beskeden og tæller den
+            med i `statistics()` (standard: 'block'). Kritiske beskeder og afslutningen fra `end()` kasseres aldrig.
+        level : int, valgfri
+            Laveste niveau, der skrives. Standard er `Logger.DEBUG` med debug-tilstand og ellers `Logger.INFO`.
+        jsonl : bool, valgfri
+            Skriver også beskeder og målinger som JSON-linjer i `<logfil>.jsonl` (standard: False).
+        summary_size : int, valgfri
+            Antal faser i oversigten over de langsomste faser, som `end()` skriver (standard: 10).
+        max_bytes : int, valgfri
+            Roterer logfilen, når den bliver større end dette antal bytes (standard: ingen rotation).
+        max_age : float, valgfri
+            Roterer logfilen, når den har været åben i mere end dette antal sekunder (standard: ingen rotation).
+        compress : bool, valgfri
+            Komprimerer roterede filer med gzip i en baggrundstråd (standard: False).
         """
+        if overflow not in ('block', 'drop'):
+            raise ValueError(f"Unknown overflow policy '{overflow}', use 'block' or 'drop'")
         self.path = path
         self.start_time = perf_counter()
         self.__warnings = 0
         self.__criticals = 0
         self.debug = debug
+        self.level = level if level is not None else (self.DEBUG if debug else self.INFO)
+        self.__time_cache = (None, '')
         self.__date_at_end = date_at_end
         self.__filename = filename
         self.__num_of_logs = num_of_logs
         self.__print = print_msg
+        self.__buffering = buffering
+        self.__background = background
+        self.__overflow = overflow
+        self.__queue = queue.Queue(maxsize=queue_size) if background else None
+        self.__thread = None
+        self.__file = None
+        self.__lock = threading.Lock()
+        self.__pending = 0
+        self.__flushed = 0
+        self.__dropped = 0
+        self.__jsonl = jsonl
+        self.__json_file = None
+        self.__summary_size = summary_size
+        self.__timings = {}
+        self.__tracing = 0
+        self.__max_bytes = max_bytes
+        self.__max_age = max_age
+        self.__compress = compress
+        self.__size = 0
+        self.__opened = 0
+        self.__compressor = None
+        self.__manifest_lock = threading.Lock()
         if not self.__filename:
             self.__filename = 'log'
+        self.__dir = path
+        self.__base = self.__filename
+        self.__manifest = os.path.join(path, f'{self.__base}.manifest.json')
         if self.__date_at_end == True:
-            self.__check_num_of_files()
             self.__filename = f"{self.__filename} {self.__get_time().replace(':','.')}.log"
+            self.__check_num_of_files(self.__filename)
         else:
             self.__filename = f"{self.__filename}.log"
         self.path = os.path.join(path, self.__filename)
+        self.json_path = os.path.splitext(self.path)[0] + '.jsonl' if jsonl else None
 
     def __get_time(self):
         """
         Henter den aktuelle dato og tid i formatet 'ÅÅÅÅ-MM-DD TT:MM:SS'.
 
+        Strengen formateres kun én gang pr. sekund og genbruges ellers.
+
         Returnerer:
         -----------
         str
             Den aktuelle dato og tid som en streng.
         """
-        return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        second = int(time.time())
+        cached = self.__time_cache
+        if cached[0] != second:
+            cached = (second, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second)))
+            self.__time_cache = cached
+        return cached[1]
 
-    def __write(self, msg):
+    def __emit(self, label, msg, args, keep=False):
+        """
+        Formaterer en besked med eventuelle `%`-argumenter og skriver den. Med `keep` kasseres beskeden
+        aldrig, se `__write`.
+        """
+        if args:
+            msg = msg % args
+        now = self.__get_time()
+        self.__write(f"{now} : {label} : {msg}", keep)
+        if self.__jsonl:
+            self.__write_json({'time': now, 'level': label.strip(), 'msg': msg})
+
+    def __write_json(self, record, mode='a'):
+        """
+        Skriver en post som en JSON-linje til `json_path`.
+        """
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.__lock:
+            if self.__json_file is None or mode == 'w':
+                if self.__json_file is not None:
+                    self.__json_file.close()
+                self.__json_file = open(self.json_path, mode, encoding='utf-8', buffering=self.__buffering)
+                atexit.register(self.close)
+            self.__json_file.write(line + '\n')
+
+    def __write(self, msg, keep=False):
         """
         Skriver en besked til logfilen og eventuelt til konsollen.
 
@@ -84,26 +200,276 @@ class Logger:
         ----------
         msg : str
             Beskeden, der skal logges.
+        keep : bool, valgfri
+            Venter på plads i køen i stedet for at kassere beskeden, også med `overflow='drop'`. Bruges til
+            kritiske beskeder og oversigten fra `end()` (standard: False).
         """
         self.msg = msg
         if self.__print == True:
             print(self.msg)
-        with open(self.path, 'a', encoding='utf-8') as file:
-            file.write(self.msg + '\n')
+        if not self.__background:
+            with self.__lock:
+                self.__write_lines([self.msg])
+            return
+        self.__start_writer()
+        if self.__overflow == 'drop' and not keep:
+            try:
+                self.__queue.put_nowait(self.msg)
+            except queue.Full:
+                with self.__lock:
+                    self.__dropped += 1
+        else:
+            self.__queue.put(self.msg)
+
+    def __write_lines(self, lines, mode='a'):
+        """
+        Skriver linjer til den åbne logfil og åbner den først, hvis det er nødvendigt. Kaldes med låsen taget.
+        """
+        if self.__file is None or mode == 'w':
+            if self.__file is not None:
+                self.__file.close()
+            self.__file = open(self.path, mode, encoding='utf-8', buffering=self.__buffering)
+            self.__size = self.__file.tell()
+            self.__opened = time.time()
+            atexit.register(self.close)
+        text = '\n'.join(lines) + '\n'
+        self.__file.write(text)
+        self.__pending += len(lines)
+        # Grænsen gælder bytes på disken: UTF-8 bruger flere bytes til æ, ø og å, og på Windows skrives
+        # linjeskift som to tegn
+        size = len(text) if text.isascii() else len(text.encode('utf-8'))
+        if os.linesep != '\n':
+            size += text.count('\n') * (len(os.linesep) - 1)
+        self.__size += size
+        if ((self.__max_bytes is not None and self.__size >= self.__max_bytes)
+                or (self.__max_age is not None and time.time() - self.__opened >= self.__max_age)):
+            self.__rotate()
 
-    def __check_num_of_files(self):
+    def __rotate(self):
         """
-        Kontrollerer antallet af logfiler i mappen og sletter overskydende filer, så kun det angivne antal gemmes.
+        Lukker logfilen, omdøber den med et tidsstempel og åbner en ny. Kaldes med låsen taget.
+        """
+        self.__flush_file()
+        self.__file.close()
+        self.__file = None
+        stem = os.path.splitext(self.__filename)[0]
+        stamp = time.strftime('%Y-%m-%d_%H.%M.%S')
+        rotated = f'{stem}.{stamp}.log'
+        counter = 1
+        while any(os.path.exists(os.path.join(self.__dir, rotated + ext)) for ext in ('', '.gz')):
+            rotated = f'{stem}.{stamp}.{counter}.log'
+            counter += 1
+        os.replace(self.path, os.path.join(self.__dir, rotated))
+        self.__check_num_of_files(rotated)
+        if self.__compress:
+            if self.__compressor is None:
+                import concurrent.futures
+                # Tråden er ikke en dæmon, så en igangværende komprimering gøres færdig, før Python afslutter
+                self.__compressor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                          thread_name_prefix='Logger-gzip')
+            self.__compressor.submit(self.__gzip, rotated)
+        self.__file = open(self.path, 'w', encoding='utf-8', buffering=self.__buffering)
+        self.__size = 0
+        self.__opened = time.time()
+
+    def __gzip(self, name):
+        """
+        Komprimerer en roteret logfil med gzip og opdaterer manifestet. Kører i baggrundstråden.
+        """
+        src = os.path.join(self.__dir, name)
+        try:
+            with open(src, 'rb') as f_in, gzip.open(src + '.gz', 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        except FileNotFoundError:
+            # Filen er allerede slettet af oprydningen
+            return
+        with self.__locked_manifest():
+            files = self.__read_manifest()
+            if name not in files:
+                os.remove(src + '.gz')
+                return
+            os.remove(src)
+            self.__write_manifest([f + '.gz' if f == name else f for f in files])
+
+    def __start_writer(self):
         """
-        log_files = sorted(
-            glob.glob(os.path.join(self.path, f'{self.__filename}*.log')),
-            key=os.path.getmtime,
-            reverse=True
-        )
+        Starter baggrundstråden, hvis den ikke allerede kører.
+        """
+        if self.__thread is None or not self.__thread.is_alive():
+            self.__thread = threading.Thread(target=self.__writer, name='Logger', daemon=True)
+            self.__thread.start()
+            atexit.register(self.close)
+
+    def __writer(self):
+        """
+        Baggrundstråden: henter beskeder fra køen og skriver dem samlet. Tømmer bufferen, når køen er tom.
+        """
+        while True:
+            lines = [self.__queue.get()]
+            while len(lines) < 1000:
+                try:
+                    lines.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in lines
+            lines = [line for line in lines if line is not None]
+            with self.__lock:
+                if lines:
+                    self.__write_lines(lines)
+                if self.__queue.empty() or stop:
+                    self.__flush_file()
+            for _ in range(len(lines) + stop):
+                self.__queue.task_done()
+            if stop:
+                return
+
+    def __flush_file(self):
+        """
+        Tømmer filens buffer. Kaldes med låsen taget.
+        """
+        if self.__file is not None:
+            self.__file.flush()
+            self.__flushed += self.__pending
+            self.__pending = 0
+        if self.__json_file is not None:
+            self.__json_file.flush()
+
+    def flush(self):
+        """
+        Venter på, at baggrundstråden har skrevet alle beskeder i køen, og tømmer filens buffer.
+        """
+        if self.__background and self.__thread is not None and self.__thread.is_alive():
+            self.__queue.join()
+        with self.__lock:
+            self.__flush_file()
+
+    def close(self):
+        """
+        Tømmer bufferen, stopper baggrundstråden og lukker logfilen. Kaldes automatisk, når Python afsluttes.
+        En senere besked åbner filen igen i tilføjelsestilstand.
+        """
+        atexit.unregister(self.close)
+        if self.__background and self.__thread is not None and self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+        with self.__lock:
+            self.__flush_file()
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+            if self.__json_file is not None:
+                self.__json_file.close()
+                self.__json_file = None
+
+    def statistics(self):
+        """
+        Returnerer tællere for de skrevne beskeder.
+
+        Returnerer:
+        -----------
+        dict
+            `flushed` er antal beskeder, der er tømt til disken, `buffered` antal beskeder i filens buffer,
+            `queued` antal beskeder i køen til baggrundstråden og `dropped` antal kasserede beskeder.
+        """
+        with self.__lock:
+            return {'flushed': self.__flushed, 'buffered': self.__pending,
+                    'queued': self.__queue.qsize() if self.__queue is not None else 0, 'dropped': self.__dropped}
+
+    def __enter__(self):
+        self.start()
+        return self
 
-        files_to_delete = log_files[self.__num_of_logs:]
-        for file_path in files_to_delete:
-            os.remove(file_path)
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.critical(f'{exc_type.__name__}: {exc_value}')
+        self.end()
+
+    @contextlib.contextmanager
+    def __locked_manifest(self, timeout=10, stale=60):
+        """
+        Låser manifestet, mens det læses, ændres og skrives, både for tråde i processen og via en låsefil
+        for andre processer, der logger til samme mappe. En låsefil, der er ældre end `stale` sekunder,
+        regnes for efterladt af en proces, der er stoppet.
+        """
+        lock_path = self.__manifest + '.lock'
+        with self.__manifest_lock:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    break
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(lock_path) > stale:
+                            os.remove(lock_path)
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f'Could not lock {self.__manifest} within {timeout} seconds')
+                    time.sleep(0.01)
+            try:
+                os.close(fd)
+                yield
+            finally:
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+
+    def __read_manifest(self):
+        """
+        Læser listen over gemte logfiler fra manifestet, ældste først. Findes manifestet ikke, dannes det én
+        gang ud fra de eksisterende filer med samme filnavn.
+        """
+        try:
+            with open(self.__manifest, 'r', encoding='utf-8') as f:
+                return json.load(f)['files']
+        except (FileNotFoundError, ValueError, KeyError):
+            base = glob.escape(self.__base)
+            patterns = [f'{base} *.log', f'{base} *.log.gz', f'{base}.*.log', f'{base}.*.log.gz']
+            found = {p for pattern in patterns for p in glob.glob(os.path.join(self.__dir, pattern))}
+            return [os.path.basename(p) for p in sorted(found, key=os.path.getmtime)]
+
+    def __write_manifest(self, files):
+        """
+        Gemmer listen over logfiler i manifestet atomisk. Kaldes med manifestet låst.
+        """
+        tmp = f'{self.__manifest}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'files': files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.__manifest)
+
+    def __check_num_of_files(self, new_file):
+        """
+        Registrerer en ny logfil i manifestet og sletter de ældste filer, så kun det angivne antal gemmes.
+        En logfils JSON Lines-fil (`.jsonl`) slettes sammen med den.
+
+        Parametre:
+        ----------
+        new_file : str
+            Filnavnet på den nye logfil (uden mappe).
+        """
+        with self.__locked_manifest():
+            files = [f for f in self.__read_manifest() if f != new_file]
+            files.append(new_file)
+            files_to_delete = files[:-self.__num_of_logs] if self.__num_of_logs > 0 else files[:-1]
+            kept = files[len(files_to_delete):]
+            failed = []
+            for name in files_to_delete:
+                log_name = name[:-3] if name.endswith('.gz') else name
+                json_name = os.path.splitext(log_name)[0] + '.jsonl'
+                for path in (os.path.join(self.__dir, name), os.path.join(self.__dir, json_name)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError:
+                        # F.eks. PermissionError på Windows, når en anden proces har filen åben. Filen bliver
+                        # i manifestet, så den slettes ved næste oprydning
+                        if name not in failed:
+                            failed.append(name)
+            self.__write_manifest(failed + kept)
 
         return
 
@@ -114,14 +480,113 @@ class Logger:
         Hvis debug-tilstand er aktiveret, skrives yderligere debug-info til logfilen.
         """
         self.msg = f"{self.__get_time()} : INFO     : Starting"
-        with open(self.path, 'w', encoding='utf-8') as file:
-            file.write(self.msg + '\n')
+        # Beskeder fra før start skrives færdig, inden filen overskrives
+        self.flush()
+        with self.__lock:
+            self.__write_lines([self.msg], mode='w')
+        if self.__jsonl:
+            self.__write_json({'time': self.__get_time(), 'event': 'start', 'log': self.path}, mode='w')
         if self.debug == True:
             self.info('*****************************')
             self.info('******** DEBUGGING **********')
             self.info('*****************************')
 
-    def info(self, msg):
+    @contextlib.contextmanager
+    def timer(self, stage, memory=False):
+        """
+        Måler varigheden af en fase. Kan bruges både som context manager og som dekorator:
+
+            with log.timer('indlæs'):
+                ...
+
+            @log.timer('beregn')
+            def beregn(): ...
+
+        Varighed, antal kald og eventuelt hukommelsestop samles pr. fase og skrives i oversigten i `end()`.
+
+        Parametre:
+        ----------
+        stage : str
+            Navnet på fasen.
+        memory : bool, valgfri
+            Måler også den højeste mængde hukommelse, Python allokerer i fasen, med `tracemalloc`. Det gør
+            koden i fasen langsommere, og indlejrede målinger nulstiller toppen for den ydre fase (standard: False).
+        """
+        if memory:
+            if self.__tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.__tracing = 1
+            elif self.__tracing:
+                self.__tracing += 1
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            peak = None
+            if memory:
+                peak = max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+                if self.__tracing:
+                    self.__tracing -= 1
+                    if self.__tracing == 0:
+                        tracemalloc.stop()
+            with self.__lock:
+                timing = self.__timings.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'max': 0.0, 'peak': None})
+                timing['calls'] += 1
+                timing['seconds'] += seconds
+                timing['max'] = max(timing['max'], seconds)
+                if peak is not None:
+                    timing['peak'] = max(timing['peak'] or 0, peak)
+            if self.__jsonl:
+                self.__write_json({'time': self.__get_time(), 'stage': stage, 'seconds': seconds, 'peak_bytes': peak})
+
+    def timings(self):
+        """
+        Returnerer de målte faser.
+
+        Returnerer:
+        -----------
+        dict
+            Pr. fase: antal kald (`calls`), samlet tid (`seconds`), længste kald (`max`) og hukommelsestop i
+            bytes (`peak`, None hvis den ikke er målt).
+        """
+        with self.__lock:
+            return {stage: dict(timing) for stage, timing in self.__timings.items()}
+
+    def __summary(self, now):
+        """
+        Danner linjerne til oversigten over de langsomste faser.
+        """
+        timings = sorted(self.timings().items(), key=lambda item: item[1]['seconds'], reverse=True)
+        if not timings:
+            return []
+        width = max(len('Stage'), *(len(stage) for stage, _ in timings[:self.__summary_size]))
+        lines = [f"{now} : INFO     : Slowest stages",
+                 f"{now} : INFO     : {'Stage':<{width}} {'Calls':>7} {'Total s':>10} {'Mean s':>10} {'Max s':>10} {'Peak MB':>9}"]
+        for stage, t in timings[:self.__summary_size]:
+            peak = f"{t['peak'] / 1024 ** 2:.1f}" if t['peak'] is not None else '-'
+            lines.append(f"{now} : INFO     : {stage:<{width}} {t['calls']:>7} {t['seconds']:>10.3f} "
+                         f"{t['seconds'] / t['calls']:>10.4f} {t['max']:>10.3f} {peak:>9}")
+        return lines
+
+    def debugMsg(self, msg, *args):
+        """
+        Logger en debugbesked. Beskeden skrives kun, hvis `level` er `Logger.DEBUG`, f.eks. med debug-tilstand.
+
+        Parametre:
+        ----------
+        msg : str
+            Beskeden, der skal logges som debug.
+        *args : valgfri
+            Argumenter, der indsættes i beskeden med `%`, når den skrives.
+        """
+        if self.level > self.DEBUG:
+            return
+        self.__emit('DEBUG   ', msg, args)
+
+    def info(self, msg, *args):
         """
         Logger en informationsbesked.
 
@@ -129,11 +594,14 @@ class Logger:
         ----------
         msg : str
             Beskeden, der skal logges som info.
+        *args : valgfri
+            Argumenter, der indsættes i beskeden med `%`, når den skrives.
         """
-        self.msg = f"{self.__get_time()} : INFO     : {msg}"
-        self.__write(self.msg)
+        if self.level > self.INFO:
+            return
+        self.__emit('INFO    ', msg, args)
 
-    def critical(self, msg):
+    def critical(self, msg, *args):
         """
         Logger en kritisk besked.
 
@@ -143,13 +611,19 @@ class Logger:
         ----------
         msg : str
             Beskeden, der skal logges som kritisk.
+        *args : valgfri
+            Argumenter, der indsættes i beskeden med `%`, når den skrives.
         """
-        self.msg = f"{self.__get_time()} : CRITICAL : {msg}"
-        self.__write(self.msg)
         if self.debug == False:
             self.__criticals += 1
+        if self.level > self.CRITICAL:
+            return
+        self.__emit('CRITICAL', msg, args, keep=True)
+        # Kritiske beskeder går ofte forud for et nedbrud, så de skrives til disken med det samme,
+        # også når en baggrundstråd skriver
+        self.flush()
 
-    def warning(self, msg):
+    def warning(self, msg, *args):
         """
         Logger en advarselsbesked.
 
@@ -159,11 +633,14 @@ class Logger:
         ----------
         msg : str
             Beskeden, der skal logges som advarsel.
+        *args : valgfri
+            Argumenter, der indsættes i beskeden med `%`, når den skrives.
         """
-        self.msg = f"{self.__get_time()} : WARNING  : {msg}"
-        self.__write(self.msg)
         if self.debug == False:
             self.__warnings += 1
+        if self.level > self.WARNING:
+            return
+        self.__emit('WARNING ', msg, args)
 
     def end(self):
         """
@@ -173,9 +650,10 @@ class Logger:
         """
         elapsed_time = round(self.endTime())
         elapsed = time.strftime('%H:%M:%S', time.gmtime(elapsed_time))
-        msgs = []
-        msgs.append(f"{self.__get_time()} : INFO     : Ending")
-        msgs.append(f"{self.__get_time()} : INFO     : Time used : {elapsed.split('.')[0]}")
+        now = self.__get_time()
+        msgs = self.__summary(now)
+        msgs.append(f"{now} : INFO     : Ending")
+        msgs.append(f"{now} : INFO     : Time used : {elapsed.split('.')[0]}")
         if self.__warnings == 1: 
             warning_txt = 'Warning'
         else:
@@ -184,9 +662,13 @@ class Logger:
             critical_txt = 'Critical'
         else:
             critical_txt = 'Criticals'
-        msgs.append(f"{self.__get_time()} : INFO     : Ended with {self.__warnings} {warning_txt} and {self.__criticals} {critical_txt}")
+        msgs.append(f"{now} : INFO     : Ended with {self.__warnings} {warning_txt} and {self.__criticals} {critical_txt}")
         for msg in msgs:
-            self.__write(msg)
+            self.__write(msg, keep=True)
+        if self.__jsonl:
+            self.__write_json({'time': now, 'event': 'end', 'seconds': self.endTime(), 'warnings': self.__warnings,
+                               'criticals': self.__criticals, 'stages': self.timings()})
+        self.close()
 
     def endTime(self):
         """
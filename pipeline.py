@@ -0,0 +1,341 @@
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+try:
+    from .gis_helpers import Clipper
+except ImportError:
+    from gis_helpers import Clipper
+
+# Markerer, at en fase ikke sender flere bidder
+_DONE = object()
+
+# shapely-typekoder pr. geometrifamilie og familiens Multi-type til GeoPackage-skemaet
+_FAMILIES = {0: 0, 4: 0, 1: 1, 2: 1, 5: 1, 3: 3, 6: 3}
+_MULTI = {0: (4, 'MultiPoint'), 1: (5, 'MultiLineString'), 3: (6, 'MultiPolygon')}
+
+
+class StreamPipeline:
+    """
+    En streamende pipeline fra en databaseforespørgsel til klippet, fliseinddelt output.
+
+    Pipelinen består af fire faser, der kører i hver sin tråd og er forbundet med afgrænsede køer:
+    læsning af bidder med `DBConnect.iter_query`, dekodning af WKB-geometri, filtrering/klipning mod
+    én eller flere bounding boxes og skrivning til GeoPackage eller Parquet. Er en fase langsommere end
+    den foregående, fyldes køen, og den foregående fase venter (backpressure). Hukommelsesforbruget er
+    derfor begrænset af `chunk_rows` og `queue_size` og ikke af tabellens størrelse.
+
+    Attributter:
+    -----------
+    chunk_rows : int
+        Antal rækker pr. bid.
+    queue_size : int
+        Antal bidder, der højst må vente mellem to faser.
+    """
+
+    stages = ('read', 'decode', 'filter', 'write')
+
+    def __init__(self, db, sql, params=None, geometry='geometry', crs='EPSG:25832', bboxes=None, clip=True,
+                 chunk_rows=50_000, queue_size=4):
+        """
+        Initialiserer pipelinen.
+
+        Parametre:
+        ----------
+        db : DBConnect
+            Forbindelsen, der læses fra.
+        sql : str
+            Forespørgslen. Geometrien skal returneres som WKB, f.eks. `SHAPE.STAsBinary() AS geometry`.
+        params : sequence, valgfri
+            Parametre til forespørgslen.
+        geometry : str, valgfri
+            Navnet på WKB-kolonnen (standard: 'geometry').
+        crs : str, valgfri
+            Geometriens koordinatsystem (standard: 'EPSG:25832').
+        bboxes : list, valgfri
+            Én bounding box [minx, miny, maxx, maxy] eller en liste/et (N, 4)-array af bounding boxes.
+            Ved flere bokse får hver feature en kolonne `tile` med boksens nummer og skrives én gang pr. boks.
+        clip : bool, valgfri
+            Klip geometrierne til boksene. Hvis `False`, beholdes hele features, der skærer en boks (standard: True).
+        chunk_rows : int, valgfri
+            Antal rækker pr. bid (standard: 50.000).
+        queue_size : int, valgfri
+            Antal bidder, der højst må vente mellem to faser (standard: 4).
+        """
+        self.chunk_rows = chunk_rows
+        self.queue_size = queue_size
+        self.__db = db
+        self.__sql = sql
+        self.__params = params
+        self.__geometry = geometry
+        self.__crs = crs
+        self.__clip = clip
+        if bboxes is None:
+            self.__bboxes = None
+        else:
+            self.__bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+        self.__lock = threading.Lock()
+        self.__stats = {}
+        self.__error = None
+        self.__stop = threading.Event()
+        self.__elapsed = 0.0
+
+    def run(self, out_path, driver='GPKG', layer=None):
+        """
+        Kører pipelinen og skriver resultatet til `out_path`.
+
+        Parametre:
+        ----------
+        out_path : str
+            Stien til outputtet. Ved 'GPKG' en GeoPackage-fil; ved 'Parquet' en mappe, hvor hver bid
+            skrives som `part-<nr>.parquet` (kan læses samlet med `geopandas.read_parquet(mappe)`).
+        driver : str, valgfri
+            'GPKG' eller 'Parquet' (standard: 'GPKG').
+        layer : str, valgfri
+            Lagnavnet i GeoPackagen. Standard er filnavnet uden endelse.
+
+        Returnerer:
+        -----------
+        dict
+            Statistik pr. fase, se `stats`.
+        """
+        if driver not in ('GPKG', 'Parquet'):
+            raise ValueError(f"Unknown driver '{driver}', use 'GPKG' or 'Parquet'")
+        self.__stats = {stage: {'chunks': 0, 'rows_in': 0, 'rows_out': 0, 'busy_seconds': 0.0,
+                                'wait_seconds': 0.0} for stage in self.stages}
+        self.__error = None
+        self.__stop.clear()
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) - 1)]
+        workers = [
+            threading.Thread(target=self.__stage, args=('read', None, queues[0], self.__read()), daemon=True),
+            threading.Thread(target=self.__stage, args=('decode', queues[0], queues[1], self.__decode), daemon=True),
+            threading.Thread(target=self.__stage, args=('filter', queues[1], queues[2], self.__filter), daemon=True),
+            threading.Thread(target=self.__stage, args=('write', queues[2], None,
+                                                        self.__writer(out_path, driver, layer)), daemon=True),
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.__elapsed = time.perf_counter() - start
+        if self.__error is not None:
+            raise self.__error
+        return self.stats()
+
+    def stats(self):
+        """
+        Returnerer statistik for seneste kørsel.
+
+        Returnerer:
+        -----------
+        dict
+            Pr. fase: antal bidder (`chunks`), rækker ind og ud (`rows_in`, `rows_out`), tid brugt på arbejde
+            (`busy_seconds`) og på at vente på nabofaserne (`wait_seconds`) samt gennemløb i rækker pr.
+            sekund arbejdstid (`rows_per_second`). Nøglen 'total' angiver den samlede tid og rækker pr. sekund.
+        """
+        with self.__lock:
+            stats = {stage: dict(values) for stage, values in self.__stats.items()}
+        for values in stats.values():
+            values['rows_per_second'] = values['rows_in'] / values['busy_seconds'] if values['busy_seconds'] else 0.0
+        rows = stats['write']['rows_in'] if 'write' in stats else 0
+        stats['total'] = {'seconds': self.__elapsed, 'rows_written': rows,
+                          'rows_per_second': rows / self.__elapsed if self.__elapsed else 0.0}
+        return stats
+
+    def __stage(self, name, inbox, outbox, work):
+        """
+        Kører en fase: henter bidder fra `inbox`, behandler dem med `work` og sender resultatet til `outbox`.
+        Læsefasen har ingen `inbox` og får en generator i stedet; skrivefasen har ingen `outbox`.
+        """
+        stats = self.__stats[name]
+        try:
+            while not self.__stop.is_set():
+                started = time.perf_counter()
+                if inbox is None:
+                    chunk = next(work, _DONE)
+                    rows_in = 0 if chunk is _DONE else len(chunk)
+                    result = chunk
+                    busy = time.perf_counter() - started
+                else:
+                    chunk = self.__get(inbox, stats)
+                    started = time.perf_counter()
+                    if chunk is _DONE:
+                        result = _DONE
+                        rows_in = 0
+                    else:
+                        rows_in = len(chunk)
+                        result = work(chunk)
+                    busy = time.perf_counter() - started
+                with self.__lock:
+                    stats['busy_seconds'] += busy
+                    if chunk is not _DONE:
+                        stats['chunks'] += 1
+                        stats['rows_in'] += rows_in
+                        stats['rows_out'] += len(result) if result is not None else 0
+                if outbox is not None:
+                    self.__put(outbox, result, stats)
+                if chunk is _DONE:
+                    break
+        except BaseException as e:
+            self.__error = self.__error or e
+            self.__stop.set()
+        finally:
+            # Lukker generatoren, så cursoren frigives, også hvis en senere fase fejlede
+            if inbox is None:
+                work.close()
+
+    def __get(self, inbox, stats):
+        """
+        Henter en bid fra en kø og registrerer ventetiden. Afbrydes, hvis en anden fase fejler.
+        """
+        started = time.perf_counter()
+        while True:
+            try:
+                item = inbox.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self.__stop.is_set():
+                    item = _DONE
+                    break
+        with self.__lock:
+            stats['wait_seconds'] += time.perf_counter() - started
+        return item
+
+    def __put(self, outbox, item, stats):
+        """
+        Sender en bid til en kø og venter, hvis køen er fuld (backpressure). Afbrydes, hvis en anden fase fejler.
+        """
+        started = time.perf_counter()
+        while not self.__stop.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        with self.__lock:
+            stats['wait_seconds'] += time.perf_counter() - started
+
+    def __read(self):
+        """
+        Læsefasen: bidder med WKB-geometri fra databasen.
+        """
+        return self.__db.iter_query(self.__sql, self.__params, chunk_rows=self.chunk_rows)
+
+    def __decode(self, chunk):
+        """
+        Dekodningsfasen: WKB-kolonnen konverteres vektoriseret til en GeoDataFrame.
+        """
+        import geopandas as gpd
+
+        chunk[self.__geometry] = gpd.GeoSeries.from_wkb(np.asarray(chunk[self.__geometry], dtype=object),
+                                                        index=chunk.index)
+        return gpd.GeoDataFrame(chunk, geometry=self.__geometry, crs=self.__crs)
+
+    def __filter(self, chunk):
+        """
+        Filtreringsfasen: klipper eller filtrerer bidden mod bounding boxene.
+        """
+        import pandas as pd
+        import shapely
+
+        if self.__bboxes is None:
+            return chunk
+        if not self.__clip:
+            boxes = shapely.box(*self.__bboxes.T)
+            tile_idx, feature_idx = shapely.STRtree(np.asarray(chunk.geometry.values, dtype=object)).query(
+                boxes, predicate='intersects')
+            result = chunk.iloc[feature_idx]
+        else:
+            clipper = Clipper(chunk)
+            parts = [clipper.clip(bbox) for bbox in self.__bboxes]
+            tile_idx = np.repeat(np.arange(len(parts)), [len(part) for part in parts])
+            result = pd.concat(parts) if len(parts) > 1 else parts[0]
+        if len(self.__bboxes) > 1:
+            result = result.assign(tile=tile_idx)
+        return result
+
+    def __writer(self, out_path, driver, layer):
+        """
+        Skrivefasen: returnerer en funktion, der skriver hver bid inkrementelt til outputtet.
+
+        Skemaet lægges fast ud fra den første bid, så senere bidder kan tilføjes: kolonnetyperne gives
+        videre til alle bidder, og geometrierne gøres til familiens Multi-type, så f.eks. Polygon,
+        MultiPolygon og GeometryCollection fra klipningen kan stå i samme lag. Dele af en anden dimension
+        (f.eks. en linje, hvor en polygon rører boksens kant) udelades ligesom i `geopandas.clip`. Har den
+        første bid flere geometrifamilier, skrives laget med geometritypen 'Unknown' uden omformning.
+        """
+        state = {'part': 0, 'dtypes': None, 'family': None, 'schema': None}
+        if driver == 'Parquet':
+            os.makedirs(out_path, exist_ok=True)
+        layer = layer or os.path.splitext(os.path.basename(out_path))[0]
+
+        def write(chunk):
+            if len(chunk) == 0:
+                return chunk
+            chunk = self.__conform(chunk, state, driver)
+            if driver == 'Parquet':
+                chunk.to_parquet(os.path.join(out_path, f"part-{state['part']:05d}.parquet"))
+            else:
+                chunk.to_file(out_path, layer=layer, driver='GPKG', mode='w' if state['part'] == 0 else 'a',
+                              schema=state['schema'])
+            state['part'] += 1
+            return chunk
+        return write
+
+    @staticmethod
+    def __conform(chunk, state, driver):
+        """
+        Tilpasser en bid til skemaet fra den første bid. Ved den første bid fastlægges skemaet.
+        """
+        import geopandas as gpd
+        import shapely
+
+        name = chunk.geometry.name
+        geoms = np.asarray(chunk.geometry.values, dtype=object)
+        # Dele af multi-geometrier og GeometryCollections, to niveauer ned, med nummeret på deres feature
+        parts, index = shapely.get_parts(geoms, return_index=True)
+        parts, sub = shapely.get_parts(parts, return_index=True)
+        index = index[sub]
+        families = np.array([_FAMILIES.get(t, -1) for t in shapely.get_type_id(parts)], dtype=int)
+
+        if state['dtypes'] is None:
+            from geopandas.io.file import infer_schema
+
+            state['dtypes'] = chunk.drop(columns=name).dtypes
+            found = set(np.unique(families).tolist()) - {-1}
+            # Parquet gemmer geometrien som WKB uden fast type, så kun GeoPackagen får en geometrifamilie
+            state['family'] = found.pop() if len(found) == 1 and driver != 'Parquet' else None
+            if driver != 'Parquet':
+                schema = infer_schema(chunk)
+                schema['geometry'] = _MULTI[state['family']][1] if state['family'] is not None else 'Unknown'
+                state['schema'] = schema
+        else:
+            changed = {col: dtype for col, dtype in state['dtypes'].items()
+                       if col in chunk.columns and chunk[col].dtype != dtype}
+            for col, dtype in changed.items():
+                try:
+                    chunk = chunk.assign(**{col: chunk[col].astype(dtype)})
+                except (TypeError, ValueError):
+                    # F.eks. NULL i en heltalskolonne; skemaet bestemmer stadig feltets type i GeoPackagen
+                    pass
+
+        family = state['family']
+        if family is None:
+            return chunk
+        multi_type = _MULTI[family][0]
+        type_ids = shapely.get_type_id(geoms)
+        if np.all((type_ids == multi_type) | (type_ids == -1)):
+            return chunk
+        keep = families == family
+        result = np.full(len(geoms), None, dtype=object)
+        features, inverse = np.unique(index[keep], return_inverse=True)
+        if len(features):
+            collect = {0: shapely.multipoints, 1: shapely.multilinestrings, 3: shapely.multipolygons}[family]
+            result[features] = collect(parts[keep], indices=inverse)
+        chunk = chunk.copy()
+        chunk[name] = gpd.GeoSeries(result, index=chunk.index, crs=chunk.crs)
+        return chunk
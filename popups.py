@@ -16,9 +16,22 @@ bruger følgende:
     Kan evt. gemmes i en folder og bruges senere
     
 """
-import arcpy
 import os
 import json
+
+
+def _arcpy():
+    """
+    Importerer arcpy ved første brug og giver en tydelig fejl, hvis ArcGIS ikke er installeret.
+    Holdes lokalt frem for at hentes fra gis_helpers, som ellers ville importere NumPy og shapely med.
+    """
+    try:
+        import arcpy
+    except ImportError as e:
+        raise ImportError('This function requires arcpy, which is only available with ArcGIS Pro') from e
+    return arcpy
+
+
 def arcgisProPopup(fc, conn, exclude=None, showIfEmpty=None):
     popup = """ 
             var attributes = {};
@@ -53,7 +66,7 @@ def arcgisProPopup(fc, conn, exclude=None, showIfEmpty=None):
             };
 """
     featureclass = os.path.join(conn, fc)
-    desc = arcpy.Describe(featureclass)
+    desc = _arcpy().Describe(featureclass)
     # for field in desc.fields:
     if not exclude: exclude = []
     if not showIfEmpty: showIfEmpty = []
@@ -73,7 +86,7 @@ def arcgisProPopup(fc, conn, exclude=None, showIfEmpty=None):
 
 def webgisPopup(fc, conn, title, showIfEmpty=[], exclude=[], showNotIfEmpty=[]):
     featureclass = os.path.join(conn, fc)
-    desc = arcpy.Describe(featureclass)
+    desc = _arcpy().Describe(featureclass)
     # for field in desc.fields:
     show = []
     shownotifempty = []
@@ -158,5 +171,6 @@ def webgisPopup(fc, conn, title, showIfEmpty=[], exclude=[], showNotIfEmpty=[]):
     return result #{'fieldInfos': fieldInfos, 'expressions': expressions, 'table': table}
 
 
-pp = webgisPopup('Administration.AdgangsAdresser', r'Z:\Arcgis Administration\_DatabaseConnections\PortalProd_Administration.sde', 'Adgangsadresse')
-print(pp)
+if __name__ == "__main__":
+    pp = webgisPopup('Administration.AdgangsAdresser', r'Z:\Arcgis Administration\_DatabaseConnections\PortalProd_Administration.sde', 'Adgangsadresse')
+    print(pp)
@@ -0,0 +1,90 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from boundingBox import BoundingBox
+
+
+@pytest.mark.parametrize('bbox, max_area, expected', [
+    ([0, 0, 100, 1], 50, 2),
+    ([0, 0, 100, 100], 1500, 9),
+    ([0, 0, 10, 10], 100, 1),
+])
+def test_tile_max_area_keeps_tiles_near_square(bbox, max_area, expected):
+    tiles = BoundingBox(bbox).tile(bbox, max_area=max_area)
+    widths = tiles[:, 2] - tiles[:, 0]
+    heights = tiles[:, 3] - tiles[:, 1]
+    assert len(tiles) == expected
+    assert np.all(widths * heights <= max_area + 1e-9)
+    if bbox[2] - bbox[0] == bbox[3] - bbox[1]:
+        assert np.allclose(widths, heights)
+
+
+def test_tile_covers_bbox():
+    bbox = [0, 0, 300, 100]
+    tiles = BoundingBox(bbox).tile(bbox, max_size=40, max_area=1000)
+    assert (tiles[:, 2] - tiles[:, 0]).max() <= 40
+    assert (tiles[:, 3] - tiles[:, 1]).max() <= 40
+    assert tiles[:, 0].min() == 0 and tiles[:, 2].max() == 300
+    assert tiles[:, 1].min() == 0 and tiles[:, 3].max() == 100
+
+
+class FakeService:
+    """
+    En lokal stand-in for en WFS-service, der returnerer højst `limit` features pr. forespørgsel.
+    """
+
+    def __init__(self, points, limit, counts=False):
+        self.points = points
+        self.limit = limit
+        self.counts = counts
+        self.requests = []
+
+    def __call__(self, tile):
+        self.requests.append(tuple(tile))
+        minx, miny, maxx, maxy = tile
+        inside = ((self.points[:, 0] >= minx) & (self.points[:, 0] < maxx)
+                  & (self.points[:, 1] >= miny) & (self.points[:, 1] < maxy))
+        if self.counts:
+            return np.int64(inside.sum())
+        return [tuple(p) for p in self.points[inside][:self.limit]]
+
+
+def _points():
+    rng = np.random.default_rng(0)
+    # En tæt klynge i nederste venstre hjørne og spredte punkter i resten
+    return np.vstack([rng.random((900, 2)) * 10, rng.random((300, 2)) * 100])
+
+
+def test_adaptive_split_returns_every_feature_once():
+    points = _points()
+    service = FakeService(points, limit=100)
+    tiles = list(BoundingBox([0, 0, 100, 100]).adaptiveSplit([0, 0, 100, 100], service, limit=100))
+    features = [f for _, result in tiles for f in result]
+    assert all(len(result) < 100 for _, result in tiles)
+    assert sorted(features) == sorted(map(tuple, points))
+    # Hver flise spørges kun én gang, og kun fliser ved grænsen er opdelt
+    assert len(service.requests) == len(set(service.requests))
+    root = [t for t in service.requests if t == (0.0, 0.0, 100.0, 100.0)]
+    assert len(root) == 1
+
+
+def test_adaptive_split_splits_only_dense_tiles():
+    points = _points()
+    service = FakeService(points, limit=100, counts=True)
+    tiles = list(BoundingBox([0, 0, 100, 100]).adaptiveSplit([0, 0, 100, 100], service, limit=100))
+    assert sum(int(count) for _, count in tiles) == len(points)
+    sizes = {round(tile[2] - tile[0], 6) for tile, _ in tiles}
+    # Klyngen giver små fliser, mens de tynde områder beholder store fliser
+    assert min(sizes) <= 6.25 and max(sizes) >= 50
+    # Opdelte fliser er alle dem, der ramte grænsen, og de returneres ikke selv
+    split = [t for t in service.requests if list(t) not in [tile for tile, _ in tiles]]
+    assert all(service(list(t)) >= 100 for t in split)
+
+
+def test_adaptive_split_respects_max_depth():
+    points = np.zeros((500, 2)) + 1.0
+    service = FakeService(points, limit=10, counts=True)
+    tiles = list(BoundingBox([0, 0, 64, 64]).adaptiveSplit([0, 0, 64, 64], service, limit=10, max_depth=3))
+    assert sum(int(count) for _, count in tiles) == 500
+    assert min(tile[2] - tile[0] for tile, _ in tiles) == 8
@@ -0,0 +1,66 @@
+import gc
+import sqlite3
+import threading
+
+import pytest
+
+from DatabaseConnections import ConnectionPool, DBConnect
+
+
+def factory():
+    return sqlite3.connect(':memory:', check_same_thread=False)
+
+
+def test_checkout_reuses_connections():
+    pool = ConnectionPool(factory, max_size=2)
+    first = pool.checkout()
+    pool.checkin(first)
+    assert pool.checkout() is first
+    stats = pool.statistics()
+    assert stats['creates'] == 1
+    assert stats['checkouts'] == 2
+
+
+def test_overflow_is_bounded_and_times_out():
+    pool = ConnectionPool(factory, max_size=2, max_overflow=1, checkout_timeout=0.2)
+    held = [pool.checkout() for _ in range(3)]
+    assert pool.statistics()['overflows'] == 1
+    with pytest.raises(TimeoutError):
+        pool.checkout()
+    pool.checkin(held.pop())
+    assert pool.checkout() is not None
+    # Overløbsforbindelsen lukkes ved aflevering, når puljen har max_size ledige
+    for cnxn in held:
+        pool.checkin(cnxn)
+    assert pool.statistics()['idle'] <= 2
+
+
+def test_checkout_waits_for_checkin():
+    pool = ConnectionPool(factory, max_size=1, max_overflow=0, checkout_timeout=5)
+    cnxn = pool.checkout()
+    threading.Timer(0.1, pool.checkin, args=(cnxn,)).start()
+    assert pool.checkout() is cnxn
+    assert pool.statistics()['waits'] == 1
+
+
+def test_checkin_resets_session_state():
+    pool = ConnectionPool(factory, max_size=1)
+    cnxn = pool.checkout()
+    cnxn.execute('CREATE TABLE t (a INTEGER)')
+    cnxn.commit()
+    cnxn.isolation_level = None
+    pool.checkin(cnxn)
+    cnxn = pool.checkout()
+    assert cnxn.isolation_level == ''
+    cnxn.execute('INSERT INTO t VALUES (1)')
+    pool.checkin(cnxn)
+    cnxn = pool.checkout()
+    assert cnxn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+
+def test_dbconnect_handles_keep_connection_checked_out():
+    handle = DBConnect('test', 'sqlite-handles', connect=factory).conn()
+    gc.collect()
+    other = DBConnect('test', 'sqlite-handles', connect=factory)
+    assert other.conn()._obj is not handle._obj
+    assert handle.execute('SELECT 1').fetchone() == (1,)
@@ -0,0 +1,132 @@
+import json
+import os
+import socket
+
+import pytest
+
+aiosmtpd = pytest.importorskip('aiosmtpd.controller')
+
+from emailer import Mailer
+
+
+class Handler:
+    def __init__(self):
+        self.sessions = []
+        self.messages = []
+        self.busy = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('nobody@'):
+            return '550 5.1.1 No such user'
+        if address.startswith('busy@') and self.busy:
+            self.busy -= 1
+            return '450 4.2.1 Mailbox busy'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        if not any(s is session for s in self.sessions):
+            self.sessions.append(session)
+        self.messages.append((envelope.mail_from, list(envelope.rcpt_tos)))
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    port = free_port()
+    handler = Handler()
+    controllers = []
+
+    def start():
+        controller = aiosmtpd.Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        controllers.append(controller)
+
+    start()
+    monkeypatch.setenv('EMAILER_SMTP_SERVER', '127.0.0.1')
+    monkeypatch.setenv('EMAILER_SMTP_PORT', str(port))
+    monkeypatch.setenv('EMAILER_SENDER', 'robot@lk.dk')
+    monkeypatch.setenv('EMAILER_USER', '')
+    monkeypatch.setenv('EMAILER_PASS', '')
+    yield handler, start, controllers
+    controllers[-1].stop()
+
+
+def test_session_is_reused_inside_with_block(smtp):
+    handler = smtp[0]
+    with Mailer(starttls=False) as mailer:
+        for i in range(3):
+            assert mailer.sendmail(f'Rapport {i}', ['a@lk.dk'], text='hej') == {}
+    assert len(handler.messages) == 3
+    assert len(handler.sessions) == 1
+
+
+def test_reconnects_after_server_drops_connection(smtp):
+    handler, start, controllers = smtp
+    with Mailer(starttls=False) as mailer:
+        mailer.sendmail('Før', ['a@lk.dk'], text='hej')
+        # Serveren genstartes, så Mailerens åbne forbindelse er lukket i den anden ende
+        controllers[-1].stop()
+        start()
+        assert mailer.sendmail('Efter', ['a@lk.dk'], text='hej') == {}
+    assert len(handler.messages) == 2
+    assert len(handler.sessions) == 2
+
+
+def test_send_many_reports_result_per_recipient(smtp):
+    handler = smtp[0]
+    with Mailer(starttls=False) as mailer:
+        results = mailer.send_many([
+            {'subject': 'Et', 'tos': ['a@lk.dk', 'nobody@lk.dk'], 'text': 'hej'},
+            {'subject': 'To', 'tos': ['nobody@lk.dk'], 'text': 'hej'},
+            {'subject': 'Tre', 'tos': ['b@lk.dk'], 'text': 'hej'},
+        ])
+    assert results[0]['a@lk.dk'] is None
+    assert results[0]['nobody@lk.dk'][0] == 550
+    assert results[1]['nobody@lk.dk'][0] == 550
+    assert results[2] == {'b@lk.dk': None}
+    assert [rcpts for _, rcpts in handler.messages] == [['a@lk.dk'], ['b@lk.dk']]
+    assert len(handler.sessions) == 1
+
+
+def queued_mailer(tmp_path):
+    return Mailer(starttls=False, queued=True, spool_dir=str(tmp_path), workers=1, backoff=0.05, max_attempts=3)
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_queued_retries_temporarily_refused_and_buries_permanently_refused(smtp, tmp_path):
+    handler = smtp[0]
+    handler.busy = 1
+    mailer = queued_mailer(tmp_path)
+    msg_id = mailer.sendmail('Rapport', ['a@lk.dk', 'busy@lk.dk', 'nobody@lk.dk'], text='hej')
+    assert mailer.close(timeout=10) == 0
+    assert [rcpts for _, rcpts in handler.messages] == [['a@lk.dk'], ['busy@lk.dk']]
+    assert not os.path.exists(tmp_path / (msg_id + '.eml'))
+    dead = read_json(tmp_path / 'dead' / (msg_id + '.refused.json'))
+    assert dead['recipients'] == ['nobody@lk.dk']
+    assert dead['refused']['nobody@lk.dk'][0] == 550
+    assert os.path.exists(tmp_path / 'dead' / (msg_id + '.refused.eml'))
+
+
+def test_queued_buries_temporarily_refused_after_max_attempts(smtp, tmp_path):
+    handler = smtp[0]
+    handler.busy = 10
+    mailer = queued_mailer(tmp_path)
+    msg_id = mailer.sendmail('Rapport', ['a@lk.dk', 'busy@lk.dk'], text='hej')
+    assert mailer.close(timeout=10) == 0
+    assert [rcpts for _, rcpts in handler.messages] == [['a@lk.dk']]
+    dead = read_json(tmp_path / 'dead' / (msg_id + '.refused.json'))
+    assert dead['recipients'] == ['busy@lk.dk']
+    assert dead['refused']['busy@lk.dk'][0] == 450
+    assert dead['attempts'] == 3
+    assert sorted(os.listdir(tmp_path)) == ['dead']
@@ -0,0 +1,79 @@
+import types
+
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+shapely = pytest.importorskip('shapely')
+
+import gis_helpers
+
+
+def fake_factory(calls):
+    """
+    En geometrifabrik uden ArcPy, der registrerer kaldene og bygger geometrien med shapely.
+    """
+    def factory(wkb, epsg):
+        calls.append(epsg)
+        return ('fake', epsg, shapely.from_wkb(wkb))
+    return factory
+
+
+@pytest.fixture
+def gdf():
+    geoms = [shapely.Point(i, i) if i % 4 else shapely.box(i, i, i + 1, i + 2) for i in range(10)]
+    geoms[5] = None
+    return gpd.GeoDataFrame({'navn': [f'f{i}' for i in range(10)], 'vaerdi': range(10)}, geometry=geoms,
+                            crs='EPSG:25832')
+
+
+def test_add_geometry_round_trips_wkb(gdf):
+    calls = []
+    result = gis_helpers.addGeometry(gdf, drop_geom=True, epsg=25833, geometry_factory=fake_factory(calls))
+    assert 'geometry' not in result.columns
+    assert len(calls) == 9 and set(calls) == {25833}
+    for original, shape in zip(gdf.geometry, result['SHAPE@']):
+        if original is None:
+            assert shape is None
+        else:
+            assert shape[0] == 'fake' and shape[2].equals_exact(original, 0)
+
+
+def test_iter_rows_puts_geometry_last(gdf):
+    rows = list(gis_helpers.iterRows(gdf, fields=['vaerdi', 'navn'], geometry_factory=fake_factory([])))
+    assert rows[0][:2] == (0, 'f0')
+    assert rows[1][2][2].equals(gdf.geometry[1])
+    assert rows[5][2] is None
+
+
+def test_insert_rows_batches_wkb_encoding(gdf, monkeypatch):
+    inserted = []
+    encoded = []
+
+    class InsertCursor:
+        def __init__(self, featureclass, fields):
+            self.fields = fields
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def insertRow(self, row):
+            assert len(row) == len(self.fields)
+            inserted.append(row)
+
+    to_wkb = shapely.to_wkb
+
+    def counting_to_wkb(geoms, *args, **kwargs):
+        encoded.append(len(geoms))
+        return to_wkb(geoms, *args, **kwargs)
+
+    fake_arcpy = types.SimpleNamespace(da=types.SimpleNamespace(InsertCursor=InsertCursor))
+    monkeypatch.setattr(gis_helpers, '_arcpy', lambda: fake_arcpy)
+    monkeypatch.setattr(gis_helpers.shapely, 'to_wkb', counting_to_wkb)
+
+    count = gis_helpers.insertRows(gdf, 'fc', batch_size=4, geometry_factory=fake_factory([]))
+    assert count == len(inserted) == 10
+    assert encoded == [4, 4, 2]
+    assert [row[0] for row in inserted] == list(gdf['navn'])
@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import importtime_check
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Moduler, der bruger NumPy direkte og derfor må importere det ved indlæsning
+USES_NUMPY = {'boundingBox', 'gis_helpers', 'pipeline'}
+
+
+def imported_modules(module):
+    """
+    Importerer et modul i en ny proces og returnerer de importerede topniveau-pakker.
+    """
+    code = f'import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))'
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1]
+        if error.startswith('ModuleNotFoundError'):
+            pytest.skip(f'{module}: {error}')
+        pytest.fail(f'{module} failed to import: {error}')
+    return {name.split('.')[0] for name in json.loads(result.stdout)}
+
+
+@pytest.mark.parametrize('module', importtime_check.MODULES)
+def test_module_does_not_import_heavy_dependencies(module):
+    heavy = {'geopandas', 'pyodbc', 'sqlalchemy'}
+    if module not in USES_NUMPY:
+        heavy.add('numpy')
+    assert not heavy & imported_modules(module)
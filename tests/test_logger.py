@@ -0,0 +1,35 @@
+import json
+import multiprocessing
+import os
+
+from logger import Logger
+
+
+def test_max_bytes_counts_encoded_bytes(tmp_path):
+    log = Logger(str(tmp_path), filename='utf', max_bytes=1000)
+    log.start()
+    for _ in range(200):
+        log.info('æøå' * 10)
+    log.end()
+    files = [f for f in os.listdir(tmp_path) if f.startswith('utf') and f.endswith('.log')]
+    assert len(files) > 1
+    # Én linje kan gå over grænsen, før der roteres, men ikke en hel fil med to-byte tegn
+    assert max(os.path.getsize(tmp_path / f) for f in files) < 1200
+
+
+def _retain(path, worker):
+    for k in range(5):
+        log = Logger(path, filename='job', num_of_logs=1000)
+        log._Logger__check_num_of_files(f'job.p{worker}.{k}.log')
+
+
+def test_manifest_keeps_entries_from_concurrent_processes(tmp_path):
+    processes = [multiprocessing.Process(target=_retain, args=(str(tmp_path), i)) for i in range(6)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    with open(tmp_path / 'job.manifest.json', encoding='utf-8') as f:
+        files = json.load(f)['files']
+    assert len(files) == 30
+    assert sorted(os.listdir(tmp_path)) == ['job.manifest.json']
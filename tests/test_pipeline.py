@@ -0,0 +1,71 @@
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+fiona = pytest.importorskip('fiona')
+pd = pytest.importorskip('pandas')
+shapely = pytest.importorskip('shapely')
+
+from pipeline import StreamPipeline
+
+
+class FakeDB:
+    """
+    En lokal stand-in for DBConnect, der returnerer færdige bidder med WKB-geometri.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def iter_query(self, sql, params=None, chunk_rows=50_000):
+        for rows in self.chunks:
+            yield pd.DataFrame({'navn': [r[0] for r in rows], 'antal': [r[1] for r in rows],
+                                'geometry': [shapely.to_wkb(r[2]) if r[2] is not None else None for r in rows]})
+
+
+def read_layer(path):
+    with fiona.open(path) as layer:
+        return layer.schema, [feature for feature in layer]
+
+
+def test_gpkg_append_with_mixed_geometry_types(tmp_path):
+    chunks = [
+        [('a', 1, shapely.box(0, 0, 1, 1)), ('b', 2, shapely.box(2, 2, 3, 3))],
+        [('c', None, shapely.MultiPolygon([shapely.box(0, 0, 1, 1), shapely.box(4, 4, 5, 5)])),
+         ('d', 4, shapely.GeometryCollection([shapely.box(6, 6, 7, 7), shapely.LineString([(0, 0), (1, 1)])])),
+         ('e', 5, None)],
+    ]
+    out = str(tmp_path / 'mixed.gpkg')
+    stats = StreamPipeline(FakeDB(chunks), 'sql', chunk_rows=2).run(out)
+    schema, features = read_layer(out)
+    assert stats['write']['rows_in'] == 5
+    assert schema['geometry'] == 'MultiPolygon'
+    assert [f['properties']['navn'] for f in features] == ['a', 'b', 'c', 'd', 'e']
+    assert features[3]['geometry']['type'] == 'MultiPolygon'
+    assert features[4]['geometry'] is None
+
+
+def test_gpkg_append_after_clipping(tmp_path):
+    # Klipningen giver Polygon i første bid og MultiPolygon og en linje langs kanten i den næste
+    chunks = [
+        [('a', 1, shapely.box(0, 0, 4, 4))],
+        [('b', 2, shapely.Polygon([(3, 0), (9, 0), (9, 9), (3, 9), (3, 8), (8, 8), (8, 1), (3, 1)])),
+         ('c', 3, shapely.box(5, 5, 6, 6).union(shapely.box(6, 6, 7, 7)))],
+    ]
+    out = str(tmp_path / 'clip.gpkg')
+    StreamPipeline(FakeDB(chunks), 'sql', bboxes=[0, 0, 5, 10]).run(out)
+    schema, features = read_layer(out)
+    assert schema['geometry'] == 'MultiPolygon'
+    geometries = {f['properties']['navn']: f['geometry'] for f in features}
+    assert geometries['a']['type'] == geometries['b']['type'] == 'MultiPolygon'
+    # 'c' rører kun boksens kant; linjen udelades, men rækken bevares uden geometri
+    assert geometries['c'] is None
+
+
+def test_first_chunk_with_mixed_families_uses_unknown_geometry(tmp_path):
+    chunks = [[('p', 1, shapely.Point(0, 0)), ('l', 2, shapely.LineString([(0, 0), (1, 1)]))],
+              [('q', 3, shapely.box(0, 0, 1, 1))]]
+    out = str(tmp_path / 'unknown.gpkg')
+    StreamPipeline(FakeDB(chunks), 'sql', chunk_rows=2).run(out)
+    schema, features = read_layer(out)
+    assert schema['geometry'] == 'Unknown'
+    assert [f['geometry']['type'] for f in features] == ['Point', 'LineString', 'Polygon']
@@ -1,15 +1,26 @@
 import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
 
-def unpack(infile, outfolder, structure=False):
+# Kopibufferen til store filer er større end shutil's standard på 64 KB, så de skrives med færre systemkald
+BUFFER_SIZE = 1024 * 1024
+SMALL_BUFFER_SIZE = 64 * 1024
+
+
+def unpack(infile, outfolder, structure=False, workers=1, buffer_size=BUFFER_SIZE):
     """
     Udpakker en zip-fil til en angivet mappe med eller uden at bevare mappestrukturen.
 
-    Denne funktion kan udpakke en zip-fil til en bestemt output-mappe. Hvis parameteren `structure` 
-    er sat til `True`, vil den bevare den oprindelige mappestruktur fra zip-filen. Hvis `structure` 
+    Denne funktion kan udpakke en zip-fil til en bestemt output-mappe. Hvis parameteren `structure`
+    er sat til `True`, vil den bevare den oprindelige mappestruktur fra zip-filen. Hvis `structure`
     er `False`, vil alle filer blive udpakket direkte til output-mappen uden mappestrukturen.
 
+    Med `workers` større end 1 fordeles filerne på en trådpulje, hvor hver tråd har sin egen `ZipFile`.
+    Udpakningen af zlib-data og skrivningen til disk frigiver GIL'en, så trådene arbejder samtidigt.
+    Filerne får deres ændringstidspunkt fra zip-filen.
+
     Parametre:
     ----------
     infile : str
@@ -17,17 +28,106 @@ def unpack(infile, outfolder, structure=False):
     outfolder : str
         Stien til mappen, hvor filerne skal udpakkes.
     structure : bool, valgfri
-        Hvis `True`, bevares mappestrukturen fra zip-filen. Hvis `False`, udpakkes filerne uden struktur. 
+        Hvis `True`, bevares mappestrukturen fra zip-filen. Hvis `False`, udpakkes filerne uden struktur.
         Standard er `False`.
+    workers : int, valgfri
+        Antal tråde, der udpakker samtidigt. Standard er 1.
+    buffer_size : int, valgfri
+        Størrelsen på kopibufferen i bytes til filer, der er større end bufferen. Mindre filer kopieres med
+        64 KB. Standard er 1 MB.
 
     Returnerer:
     -----------
     Ingen (None).
+
+    Bemærkninger:
+    -------------
+    Stier i zip-filen renses, så absolutte stier, drevbogstaver og `..` ikke kan skrive uden for
+    `outfolder`. Uden struktur overskriver en senere fil med samme navn en tidligere, som hidtil.
+    """
+    with ZipFile(infile) as zObject:
+        members = _members(zObject, outfolder, structure)
+
+    if workers <= 1 or len(members) <= 1:
+        _extract(infile, members, buffer_size)
+        return
+
+    # De største filer fordeles først, og hver fil gives til tråden med mindst arbejde (LPT), så trådene
+    # bliver færdige nogenlunde samtidigt
+    groups = [[] for _ in range(min(workers, len(members)))]
+    loads = [0] * len(groups)
+    for member in sorted(members, key=lambda m: m[0].compress_size + m[0].file_size, reverse=True):
+        i = loads.index(min(loads))
+        groups[i].append(member)
+        loads[i] += member[0].compress_size + member[0].file_size
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        for future in [executor.submit(_extract, infile, group, buffer_size) for group in groups]:
+            future.result()
+
+
+def _members(zObject, outfolder, structure):
     """
-    if structure:
-        with ZipFile(infile,'r') as zObject:
-            zObject.extractall(path=outfolder)
-    else:
+    Finder filerne i zip-filen og deres rensede målstier og opretter de nødvendige mapper. Med struktur
+    oprettes også mapper, der er tomme i zip-filen.
+
+    Returnerer:
+    -----------
+    list
+        (ZipInfo, målsti) for hver fil, der skal udpakkes.
+    """
+    targets = {}
+    folders = {outfolder}
+    for info in zObject.infolist():
+        if info.is_dir() and not structure:
+            continue
+        if structure:
+            # Samme rensning som ZipFile.extract: ingen drev, ingen rod og ingen '..'-dele
+            parts = [p for p in info.filename.replace('\\', '/').split('/')
+                     if p and p not in ('.', '..') and not (len(p) == 2 and p[1] == ':')]
+            if not parts:
+                continue
+            target = os.path.join(outfolder, *parts)
+            if info.is_dir():
+                # Mapper oprettes, også når de er tomme
+                folders.add(target)
+                continue
+            folders.add(os.path.dirname(target))
+        else:
+            filename = os.path.basename(info.filename.replace('\\', '/'))
+            if not filename or filename in ('.', '..'):
+                continue
+            target = os.path.join(outfolder, filename)
+        # Den sidste fil med en given målsti vinder, ligesom når filerne udpakkes i rækkefølge
+        targets.pop(target, None)
+        targets[target] = info
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+    return [(info, target) for target, info in targets.items()]
+
+
+def _extract(infile, members, buffer_size):
+    """
+    Udpakker en gruppe filer med sin egen `ZipFile` og sætter ændringstidspunktet fra zip-filen.
+    """
+    with ZipFile(infile) as zObject:
+        for info, target in members:
+            # zlib reserverer hele bufferen ved hver læsning, og store bufferes allokering koster mere, end de
+            # sparer på små filer, så kun filer større end bufferen kopieres med den
+            length = buffer_size if info.file_size > buffer_size else SMALL_BUFFER_SIZE
+            with zObject.open(info) as source, open(target, 'wb') as dest:
+                shutil.copyfileobj(source, dest, length)
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(target, (mtime, mtime))
+
+
+if __name__ == "__main__":
+    # Benchmark: den tidligere implementering mod den nye serielt og parallelt på et syntetisk arkiv,
+    # der ligner en leverance med mange shapefil- og GML-dele
+    import random
+    import tempfile
+    import zipfile
+
+    def unpack_old(infile, outfolder):
         with ZipFile(infile) as zObject:
             for member in zObject.namelist():
                 filename = os.path.basename(member)
@@ -37,4 +137,32 @@ def unpack(infile, outfolder, structure=False):
                 target = open(os.path.join(outfolder, filename), 'wb')
                 with source, target:
                     shutil.copyfileobj(source, target)
-    
\ No newline at end of file
+
+    rnd = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = os.path.join(tmp, 'levering.zip')
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for i in range(2000):
+                ext = rnd.choice(['.shp', '.dbf', '.shx', '.prj', '.gml'])
+                size = rnd.choice([1_000, 50_000, 500_000]) if ext != '.prj' else 400
+                # Halvt tilfældige data, så komprimeringen ligner rigtige geodata
+                data = os.urandom(size // 2) + bytes(size - size // 2)
+                zf.writestr(f'tile_{i // 5:04d}/part_{i}{ext}', data)
+        print(f'Arkiv: {os.path.getsize(archive) / 1024 ** 2:.0f} MB, 2000 filer, {os.cpu_count()} CPU')
+
+        def run(label, func, repeat=3):
+            # Bedste af flere kørsler, da oprettelsen af filerne svinger meget med filsystemets cache
+            best = float('inf')
+            for _ in range(repeat):
+                out = tempfile.mkdtemp(dir=tmp)
+                start = time.perf_counter()
+                func(out)
+                best = min(best, time.perf_counter() - start)
+                shutil.rmtree(out)
+            print(f'{label:<28}: {best:.2f} s')
+
+        run('Tidligere implementering', lambda out: unpack_old(archive, out))
+        run('unpack, 1 tråd', lambda out: unpack(archive, out))
+        workers = min(8, (os.cpu_count() or 1) * 2)
+        run(f'unpack, {workers} tråde', lambda out: unpack(archive, out, workers=workers))
+        run(f'unpack, {workers} tråde, struktur', lambda out: unpack(archive, out, structure=True, workers=workers))